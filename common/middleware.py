@@ -0,0 +1,166 @@
+import logging
+import time
+import tracemalloc
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from common import routers
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+logger = logging.getLogger('common.profiling')
+
+
+class ReplicaMiddleware:
+    """
+    Sends the reads of safe requests to the replica database, unless the
+    client made a write in the last `REPLICA_PIN_SECONDS`, so it always sees
+    its own writes even if the replica lags behind.
+
+    The pin is a cookie set by every unsafe request, that expires by itself.
+    """
+    cookie_name = 'pin_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        replica = (
+            request.method in SAFE_METHODS and
+            self.cookie_name not in request.COOKIES
+        )
+        with routers.reads_from_replica(replica):
+            response = self.get_response(request)
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(
+                self.cookie_name,
+                '1',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True
+            )
+        return response
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class Profile:
+    """
+    What a request spent: the queries it ran and their time (as an
+    `execute_wrapper` of every database connection), and the time its
+    template took to render.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.render_started = None
+        self.render_seconds = 0.0
+        self.query_budget = getattr(settings, 'PROFILING_QUERY_BUDGET', None)
+        self.view = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.sql_seconds += time.perf_counter() - started
+
+    def rendered(self, response):
+        self.render_seconds = time.perf_counter() - self.render_started
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in middleware measuring, for every request, the number of queries
+    and their total time, the template render time and, with
+    `PROFILING_MEMORY`, the peak of memory allocated. They're sent back in a
+    `Server-Timing` header (shown by the browser's developer tools) and
+    logged to `common.profiling`, with the measures as `extra` fields.
+
+    Requests running more queries than the `query_budget` of their view
+    class, or the `PROFILING_QUERY_BUDGET`, log a warning, or raise
+    `QueryBudgetExceeded` with `PROFILING_RAISE_OVER_BUDGET`, which fails
+    the tests doing them.
+
+    It goes first in `MIDDLEWARE`, so the queries of the other middleware
+    (sessions, authentication) are counted too. Queries run while a
+    streaming response is consumed aren't.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.memory = getattr(settings, 'PROFILING_MEMORY', False)
+
+    def __call__(self, request):
+        profile = request.profile = Profile()
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            # reset_peak() is only there since Python 3.9.
+            getattr(tracemalloc, 'reset_peak', tracemalloc.clear_traces)()
+
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(profile)
+                )
+            response = self.get_response(request)
+
+        total_seconds = time.perf_counter() - profile.started
+        measures = {
+            'method': request.method,
+            'path': request.path,
+            'view': profile.view,
+            'status': response.status_code,
+            'queries': profile.queries,
+            'sql_ms': round(profile.sql_seconds * 1000, 1),
+            'render_ms': round(profile.render_seconds * 1000, 1),
+            'total_ms': round(total_seconds * 1000, 1)
+        }
+        timings = [
+            'sql;dur=%.1f;desc="%d queries"' % (
+                measures['sql_ms'], profile.queries
+            ),
+            'render;dur=%.1f' % measures['render_ms'],
+            'total;dur=%.1f' % measures['total_ms']
+        ]
+        if self.memory:
+            measures['peak_kib'] = tracemalloc.get_traced_memory()[1] // 1024
+            timings.append('mem;desc="%d KiB peak"' % measures['peak_kib'])
+        response['Server-Timing'] = ', '.join(timings)
+        logger.info(
+            ' '.join('%s=%s' % item for item in measures.items()),
+            extra=measures
+        )
+
+        budget = profile.query_budget
+        if budget is not None and profile.queries > budget:
+            message = '%s %s ran %d queries, over its budget of %d.' % (
+                request.method, request.path, profile.queries, budget
+            )
+            if getattr(settings, 'PROFILING_RAISE_OVER_BUDGET', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message, extra=measures)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view = getattr(view_func, 'view_class', view_func)
+        request.profile.view = '%s.%s' % (
+            view.__module__, getattr(view, '__name__', type(view).__name__)
+        )
+        budget = getattr(view, 'query_budget', None)
+        if budget is not None:
+            request.profile.query_budget = budget
+
+    def process_template_response(self, request, response):
+        # The response is rendered right after the last middleware returns
+        # it.
+        request.profile.render_started = time.perf_counter()
+        response.add_post_render_callback(request.profile.rendered)
+        return response
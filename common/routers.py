@@ -0,0 +1,56 @@
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+REPLICA = 'replica'
+
+_state = threading.local()
+
+
+@contextmanager
+def reads_from_replica(replica=True):
+    """
+    Sends the reads done inside to the `replica` database, if configured, or
+    back to the primary one with `replica=False`.
+    """
+    previous = getattr(_state, 'replica', False)
+    _state.replica = replica
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+def reads_from_primary():
+    """
+    Sends the reads done inside to the primary database, for code that has to
+    read what it just wrote.
+    """
+    return reads_from_replica(False)
+
+
+class ReplicaRouter:
+    """
+    Reads from the `replica` database inside `reads_from_replica` (see
+    `ReplicaMiddleware`), and from the primary one everywhere else, so
+    postings, tasks and commands always see their own writes. Writes and
+    migrations always go to the primary database.
+    """
+
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'replica', False) and REPLICA in settings.DATABASES:
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica is a copy of the primary database.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == REPLICA:
+            return False
+        return None
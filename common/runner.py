@@ -0,0 +1,14 @@
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Test runner failing the requests of the tests that go over their query
+    budget (see `common.middleware.ProfilingMiddleware`), which are only
+    logged while developing.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.PROFILING_RAISE_OVER_BUDGET = True
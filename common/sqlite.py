@@ -0,0 +1,33 @@
+from django.conf import settings
+
+
+def set_pragmas(sender, connection, **kwargs):
+    """
+    `connection_created` receiver setting the `SQLITE_PRAGMAS` on every new
+    SQLite connection.
+
+    Pragmas like `synchronous`, `cache_size` or `busy_timeout` only last as
+    long as the connection, so they have to be set every time one is opened.
+    `busy_timeout` is set first, so the other ones wait for the lock too.
+
+    The journal mode is stored in the database file instead, and changing it
+    fails while other connections are open, so it's only set when it
+    differs.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = dict(getattr(settings, 'SQLITE_PRAGMAS', {}))
+    if not pragmas:
+        return
+    journal_mode = pragmas.pop('journal_mode', None)
+    names = sorted(pragmas, key=lambda name: name != 'busy_timeout')
+    with connection.cursor() as cursor:
+        for name in names:
+            cursor.execute('PRAGMA %s = %s' % (name, pragmas[name]))
+        # A read-only connection (mode=ro) can't change it.
+        if journal_mode is not None and 'mode=ro' not in str(
+            connection.settings_dict['NAME']
+        ):
+            cursor.execute('PRAGMA journal_mode')
+            if cursor.fetchone()[0] != str(journal_mode).lower():
+                cursor.execute('PRAGMA journal_mode = %s' % journal_mode)
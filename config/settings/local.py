@@ -0,0 +1,52 @@
+from .base import *  # noqa
+from .base import env
+
+# GENERAL
+# ------------------------------------------------------------------------------
+# https://docs.djangoproject.com/en/dev/ref/settings/#debug
+DEBUG = env.bool('DJANGO_DEBUG', default=True)
+# https://docs.djangoproject.com/en/dev/ref/settings/#secret-key
+SECRET_KEY = env('DJANGO_SECRET_KEY', default='Use-A-Super-Secret-Key-Here-For-Production')
+# https://docs.djangoproject.com/en/dev/ref/settings/#allowed-hosts
+ALLOWED_HOSTS = [
+    "localhost",
+    "0.0.0.0",
+    "127.0.0.1",
+    "192.168.99.100"
+]
+
+# CACHES
+# ------------------------------------------------------------------------------
+# https://docs.djangoproject.com/en/dev/ref/settings/#caches
+# Lodge pages are cached until the lodge's version changes. The locmem cache
+# is per process; share one between workers with filecache:///path/ or
+# rediscache://host:6379/1 (needs django-redis).
+CACHES = {
+    'default': env.cache('DJANGO_CACHE_URL', default='locmemcache://')
+}
+
+# TEMPLATES
+# ------------------------------------------------------------------------------
+# https://docs.djangoproject.com/en/dev/ref/settings/#templates
+TEMPLATES[0]['OPTIONS']['debug'] = DEBUG  # noqa F405
+
+# EMAIL
+# ------------------------------------------------------------------------------
+# https://docs.djangoproject.com/en/dev/ref/settings/#email-backend
+EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# CELERY
+# ------------------------------------------------------------------------------
+# http://docs.celeryproject.org/en/latest/userguide/configuration.html#task-always-eager
+CELERY_TASK_ALWAYS_EAGER = env.bool('CELERY_TASK_ALWAYS_EAGER', default=True)
+
+# PROFILING
+# ------------------------------------------------------------------------------
+MIDDLEWARE = ['common.middleware.ProfilingMiddleware'] + MIDDLEWARE  # noqa F405
+# Views going over it log a warning, and fail the tests, whose runner
+# raises instead.
+PROFILING_QUERY_BUDGET = 60
+TEST_RUNNER = 'common.runner.TestRunner'
+
+# Your stuff...
+# ------------------------------------------------------------------------------
@@ -2,7 +2,6 @@ from allauth.account import views as allauth
 from django.conf import settings
 from django.conf.urls import include
 from django.urls import path
-from django.conf.urls.static import static
 from django.contrib import admin
 from django.views import defaults as default_views
 from hijos.users.views import LodgesList
@@ -41,7 +40,7 @@ urlpatterns = [
     path('email/', allauth.email, name='account_email'),
 
     path('treasure/', include('hijos.treasure.urls', namespace='treasure')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
 
 if settings.DEBUG:
     # This allows the error pages to be debugged during development, just visit
@@ -21,6 +21,14 @@ app.conf.beat_schedule = {
     'say-hello': {
         'task': 'say_hello',
         'schedule': crontab(minute='*', hour='*')
+    },
+    'refresh-debt-summaries': {
+        'task': 'treasure.refresh_debt_summaries',
+        'schedule': crontab(minute=0, hour=3)
+    },
+    'take-balance-checkpoints': {
+        'task': 'treasure.take_balance_checkpoints',
+        'schedule': crontab(minute=30, hour=2)
     }
 }
 
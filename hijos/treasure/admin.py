@@ -38,6 +38,16 @@ class PeriodAdmin(admin.ModelAdmin):
     pass
 
 
+@admin.register(models.PeriodInvoicingJob)
+class PeriodInvoicingJobAdmin(admin.ModelAdmin):
+    pass
+
+
+@admin.register(models.BalanceMailingJob)
+class BalanceMailingJobAdmin(admin.ModelAdmin):
+    pass
+
+
 @admin.register(models.Invoice)
 class InvoiceAdmin(admin.ModelAdmin):
     pass
@@ -0,0 +1,171 @@
+from array import array
+from collections import deque, namedtuple
+from datetime import date
+from decimal import Decimal
+
+from django.utils import timezone
+
+from hijos.treasure import models, rollups
+
+# The debt of an account: `buckets` are the amounts still owed from its
+# invoices and charges, by `rollups.AGING_BUCKETS` range of age, and `oldest`
+# the day of the oldest one.
+AgedDebt = namedtuple(
+    'AgedDebt', ['account_id', 'balance', 'debt', 'buckets', 'oldest']
+)
+
+
+def cents(value):
+    return Decimal(value).scaleb(-2)
+
+
+def read_movements(lodge_id, chunk_size=5000):
+    """
+    Returns the account, day (ordinal) and amount (in cents) of every active
+    movement of the accounts of a lodge, in three arrays sorted by account
+    and posting order.
+
+    Rows are streamed into typed arrays, so a lodge's history takes a few
+    bytes per movement instead of a model instance (or a tuple) each. Days
+    are converted once per distinct instant, since batches (like a period's
+    invoices) share theirs.
+    """
+    movements = models.AccountMovement.objects.filter(
+        account__affiliation__lodge=lodge_id,
+        is_active=True
+    ).order_by('account', 'created_on', 'id')
+    accounts = array('q')
+    days = array('l')
+    amounts = array('q')
+    days_by_instant = {}
+    for account_id, created_on, amount in movements.values_list(
+        'account_id', 'created_on', 'amount'
+    ).iterator(chunk_size=chunk_size):
+        day = days_by_instant.get(created_on)
+        if day is None:
+            day = days_by_instant[created_on] = timezone.localdate(
+                created_on
+            ).toordinal()
+        accounts.append(account_id)
+        days.append(day)
+        amounts.append(int(amount * 100))
+    return accounts, days, amounts
+
+
+def age(account_id, balance, debts, today):
+    """
+    Returns the `AgedDebt` of the `[day, cents]` still owed by an account.
+    """
+    buckets = [0] * len(rollups.AGING_BUCKETS)
+    for day, owed in debts:
+        days = today - day
+        for i, (name, days_from, days_until) in enumerate(
+            rollups.AGING_BUCKETS
+        ):
+            if days_until is None or days <= days_until:
+                buckets[i] += owed
+                break
+    return AgedDebt(
+        account_id,
+        cents(balance),
+        cents(sum(buckets)),
+        [cents(bucket) for bucket in buckets],
+        date.fromordinal(debts[0][0])
+    )
+
+
+def allocate(accounts, days, amounts, today):
+    """
+    Allocates, account by account, every credit (deposits) to the oldest
+    debits (invoices and charges) still owed, first in first out, and
+    returns the `AgedDebt` of every account that still owes some.
+
+    It's a single pass over the arrays of `read_movements`. Credits beyond
+    what's owed are kept and settle the next debits.
+    """
+    today = today.toordinal()
+    aged = []
+    account_id = None
+    debts = deque()
+    balance = credit = 0
+    for movement_account_id, day, amount in zip(accounts, days, amounts):
+        if movement_account_id != account_id:
+            if debts:
+                aged.append(age(account_id, balance, debts, today))
+            account_id = movement_account_id
+            debts = deque()
+            balance = credit = 0
+        balance += amount
+        if amount < 0:
+            owed = -amount
+            if credit:
+                settled = min(credit, owed)
+                credit -= settled
+                owed -= settled
+            if owed:
+                debts.append([day, owed])
+        else:
+            while amount and debts:
+                debt = debts[0]
+                if debt[1] <= amount:
+                    amount -= debt[1]
+                    debts.popleft()
+                else:
+                    debt[1] -= amount
+                    amount = 0
+            credit += amount
+    if debts:
+        aged.append(age(account_id, balance, debts, today))
+    return aged
+
+
+def aging_report(lodge, today=None):
+    """
+    Returns the `(aged debt, affiliation)` of the accounts of a lodge that
+    owe, oldest debt first, and their totals. Affiliations are dicts of
+    their `id`, `last_name` and `first_name`.
+    """
+    today = today or timezone.localdate()
+    aged = allocate(*read_movements(lodge.pk), today)
+    affiliations = {
+        account_id: {
+            'id': affiliation_id,
+            'last_name': last_name,
+            'first_name': first_name
+        }
+        for account_id, affiliation_id, last_name, first_name in (
+            models.Account.objects.filter(
+                affiliation__lodge=lodge
+            ).values_list(
+                'id',
+                'affiliation_id',
+                'affiliation__user__last_name',
+                'affiliation__user__first_name'
+            )
+        )
+    }
+    aged.sort(key=lambda debt: (debt.oldest, debt.account_id))
+    totals = {
+        'debt': sum((debt.debt for debt in aged), Decimal('0.00')),
+        'buckets': [
+            sum((debt.buckets[i] for debt in aged), Decimal('0.00'))
+            for i in range(len(rollups.AGING_BUCKETS))
+        ]
+    }
+    return [(debt, affiliations[debt.account_id]) for debt in aged], totals
+
+
+def export_rows(rows):
+    """
+    Yields the `exports.AGING_COLUMNS` of every row of an `aging_report`.
+    """
+    for debt, affiliation in rows:
+        yield [
+            affiliation['id'],
+            affiliation['last_name'],
+            affiliation['first_name'],
+            debt.balance,
+            debt.debt,
+            *debt.buckets,
+            debt.oldest
+        ]
@@ -0,0 +1,425 @@
+import hashlib
+import json
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models as db
+from django.db.models import Q
+from django.db.models.fields.files import FieldFile
+from django.forms import modelform_factory
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.translation import ugettext_lazy as _
+from django.views import View
+
+from hijos.treasure import forms, models
+from hijos.treasure.pagination import keyset_paginate
+
+MAX_PAGE_SIZE = 200
+
+
+class Resource:
+    """
+    Describes how a model is exposed by the JSON API.
+
+    `fields` are `(name, attribute path, select_related path)` tuples: the
+    value is read by following the dotted attribute path from every object,
+    and the related path (if any) is joined only when the field is asked
+    for, so sparse fieldsets also narrow the query.
+    """
+    model = None
+    fields = ()
+    lodge_lookup = None
+    account_lookup = None
+    # Fields of the form creating an object, or None if it's read-only.
+    form_fields = None
+    ordering = ('-created_on', '-id')
+
+    def __init__(self, names=None):
+        self.selected = [
+            spec for spec in self.fields
+            if names is None or spec[0] == 'id' or spec[0] in names
+        ]
+
+    @classmethod
+    def field_names(cls):
+        return [name for name, path, related in cls.fields]
+
+    def get_queryset(self):
+        queryset = self.model.objects.all()
+        related = {
+            related for name, path, related in self.selected if related
+        }
+        # Without arguments, select_related() would follow every foreign key.
+        if related:
+            queryset = queryset.select_related(*related)
+        return queryset
+
+    def filter(self, queryset, form):
+        return form.filter_by(queryset, self.lodge_lookup, self.account_lookup)
+
+    def serialize(self, obj):
+        data = {}
+        for name, path, related in self.selected:
+            value = obj
+            for attr in path.split('.'):
+                value = getattr(value, attr)
+                if value is None:
+                    break
+            if callable(value):
+                value = value()
+            if isinstance(value, FieldFile):
+                value = value.url if value else None
+            elif isinstance(value, db.Model):
+                value = str(value)
+            data[name] = value
+        return data
+
+
+AUDIT_FIELDS = (
+    ('id', 'pk', None),
+    ('is_active', 'is_active', None),
+    ('created_on', 'created_on', None),
+    ('last_modified_on', 'last_modified_on', None)
+)
+
+
+class InvoiceResource(Resource):
+    model = models.Invoice
+    fields = AUDIT_FIELDS + (
+        ('period', 'period_id', None),
+        ('period_begin', 'period.begin', 'period'),
+        ('period_end', 'period.end', 'period'),
+        ('affiliation', 'affiliation_id', None),
+        ('member', 'affiliation.user', 'affiliation__user'),
+        ('amount', 'amount', None),
+        ('send_email', 'send_email', None)
+    )
+    lodge_lookup = 'period__lodge'
+    account_lookup = 'affiliation'
+    form_fields = ['period', 'affiliation', 'amount', 'send_email']
+
+
+class DepositResource(Resource):
+    model = models.Deposit
+    fields = AUDIT_FIELDS + (
+        ('payer', 'payer_id', None),
+        ('member', 'payer.user', 'payer__user'),
+        ('lodge_account', 'lodge_account_id', None),
+        ('amount', 'amount', None),
+        ('description', 'description', None),
+        ('receipt', 'receipt', None),
+        ('send_email', 'send_email', None)
+    )
+    lodge_lookup = 'payer__lodge'
+    account_lookup = 'payer'
+    form_fields = [
+        'payer',
+        'lodge_account',
+        'amount',
+        'description',
+        'send_email',
+        'receipt'
+    ]
+
+
+class ChargeResource(Resource):
+    model = models.Charge
+    fields = AUDIT_FIELDS + (
+        ('debtor', 'debtor_id', None),
+        ('member', 'debtor.user', 'debtor__user'),
+        ('charge_type', 'charge_type', None),
+        ('amount', 'amount', None),
+        ('description', 'description', None),
+        ('send_email', 'send_email', None)
+    )
+    lodge_lookup = 'debtor__lodge'
+    account_lookup = 'debtor'
+    form_fields = [
+        'debtor',
+        'charge_type',
+        'amount',
+        'description',
+        'send_email'
+    ]
+
+
+class GrandLodgeDepositResource(Resource):
+    model = models.GrandLodgeDeposit
+    fields = AUDIT_FIELDS + (
+        ('payer', 'payer_id', None),
+        ('member', 'payer.user', 'payer__user'),
+        ('amount', 'amount', None),
+        ('description', 'description', None),
+        ('receipt', 'receipt', None),
+        ('status', 'status', None),
+        ('send_email', 'send_email', None)
+    )
+    lodge_lookup = 'payer__lodge'
+    account_lookup = 'payer'
+    form_fields = [
+        'payer',
+        'amount',
+        'description',
+        'receipt',
+        'send_email'
+    ]
+
+
+class LodgeAccountIngressResource(Resource):
+    model = models.LodgeAccountIngress
+    fields = AUDIT_FIELDS + (
+        ('lodge_account', 'lodge_account_id', None),
+        (
+            'handler',
+            'lodge_account.handler.user',
+            'lodge_account__handler__user'
+        ),
+        ('ingress_type', 'ingress_type', None),
+        ('amount', 'amount', None),
+        ('description', 'description', None),
+        ('receipt', 'receipt', None)
+    )
+    lodge_lookup = 'lodge_account__handler__lodge'
+    account_lookup = 'lodge_account'
+    form_fields = [
+        'lodge_account',
+        'ingress_type',
+        'amount',
+        'description',
+        'receipt'
+    ]
+
+
+class LodgeAccountEgressResource(Resource):
+    model = models.LodgeAccountEgress
+    fields = AUDIT_FIELDS + (
+        ('lodge_account', 'lodge_account_id', None),
+        (
+            'handler',
+            'lodge_account.handler.user',
+            'lodge_account__handler__user'
+        ),
+        ('egress_type', 'egress_type', None),
+        ('amount', 'amount', None),
+        ('description', 'description', None),
+        ('receipt', 'receipt', None)
+    )
+    lodge_lookup = 'lodge_account__handler__lodge'
+    account_lookup = 'lodge_account'
+    form_fields = [
+        'lodge_account',
+        'egress_type',
+        'amount',
+        'description',
+        'receipt'
+    ]
+
+
+class LodgeAccountTransferResource(Resource):
+    model = models.LodgeAccountTransfer
+    fields = AUDIT_FIELDS + (
+        ('lodge_account_from', 'lodge_account_from_id', None),
+        ('lodge_account_to', 'lodge_account_to_id', None),
+        ('amount', 'amount', None),
+        ('description', 'description', None)
+    )
+    form_fields = [
+        'lodge_account_from',
+        'lodge_account_to',
+        'amount',
+        'description'
+    ]
+
+    def filter(self, queryset, form):
+        # Transfers belong to the lodges of both of their accounts.
+        queryset = form.filter(queryset)
+        lodge = form.cleaned_data['lodge']
+        if lodge:
+            queryset = queryset.filter(
+                Q(lodge_account_from__handler__lodge=lodge) |
+                Q(lodge_account_to__handler__lodge=lodge)
+            )
+        account = form.cleaned_data['account']
+        if account:
+            queryset = queryset.filter(
+                Q(lodge_account_from=account) | Q(lodge_account_to=account)
+            )
+        return queryset
+
+
+class AccountResource(Resource):
+    model = models.Account
+    fields = AUDIT_FIELDS + (
+        ('affiliation', 'affiliation_id', None),
+        ('lodge', 'affiliation.lodge_id', 'affiliation'),
+        ('member', 'affiliation.user', 'affiliation__user'),
+        ('balance', 'balance', None),
+        ('debt_since', 'debt_since', None)
+    )
+    lodge_lookup = 'affiliation__lodge'
+    account_lookup = 'affiliation'
+
+
+class AccountMovementResource(Resource):
+    model = models.AccountMovement
+    fields = AUDIT_FIELDS + (
+        ('account', 'account_id', None),
+        ('account_movement_type', 'account_movement_type', None),
+        ('amount', 'amount', None),
+        ('balance', 'balance', None),
+        ('document_type', 'object_ct.model', 'object_ct'),
+        ('document', 'object_id', None)
+    )
+    lodge_lookup = 'account__affiliation__lodge'
+    account_lookup = 'account__affiliation'
+
+
+class LodgeAccountMovementResource(Resource):
+    model = models.LodgeAccountMovement
+    fields = AUDIT_FIELDS + (
+        ('lodge_account', 'lodge_account_id', None),
+        ('lodgeaccount_movement_type', 'lodgeaccount_movement_type', None),
+        ('amount', 'amount', None),
+        ('balance', 'balance', None),
+        ('document_type', 'object_ct.model', 'object_ct'),
+        ('document', 'object_id', None)
+    )
+    lodge_lookup = 'lodge_account__handler__lodge'
+    account_lookup = 'lodge_account'
+
+
+def error_response(message, status, **extra):
+    return JsonResponse(dict(extra, error=str(message)), status=status)
+
+
+def conditional_response(request, data):
+    """
+    Returns the JSON of `data` with an ETag of its content, or an empty 304
+    if the client already has it (`If-None-Match`), so polling clients don't
+    download unchanged data again.
+
+    There's no Last-Modified: balances are also changed by updates that
+    don't touch `last_modified_on` (running balances rewritten, ledger
+    fixes) and deleted rows leave no date, so only the content can tell.
+    """
+    content = json.dumps(data, cls=DjangoJSONEncoder).encode()
+    etag = quote_etag(hashlib.md5(content).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    # Clients may keep it, but have to check it's still fresh every time.
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+class ResourceMixin:
+    """
+    Answers 401 instead of redirecting to the login page, and builds the
+    resource with the fields selected by the `fields` GET parameter.
+    """
+    resource = None
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return error_response(_("Authentication required."), 401)
+        names = request.GET.get('fields')
+        if names:
+            names = set(names.split(','))
+            unknown = names - set(self.resource.field_names())
+            if unknown:
+                return error_response(
+                    _("Unknown fields: %s.") % ', '.join(sorted(unknown)), 400
+                )
+        self.api = self.resource(names or None)
+        return super().dispatch(request, *args, **kwargs)
+
+
+class ResourceListView(ResourceMixin, View):
+    """
+    Lists the objects of a resource, newest first, with keyset pagination:
+    a page has at most `limit` objects and the `next` cursor goes to the
+    `cursor` GET parameter of the following one. They can be filtered by the
+    `lodge`, `account`, `date_from` and `date_until` GET parameters.
+
+    POST creates an object, from a JSON body or a multipart form.
+    """
+    per_page = 50
+
+    def get(self, request, *args, **kwargs):
+        form = forms.LedgerExportForm(request.GET)
+        if not form.is_valid():
+            return error_response(
+                _("Invalid filters."), 400, errors=form.errors.get_json_data()
+            )
+        try:
+            per_page = min(
+                int(request.GET.get('limit', self.per_page)), MAX_PAGE_SIZE
+            )
+        except ValueError:
+            return error_response(_("Invalid limit."), 400)
+        try:
+            page = keyset_paginate(
+                self.api.filter(self.api.get_queryset(), form),
+                self.api.ordering,
+                request.GET.get('cursor'),
+                max(per_page, 1)
+            )
+        except ValueError:
+            return error_response(_("Invalid cursor."), 400)
+        return conditional_response(
+            request,
+            {
+                'results': [self.api.serialize(obj) for obj in page],
+                'next': page.next_cursor
+            }
+        )
+
+    def post(self, request, *args, **kwargs):
+        if self.api.form_fields is None:
+            return error_response(_("Method not allowed."), 405)
+        if request.content_type == 'application/json':
+            try:
+                data, files = json.loads(request.body), None
+            except ValueError:
+                return error_response(_("Invalid JSON."), 400)
+        else:
+            data, files = request.POST, request.FILES
+        form = modelform_factory(
+            self.api.model, fields=self.api.form_fields
+        )(data, files)
+        if not form.is_valid():
+            return error_response(
+                _("Invalid data."), 400, errors=form.errors.get_json_data()
+            )
+        form.instance.created_by = request.user
+        form.instance.last_modified_by = request.user
+        obj = form.save()
+        # Read again, with the related objects of the selected fields.
+        obj = self.api.get_queryset().get(pk=obj.pk)
+        return JsonResponse(self.api.serialize(obj), status=201)
+
+
+class ResourceDetailView(ResourceMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        try:
+            obj = self.api.get_queryset().get(pk=kwargs['pk'])
+        except ObjectDoesNotExist:
+            return error_response(_("Not found."), 404)
+        return conditional_response(request, self.api.serialize(obj))
+
+
+RESOURCES = (
+    ('invoices', InvoiceResource),
+    ('deposits', DepositResource),
+    ('charges', ChargeResource),
+    ('grandlodgedeposits', GrandLodgeDepositResource),
+    ('lodgeaccountingresses', LodgeAccountIngressResource),
+    ('lodgeaccountegresses', LodgeAccountEgressResource),
+    ('lodgeaccounttransfers', LodgeAccountTransferResource),
+    ('accounts', AccountResource),
+    ('accountmovements', AccountMovementResource),
+    ('lodgeaccountmovements', LodgeAccountMovementResource)
+)
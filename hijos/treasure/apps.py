@@ -1,5 +1,5 @@
 from django.apps import AppConfig
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.utils.translation import ugettext_lazy as _
 
 
@@ -78,3 +78,14 @@ class TreasureConfig(AppConfig):
             ),
             weak=False
         )
+        for model in signals.LODGE_LOOKUPS:
+            for signal in (post_save, post_delete):
+                signal.connect(
+                    receiver=signals.lodge_version,
+                    sender=model,
+                    dispatch_uid='Treasure_%s_BumpLodgeVersion%s' % (
+                        model.__name__,
+                        'OnDelete' if signal is post_delete else ''
+                    ),
+                    weak=False
+                )
@@ -0,0 +1,208 @@
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, Exists, F, Max, Min, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from hijos.treasure import models
+
+ZERO = Decimal('0.00')
+BALANCE_FIELD = DecimalField(max_digits=15, decimal_places=2)
+
+# Checkpointed account model: (checkpoint model, movement model, field
+# pointing to the account from both).
+LEDGERS = {
+    models.Account: (
+        models.AccountBalanceCheckpoint,
+        models.AccountMovement,
+        'account'
+    ),
+    models.LodgeAccount: (
+        models.LodgeAccountBalanceCheckpoint,
+        models.LodgeAccountMovement,
+        'lodge_account'
+    )
+}
+
+
+def day_end(day):
+    """
+    Returns the (aware) instant a day ends, in the current time zone.
+    """
+    return timezone.make_aware(
+        datetime.combine(day + timedelta(days=1), time.min)
+    )
+
+
+def last_month_end(today=None):
+    today = today or timezone.localdate()
+    return today.replace(day=1) - timedelta(days=1)
+
+
+def month_ends(first, last):
+    """
+    Returns the last day of every month from the one of `first` up to the
+    day `last`, oldest first.
+    """
+    days = []
+    month = first.replace(day=1)
+    while True:
+        month = (month + timedelta(days=32)).replace(day=1)
+        day = month - timedelta(days=1)
+        if day > last:
+            return days
+        days.append(day)
+
+
+def missing_month_ends(account_model, today=None):
+    """
+    Returns the month ends, up to the last one, that haven't been
+    checkpointed yet: the ones since the month of the first movement made
+    after the latest checkpoint (or at all, if there's none). Months without
+    movements have nothing to checkpoint.
+    """
+    checkpoint_model, movement_model, field = LEDGERS[account_model]
+    movements = movement_model.objects.all()
+    latest = checkpoint_model.objects.aggregate(latest=Max('date'))['latest']
+    if latest is not None:
+        movements = movements.filter(created_on__gte=day_end(latest))
+    first = movements.aggregate(first=Min('created_on'))['first']
+    if first is None:
+        return []
+    return month_ends(timezone.localdate(first), last_month_end(today))
+
+
+def catch_up(account_model, today=None):
+    """
+    Takes the checkpoints of every month end missing (see
+    `missing_month_ends`), oldest first, and returns how many checkpoints
+    and month ends were taken.
+
+    Run once on a history without checkpoints, it backfills them all; run
+    daily, it takes last month's ones, and those of any month a run missed.
+    Every month is taken in its own transaction, so an interrupted run
+    resumes from the last month it finished.
+    """
+    days = missing_month_ends(account_model, today)
+    return sum(take_checkpoints(account_model, day) for day in days), len(days)
+
+
+def movements_sum(movements, field, since):
+    """
+    Returns a subquery of the sum of the active `movements` of the outer
+    account made from the `since` instant on.
+    """
+    movements = movements.filter(
+        **{field: OuterRef('pk')},
+        is_active=True,
+        created_on__gte=since
+    )
+    return Coalesce(
+        Subquery(
+            movements.order_by().values(field).annotate(
+                total=Sum('amount')
+            ).values('total'),
+            output_field=BALANCE_FIELD
+        ),
+        Value(ZERO)
+    )
+
+
+def take_checkpoints(account_model, day):
+    """
+    Saves the balance at the end of `day` of every account with active
+    movements made that month, and returns how many.
+
+    The balance is the current one minus the movements made after the day,
+    read in the same query with the accounts locked, so a concurrent posting
+    either is already counted in both or waits. Checkpoints already taken are
+    left alone.
+    """
+    checkpoint_model, movement_model, field = LEDGERS[account_model]
+    end = day_end(day)
+    month_begin = timezone.make_aware(
+        datetime.combine(day.replace(day=1), time.min)
+    )
+    movements = movement_model.objects.all()
+    with transaction.atomic():
+        rows = account_model.objects.select_for_update().annotate(
+            moved=Exists(
+                movements.filter(
+                    **{field: OuterRef('pk')},
+                    is_active=True,
+                    created_on__gte=month_begin,
+                    created_on__lt=end
+                )
+            ),
+            later_total=movements_sum(movements, field, end)
+        ).filter(moved=True).values_list('pk', 'balance', 'later_total')
+        checkpoints = [
+            checkpoint_model(
+                **{field + '_id': pk},
+                date=day,
+                balance=balance - later_total
+            )
+            for pk, balance, later_total in rows
+        ]
+        checkpoint_model.objects.bulk_create(
+            checkpoints, batch_size=500, ignore_conflicts=True
+        )
+    return len(checkpoints)
+
+
+def shift_checkpoints(account_model, changes, batch_size=300):
+    """
+    Given the `(account id, movement instant, amount)` of movements just
+    activated (or deactivated, with the amount negated), adds the amounts to
+    the checkpoints taken after the movements were made.
+    """
+    checkpoint_model, movement_model, field = LEDGERS[account_model]
+    by_day = defaultdict(lambda: defaultdict(int))
+    for account_id, created_on, amount in changes:
+        by_day[timezone.localdate(created_on)][account_id] += amount
+    for day, deltas in by_day.items():
+        account_ids = list(deltas)
+        for i in range(0, len(account_ids), batch_size):
+            chunk = account_ids[i:i + batch_size]
+            checkpoint_model.objects.filter(
+                **{field + '__in': chunk},
+                date__gte=day
+            ).update(
+                balance=F('balance') + Case(
+                    *[
+                        When(
+                            **{field: account_id},
+                            then=Value(deltas[account_id])
+                        )
+                        for account_id in chunk
+                    ],
+                    output_field=BALANCE_FIELD
+                )
+            )
+
+
+def balance_as_of(account, day):
+    """
+    Returns the balance of an account (or lodge account) at the end of `day`,
+    from the last checkpoint taken up to then plus the active movements made
+    since, at most the ones of a month.
+    """
+    checkpoint_model, movement_model, field = LEDGERS[type(account)]
+    checkpoint = checkpoint_model.objects.filter(
+        **{field: account},
+        date__lte=day
+    ).order_by('-date').values_list('date', 'balance').first()
+    movements = movement_model.objects.filter(
+        **{field: account},
+        is_active=True,
+        created_on__lt=day_end(day)
+    )
+    balance = ZERO
+    if checkpoint is not None:
+        checkpoint_day, balance = checkpoint
+        movements = movements.filter(created_on__gte=day_end(checkpoint_day))
+    total = movements.aggregate(total=Sum('amount'))['total']
+    return balance + (total or ZERO)
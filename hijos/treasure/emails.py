@@ -0,0 +1,105 @@
+from django.db.models import OuterRef, Prefetch, Subquery
+from django.template import loader
+from django.utils.safestring import mark_safe
+from django.utils.translation import ugettext as _
+
+from hijos.treasure import models
+
+LAST_MOVEMENTS = 10
+# Latest first, as in the ledgers, so ties are always in the same order.
+MOVEMENTS_ORDERING = ('-created_on', '-id')
+
+
+def last_movements_prefetch(lookup='account__movements'):
+    """
+    Returns a `Prefetch` of the last active movements of every account into
+    `last_movements`, fetched for all the accounts with a single query.
+    """
+    last_movements = models.AccountMovement.objects.filter(
+        account=OuterRef('account'),
+        is_active=True
+    ).order_by(*MOVEMENTS_ORDERING).values('pk')[:LAST_MOVEMENTS]
+    return Prefetch(
+        lookup,
+        queryset=models.AccountMovement.objects.filter(
+            pk__in=Subquery(last_movements)
+        ).order_by(*MOVEMENTS_ORDERING),
+        to_attr='last_movements'
+    )
+
+
+def greeting(user):
+    if user.most_worshipful:
+        text = _("Dear M.·.W.·.B.·. %(full_name)s:")
+    elif user.worshipful:
+        text = _("Dear W.·.B.·. %(full_name)s:")
+    elif user.past_master:
+        text = _("Dear P.·.M.·. %(full_name)s:")
+    else:
+        text = _("Dear B.·. %(full_name)s:")
+    return text % {'full_name': user.get_full_name()}
+
+
+def balance_email(account, title, content=None):
+    """
+    Returns the `(subject, text, html, from_email, recipient_list)` of the
+    email telling the account's balance and last movements, optionally with
+    some `content` first.
+
+    The account's affiliation should come with its user and lodge treasurer,
+    and its last movements with `last_movements_prefetch`, or they're
+    queried here.
+    """
+    affiliation = account.affiliation
+    movements = getattr(account, 'last_movements', None)
+    if movements is None:
+        movements = account.movements.filter(
+            is_active=True
+        ).order_by(*MOVEMENTS_ORDERING)[:LAST_MOVEMENTS]
+    types = {k: str(v) for k, v in models.ACCOUNT_MOVEMENT_TYPES}
+    unknown = _('Unknown')
+
+    context = {
+        'greeting': greeting(affiliation.user),
+        'content': content,
+        'balance': _(
+            "Your current account balance with %(lodge)s is of $ %(balance)s"
+        ) % {
+            'lodge': str(affiliation.lodge),
+            'balance': str(account.balance)
+        },
+        'movements_header': _(
+            "\n\nYour last 10 movements are:"
+            "\n\nDate\tType\t\tAmount\t\tBalance\n\n"
+        ),
+        'movements_header_html': mark_safe(_(
+            "<br><br>Your last 10 movements are:"
+            "<br><br>"
+            "<table>"
+            "<thead>"
+            "<tr>"
+            "<th>Date</th>"
+            "<th>Type</th>"
+            "<th>Amount</th>"
+            "<th>Balance</th>"
+            "</tr>"
+            "</thead>"
+            "<tbody>"
+        )),
+        'movements': [
+            (
+                str(m.created_on.date()),
+                types.get(m.account_movement_type, unknown),
+                str(m.amount),
+                str(m.balance)
+            )
+            for m in movements
+        ]
+    }
+    return (
+        title,
+        loader.get_template('treasure/emails/balance.txt').render(context),
+        loader.get_template('treasure/emails/balance.html').render(context),
+        affiliation.lodge.treasurer.email,
+        [affiliation.user.email],
+    )
@@ -0,0 +1,100 @@
+import csv
+from itertools import chain
+
+from django.http import StreamingHttpResponse
+from django.utils.translation import ugettext_lazy as _
+
+ACCOUNT_MOVEMENT_COLUMNS = (
+    (_('id'), 'id'),
+    (_('created on'), 'created_on'),
+    (_('lodge'), 'account__affiliation__lodge__name'),
+    (_('affiliation'), 'account__affiliation_id'),
+    (_('last name'), 'account__affiliation__user__last_name'),
+    (_('first name'), 'account__affiliation__user__first_name'),
+    (_('type'), 'account_movement_type'),
+    (_('amount'), 'amount'),
+    (_('balance'), 'balance'),
+    (_('active'), 'is_active'),
+    (_('document type'), 'object_ct__model'),
+    (_('document'), 'object_id')
+)
+
+LODGEACCOUNT_MOVEMENT_COLUMNS = (
+    (_('id'), 'id'),
+    (_('created on'), 'created_on'),
+    (_('lodge'), 'lodge_account__handler__lodge__name'),
+    (_('lodge account'), 'lodge_account_id'),
+    (_('last name'), 'lodge_account__handler__user__last_name'),
+    (_('first name'), 'lodge_account__handler__user__first_name'),
+    (_('type'), 'lodgeaccount_movement_type'),
+    (_('amount'), 'amount'),
+    (_('balance'), 'balance'),
+    (_('active'), 'is_active'),
+    (_('document type'), 'object_ct__model'),
+    (_('document'), 'object_id')
+)
+
+# Columns of `aging.export_rows`, the fields are only descriptive.
+AGING_COLUMNS = (
+    (_('affiliation'), 'affiliation_id'),
+    (_('last name'), 'last_name'),
+    (_('first name'), 'first_name'),
+    (_('balance'), 'balance'),
+    (_('debt'), 'debt'),
+    (_('0-30 days'), 'debt_0_30'),
+    (_('31-90 days'), 'debt_31_90'),
+    (_('91-180 days'), 'debt_91_180'),
+    (_('over 180 days'), 'debt_over_180'),
+    (_('oldest debt'), 'oldest')
+)
+
+
+class Echo:
+    """
+    Pseudo-buffer for `csv.writer`, which hands back every written line
+    instead of storing it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset, columns, chunk_size):
+    """
+    Yields the `columns` of every row of `queryset`, with choices replaced by
+    their display values.
+
+    Rows come from a server-side cursor with `iterator()` and as tuples with
+    `values_list()`, so neither the queryset cache nor model instances are
+    ever built and memory doesn't grow with the number of rows.
+    """
+    fields = [field for header, field in columns]
+    displays = {}
+    for i, field in enumerate(fields):
+        if '__' not in field:
+            choices = queryset.model._meta.get_field(field).flatchoices
+            if choices:
+                displays[i] = {k: str(v) for k, v in choices}
+
+    for row in queryset.values_list(*fields).iterator(chunk_size=chunk_size):
+        if displays:
+            row = list(row)
+            for i, choices in displays.items():
+                row[i] = choices.get(row[i], row[i])
+        yield row
+
+
+def stream_csv(filename, columns, rows):
+    """
+    Returns a `StreamingHttpResponse` writing `rows` as a CSV attachment.
+    """
+    writer = csv.writer(Echo())
+    response = StreamingHttpResponse(
+        chain(
+            [writer.writerow([str(header) for header, field in columns])],
+            (writer.writerow(row) for row in rows)
+        ),
+        content_type='text/csv'
+    )
+    response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
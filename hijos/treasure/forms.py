@@ -1,12 +1,17 @@
-from common.mail import send_mass_html_mail
+import os
+import uuid
+
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.forms import Form
+from django.core.exceptions import ValidationError
+from django.core.validators import RegexValidator
+from django.forms import CharField, DateField, FileField, Form, HiddenInput, IntegerField, ModelChoiceField
+from django.http import HttpResponseRedirect
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
 from django.views.generic import FormView
 from django.views.generic.detail import SingleObjectMixin
 
-from hijos.treasure import models
+from hijos.treasure import imports, models, tasks
 from hijos.users.models import Affiliation, Lodge
 
 
@@ -18,106 +23,18 @@ class SendAccountBalanceForm(Form):
         }
         affiliation.account.send_treasure_mail(title)
 
-    def send_mass_email(self, lodge):
-        title = _("Your current account balance on %(lodge)s") % {
-            'lodge': str(lodge)
-        }
-
-        data_tuple = []
-        for affiliation in lodge.affiliations.filter(is_active=True).all():
-            if affiliation.user.most_worshipful:
-                body = _("Dear M.·.W.·.B.·. %(full_name)s:")
-            elif affiliation.user.worshipful:
-                body = _("Dear W.·.B.·. %(full_name)s:")
-            elif affiliation.user.past_master:
-                body = _("Dear P.·.M.·. %(full_name)s:")
-            else:
-                body = _("Dear B.·. %(full_name)s:")
-
-            body = body % {'full_name': affiliation.user.get_full_name()}
-            body_html = '<p>' + body + '</p>'
-            body += "\n\n\t"
-
-            account_balance = _(
-                "Your current account balance with %(lodge)s is of $ %(balance)s"
-            ) % {
-                'lodge': str(lodge),
-                'balance': str(affiliation.account.balance)
-            }
-            account_balance_html = (
-                "<p>&nbsp;&nbsp;&nbsp;&nbsp;" + account_balance + "</p>"
-            )
-
-            last_movements = (_(
-                "\n\nYour last 10 movements are:"
-                "\n\nDate\tType\t\tAmount\t\tBalance\n\n"
-            ))
-            last_movements_html = (_(
-                "<br><br>Your last 10 movements are:"
-                "<br><br>"
-                "<table>"
-                "<thead>"
-                "<tr>"
-                "<th>Date</th>"
-                "<th>Type</th>"
-                "<th>Amount</th>"
-                "<th>Balance</th>"
-                "</tr>"
-                "</thead>"
-                "<tbody>"
-            ))
-
-            account_movements = (
-                affiliation.account.movements.filter(is_active=True)[:10]
-            )
-            for m in account_movements.all():
-                if m.account_movement_type == models.ACCOUNTMOVEMENT_INVOICE:
-                    movement_type = _('Invoice')
-                elif m.account_movement_type == models.ACCOUNTMOVEMENT_DEPOSIT:
-                    movement_type = _('Deposit')
-                elif m.account_movement_type == (
-                    models.ACCOUNTMOVEMENT_GRANDLODGEDEPOSIT
-                ):
-                    movement_type = _('Grand Lodge Deposit')
-                elif m.account_movement_type == models.ACCOUNTMOVEMENT_CHARGE:
-                    movement_type = _('Charge')
-                else:
-                    movement_type = _('Unknown')
-
-                last_movements += (
-                    "%(date)s\t%(type)s\t\t%(amount)s\t\t%(balance)s\n"
-                ) % {
-                    'date': str(m.created_on.date()),
-                    'type': movement_type,
-                    'amount': str(m.amount),
-                    'balance': str(m.balance)
-                }
-                last_movements_html += (
-                    "<tr>"
-                    "<td>%(date)s</td>"
-                    "<td>%(type)s</td>"
-                    "<td>%(amount)s</td>"
-                    "<td>%(balance)s</td>"
-                    "</tr>"
-                ) % {
-                    'date': str(m.created_on.date()),
-                    'type': movement_type,
-                    'amount': str(m.amount),
-                    'balance': str(m.balance)
-                }
-
-            last_movements_html += "</tbody></table>"
-            data_tuple.append(
-                (
-                    title,
-                    body + account_balance + last_movements,
-                    body_html + account_balance_html + last_movements_html,
-                    lodge.treasurer.email,
-                    [affiliation.user.email],
-                )
-            )
-
-        send_mass_html_mail(data_tuple)
+    def send_mass_email(self, lodge, user):
+        """
+        Queues the balance emails of every active affiliation of the lodge
+        and returns the job reporting their progress.
+        """
+        job = models.BalanceMailingJob.objects.create(
+            lodge=lodge,
+            created_by=user,
+            last_modified_by=user
+        )
+        tasks.delay_on_commit(tasks.mail_balances, job.pk)
+        return job
 
 
 class SendAccountBalance(LoginRequiredMixin, SingleObjectMixin, FormView):
@@ -145,7 +62,7 @@ class SendMassAccountBalance(LoginRequiredMixin, SingleObjectMixin, FormView):
     form_class = SendAccountBalanceForm
 
     def form_valid(self, form):
-        form.send_mass_email(self.object)
+        self.job = form.send_mass_email(self.object, self.request.user)
         return super().form_valid(form)
 
     def post(self, request, *args, **kwargs):
@@ -153,9 +70,64 @@ class SendMassAccountBalance(LoginRequiredMixin, SingleObjectMixin, FormView):
         return super().post(request, *args, **kwargs)
 
     def get_success_url(self):
-        return reverse(
-            'users:lodge-detail', kwargs={'pk': self.object.pk}
-        )
+        return self.job.get_absolute_url()
+
+
+class LedgerFilterForm(Form):
+    date_from = DateField(
+        label=_('from'),
+        required=False,
+        help_text=_('YYYY-MM-DD')
+    )
+    date_until = DateField(
+        label=_('until'),
+        required=False,
+        help_text=_('YYYY-MM-DD')
+    )
+
+    def filter(self, movements):
+        """
+        Narrows the movements to the valid date range, if any.
+        """
+        if self.is_valid():
+            if self.cleaned_data['date_from']:
+                movements = movements.filter(
+                    created_on__date__gte=self.cleaned_data['date_from']
+                )
+            if self.cleaned_data['date_until']:
+                movements = movements.filter(
+                    created_on__date__lte=self.cleaned_data['date_until']
+                )
+        return movements
+
+
+class LedgerExportForm(LedgerFilterForm):
+    lodge = IntegerField(
+        label=_('lodge'),
+        required=False,
+        min_value=1
+    )
+    account = IntegerField(
+        label=_('account'),
+        required=False,
+        min_value=1
+    )
+
+    def filter_by(self, movements, lodge_lookup, account_lookup):
+        """
+        Narrows the movements to the lodge and account given, using the
+        lookups of the movement model, and to the date range.
+        """
+        movements = self.filter(movements)
+        if self.cleaned_data['lodge']:
+            movements = movements.filter(
+                **{lodge_lookup: self.cleaned_data['lodge']}
+            )
+        if self.cleaned_data['account']:
+            movements = movements.filter(
+                **{account_lookup: self.cleaned_data['account']}
+            )
+        return movements
 
 
 class GrandLodgeDepositForm(Form):
@@ -213,3 +185,129 @@ class GrandLodgeDepositReject(LoginRequiredMixin, SingleObjectMixin, FormView):
         return reverse(
             'treasure:grandlodgedeposit-detail', kwargs={'pk': self.object.pk}
         )
+
+
+class DepositImportForm(Form):
+    """
+    Uploads a bank statement of a lodge account, to be previewed before its
+    deposits are imported (see `DepositImportConfirmForm`).
+    """
+    lodge_account = ModelChoiceField(
+        label=_('lodge account'),
+        queryset=models.LodgeAccount.objects.select_related(
+            'handler__user', 'handler__lodge'
+        )
+    )
+    statement = FileField(
+        label=_('statement'),
+        help_text=_(
+            "CSV with date, amount and description columns, or OFX."
+        )
+    )
+
+    def clean_statement(self):
+        statement = self.cleaned_data['statement']
+        extension = os.path.splitext(statement.name)[1].lower()
+        if extension not in imports.STATEMENT_EXTENSIONS:
+            raise ValidationError(_("Only CSV and OFX files are supported."))
+        return statement
+
+    def store(self):
+        """
+        Saves the statement until the import is confirmed and returns the
+        token naming it.
+        """
+        statement = self.cleaned_data['statement']
+        token = uuid.uuid4().hex + os.path.splitext(statement.name)[1].lower()
+        imports.statement_storage.save(token, statement)
+        return token
+
+
+class DepositImportConfirmForm(Form):
+    lodge_account = ModelChoiceField(
+        queryset=models.LodgeAccount.objects.select_related('handler__lodge'),
+        widget=HiddenInput
+    )
+    token = CharField(
+        widget=HiddenInput,
+        validators=[RegexValidator(r'^[0-9a-f]{32}\.(csv|ofx|qfx)$')]
+    )
+
+    def clean_token(self):
+        token = self.cleaned_data['token']
+        if not imports.statement_storage.exists(token):
+            raise ValidationError(
+                _("The statement was already imported or discarded.")
+            )
+        return token
+
+    def import_deposits(self, user):
+        """
+        Imports the deposits of the matched lines of the stored statement,
+        and discards it.
+        """
+        lodge_account = self.cleaned_data['lodge_account']
+        name = self.cleaned_data['token']
+        with imports.statement_storage.open(name, 'rb') as statement:
+            matcher = imports.Matcher(lodge_account.handler.lodge)
+            count = imports.import_deposits(
+                (
+                    (line, affiliation_id)
+                    for line, affiliation_id, error in matcher.lines(
+                        imports.read_statement(statement, name)
+                    )
+                    if error is None
+                ),
+                lodge_account,
+                user
+            )
+        imports.statement_storage.delete(name)
+        return count
+
+
+class DepositImport(LoginRequiredMixin, FormView):
+    """
+    Shows which lines of an uploaded statement match a member, and how many
+    deposits would be imported.
+    """
+    template_name = 'treasure/deposit_import.html'
+    form_class = DepositImportForm
+
+    def form_valid(self, form):
+        lodge_account = form.cleaned_data['lodge_account']
+        token = form.store()
+        matcher = imports.Matcher(lodge_account.handler.lodge)
+        with imports.statement_storage.open(token, 'rb') as statement:
+            summary = imports.summarize(
+                matcher.lines(imports.read_statement(statement, token))
+            )
+        summary['matched'] = [
+            (line, matcher.names[affiliation_id])
+            for line, affiliation_id in summary['matched']
+        ]
+        return self.render_to_response(self.get_context_data(
+            form=form,
+            summary=summary,
+            confirm_form=DepositImportConfirmForm(initial={
+                'lodge_account': lodge_account.pk,
+                'token': token
+            })
+        ))
+
+
+class DepositImportConfirm(LoginRequiredMixin, FormView):
+    template_name = 'treasure/deposit_import.html'
+    form_class = DepositImportConfirmForm
+
+    def form_valid(self, form):
+        form.import_deposits(self.request.user)
+        return HttpResponseRedirect(reverse(
+            'treasure:deposit-list',
+            kwargs={'pk': form.cleaned_data['lodge_account'].handler.lodge_id}
+        ))
+
+    def form_invalid(self, form):
+        return self.render_to_response(self.get_context_data(
+            form=DepositImportForm(),
+            errors=form.errors
+        ))
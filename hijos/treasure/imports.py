@@ -0,0 +1,294 @@
+import csv
+import io
+import re
+import unicodedata
+from collections import defaultdict, namedtuple
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils.functional import cached_property
+from django.utils.translation import ugettext_lazy as _
+
+from hijos.treasure import models, posting
+from hijos.users import models as users
+
+# A line of a bank statement; `date` and `amount` are None if they couldn't
+# be read.
+StatementLine = namedtuple(
+    'StatementLine', ['number', 'date', 'amount', 'description']
+)
+
+STATEMENT_EXTENSIONS = ('.csv', '.ofx', '.qfx')
+CSV_DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y')
+OFX_TAG = re.compile(r'<(/?\w+)>([^<\r\n]*)')
+
+NOT_READABLE = _("The date or amount can't be read.")
+NOT_A_CREDIT = _("Not a credit.")
+NO_MEMBER = _("No member matched.")
+
+
+class StatementStorage(FileSystemStorage):
+    """
+    Keeps the uploaded statements from their upload until their import is
+    confirmed, in `settings.TREASURE_IMPORTS_ROOT`: a private directory, out
+    of MEDIA_ROOT, since they list every member's payments.
+    """
+
+    @cached_property
+    def base_location(self):
+        return settings.TREASURE_IMPORTS_ROOT
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        if setting == 'TREASURE_IMPORTS_ROOT':
+            self.__dict__.pop('base_location', None)
+            self.__dict__.pop('location', None)
+        super()._clear_cached_properties(setting, **kwargs)
+
+
+statement_storage = StatementStorage()
+
+
+def parse_date(value, formats):
+    for date_format in formats:
+        try:
+            return datetime.strptime(value.strip(), date_format).date()
+        except ValueError:
+            pass
+    return None
+
+
+def parse_amount(value):
+    """
+    Returns the amount, or None if it can't be read.
+
+    Bank exports use either a decimal point or a decimal comma, the other
+    one maybe separating the thousands, so the last of them is taken as the
+    decimal separator. Amounts where it could be either (`1,234`) aren't
+    guessed.
+    """
+    value = value.strip().replace(' ', '')
+    decimal = '.' if value.rfind('.') > value.rfind(',') else ','
+    thousands = ',' if decimal == '.' else '.'
+    integer, separator, fraction = value.rpartition(decimal)
+    if not separator:
+        integer, fraction = value, ''
+    elif len(fraction) not in (1, 2):
+        return None
+    if thousands in integer:
+        if not re.match(
+            r'^[-+]?\d{1,3}(%s\d{3})+$' % re.escape(thousands), integer
+        ):
+            return None
+        integer = integer.replace(thousands, '')
+    try:
+        return Decimal(
+            integer + '.' + fraction if separator else integer
+        ).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        return None
+
+
+def read_csv(file):
+    """
+    Yields the lines of a CSV statement (a binary file) with `date`, `amount`
+    and `description` columns, one at a time.
+    """
+    reader = csv.DictReader(
+        io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    )
+    if reader.fieldnames is None:
+        return
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    for row in reader:
+        yield StatementLine(
+            reader.line_num,
+            parse_date(row.get('date') or '', CSV_DATE_FORMATS),
+            parse_amount(row.get('amount') or ''),
+            (row.get('description') or '').strip()
+        )
+
+
+def read_ofx(file):
+    """
+    Yields the transactions (`<STMTTRN>`) of an OFX statement (a binary
+    file), one at a time. Closing tags of values are optional, as in OFX 1.
+    """
+    number = 0
+    transaction_tags = None
+    for line in io.TextIOWrapper(file, encoding='latin-1'):
+        for tag, value in OFX_TAG.findall(line):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                transaction_tags = {}
+            elif tag == '/STMTTRN' and transaction_tags is not None:
+                number += 1
+                yield StatementLine(
+                    number,
+                    parse_date(
+                        transaction_tags.get('DTPOSTED', '')[:8], ('%Y%m%d',)
+                    ),
+                    parse_amount(transaction_tags.get('TRNAMT', '')),
+                    ' '.join(
+                        transaction_tags[name].strip()
+                        for name in ('NAME', 'MEMO')
+                        if transaction_tags.get(name)
+                    )
+                )
+                transaction_tags = None
+            elif transaction_tags is not None and value.strip():
+                transaction_tags[tag] = value.strip()
+
+
+def read_statement(file, name):
+    """
+    Returns the lines of a statement, read as OFX or CSV by its file `name`.
+    """
+    if name.lower().endswith(STATEMENT_EXTENSIONS[1:]):
+        return read_ofx(file)
+    return read_csv(file)
+
+
+def normalize(text):
+    """
+    Lowercases the text and drops its accents and punctuation, but for the
+    characters of usernames and emails.
+    """
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(
+        token.strip('._-')
+        for token in re.sub(r'[^\w@.\-]+', ' ', text.lower()).split()
+    )
+
+
+class Matcher:
+    """
+    Matches the description of statement lines to the active affiliations of
+    a lodge, by the username, email or full name (either order) of their
+    members. Keys shared by more than one affiliation match none.
+
+    Every key is in a dict and descriptions are looked up by word and by
+    pair of words, so matching doesn't depend on the number of members.
+    """
+
+    def __init__(self, lodge):
+        keys = defaultdict(set)
+        self.names = {}
+        for pk, username, email, first_name, last_name in (
+            users.Affiliation.objects.filter(
+                lodge=lodge,
+                is_active=True
+            ).values_list(
+                'pk',
+                'user__username',
+                'user__email',
+                'user__first_name',
+                'user__last_name'
+            )
+        ):
+            self.names[pk] = '%s, %s' % (last_name, first_name)
+            for key in (
+                username,
+                email,
+                first_name + ' ' + last_name,
+                last_name + ' ' + first_name
+            ):
+                key = normalize(key)
+                if key:
+                    keys[key].add(pk)
+        self.keys = {
+            key: pks.pop() for key, pks in keys.items() if len(pks) == 1
+        }
+
+    def match(self, description):
+        """
+        Returns the affiliation id the description names, or None.
+        """
+        tokens = normalize(description).split()
+        for key in tokens + [
+            ' '.join(pair) for pair in zip(tokens, tokens[1:])
+        ]:
+            if key in self.keys:
+                return self.keys[key]
+        return None
+
+    def lines(self, lines):
+        """
+        Yields `(line, affiliation id, error)` for every statement line; only
+        credits naming a member have no error.
+        """
+        for line in lines:
+            if line.date is None or line.amount is None:
+                yield line, None, NOT_READABLE
+            elif line.amount <= 0:
+                yield line, None, NOT_A_CREDIT
+            else:
+                affiliation_id = self.match(line.description)
+                yield (
+                    line,
+                    affiliation_id,
+                    NO_MEMBER if affiliation_id is None else None
+                )
+
+
+def import_deposits(matched, lodge_account, user, batch_size=1000):
+    """
+    Saves a deposit to the lodge account for every `(line, affiliation id)`
+    and posts them, all in one transaction, and returns how many.
+
+    Deposits are inserted with `bulk_create` and posted with
+    `posting.PostingService`, which also bulk creates their movements, so no
+    `post_save` receiver (or email) runs for any of them.
+    """
+    service = posting.PostingService(user)
+    count = 0
+    with transaction.atomic():
+        batch = []
+        for line, affiliation_id in matched:
+            batch.append(models.Deposit(
+                payer_id=affiliation_id,
+                lodge_account=lodge_account,
+                amount=line.amount,
+                description=('%s %s' % (line.date, line.description))[:300],
+                created_by=user,
+                last_modified_by=user
+            ))
+            if len(batch) >= batch_size:
+                count += save_deposits(service, batch)
+                batch = []
+        if batch:
+            count += save_deposits(service, batch)
+    return count
+
+
+def save_deposits(service, deposits):
+    service.post(posting.bulk_insert(models.Deposit, deposits))
+    return len(deposits)
+
+
+def summarize(results, limit=100):
+    """
+    Counts the `(line, affiliation id, error)` results of a statement and
+    keeps the first `limit` matched and unmatched ones, for a preview.
+    """
+    summary = {
+        'matched': [],
+        'unmatched': [],
+        'matched_count': 0,
+        'matched_total': Decimal('0.00'),
+        'unmatched_count': 0
+    }
+    for line, affiliation_id, error in results:
+        if error is None:
+            summary['matched_count'] += 1
+            summary['matched_total'] += line.amount
+            if len(summary['matched']) < limit:
+                summary['matched'].append((line, affiliation_id))
+        else:
+            summary['unmatched_count'] += 1
+            if len(summary['unmatched']) < limit:
+                summary['unmatched'].append((line, error))
+    return summary
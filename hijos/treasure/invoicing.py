@@ -0,0 +1,76 @@
+from django.db import transaction
+from django.utils.translation import ugettext_lazy as _
+
+from hijos.treasure import models, posting, prices
+from hijos.users import models as users
+
+
+def invoice_email(invoice):
+    """
+    Returns the title and content of the email notifying a new invoice.
+    """
+    title = _("New invoice")
+    content = _(
+        "A new invoice has been issued to you for the period "
+        "%(period)s of an amount $ %(amount)s."
+    ) % {
+        'period': str(invoice.period),
+        'amount': str(invoice.amount)
+    }
+    return title, content
+
+
+def get_category_prices(period, categories):
+    """
+    Resolves, from the `PriceBook`, the price in force during the whole
+    `period` for every one of the given category ids.
+    """
+    book = prices.get_price_book()
+    return {
+        category_id: book.price(category_id, period.begin, period.end)
+        for category_id in categories
+    }
+
+
+def create_period_invoices(period, affiliations=None):
+    """
+    Invoices every affiliation (by default, every active affiliation of the
+    period's lodge) and posts the invoices to their accounts.
+
+    Invoices are inserted with `bulk_create` and posted as a single batch,
+    so the number of queries doesn't depend on the number of affiliations.
+    Returns the number of invoices created.
+    """
+    if affiliations is None:
+        affiliations = users.Affiliation.objects.filter(
+            lodge=period.lodge,
+            is_active=True
+        )
+    rows = list(affiliations.order_by().values_list('id', 'category_id'))
+    if not rows:
+        return 0
+    prices = get_category_prices(
+        period, {category_id for affiliation_id, category_id in rows}
+    )
+
+    with transaction.atomic():
+        models.Invoice.objects.bulk_create([
+            models.Invoice(
+                period=period,
+                affiliation_id=affiliation_id,
+                amount=prices[category_id] * period.price_multiplier,
+                send_email=period.send_email,
+                created_by=period.created_by,
+                last_modified_by=period.last_modified_by
+            )
+            for affiliation_id, category_id in rows
+        ])
+        invoices = list(
+            models.Invoice.objects.filter(
+                period=period,
+                affiliation__in=affiliations.order_by().values('id')
+            ).order_by('pk')
+        )
+        posting.PostingService(period.last_modified_by).post(invoices)
+
+    return len(invoices)
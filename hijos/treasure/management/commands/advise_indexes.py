@@ -0,0 +1,130 @@
+import re
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q, Sum
+
+from hijos.treasure import emails, models
+from hijos.users import models as users
+
+# Plan lines of a full table scan or of rows sorted after being read:
+# SQLite's "SCAN <table>" (without an index) and "USE TEMP B-TREE FOR ORDER
+# BY", PostgreSQL's "Seq Scan" and "Sort".
+FULL_SCAN = re.compile(
+    r'\bSCAN (TABLE )?\S+$|\bSCAN (TABLE )?\S+ \(|Seq Scan'
+)
+SORT = re.compile(r'TEMP B-TREE FOR (RIGHT PART OF )?ORDER BY|\bSort\b')
+
+
+def known_queries():
+    """
+    Returns the `(name, queryset, sorted)` of the queries the treasure runs
+    the most, with placeholder keys, since the plan doesn't depend on them.
+    `sorted` tells the rows are expected to be sorted after being read.
+    """
+    return [
+        (
+            'account last movements',
+            models.AccountMovement.objects.filter(
+                account=1,
+                is_active=True
+            ).order_by(*emails.MOVEMENTS_ORDERING)[:emails.LAST_MOVEMENTS],
+            False
+        ),
+        (
+            'account ledger',
+            models.AccountMovement.objects.filter(
+                account=1,
+                is_active=True
+            ).order_by('-created_on', '-id')[:51],
+            False
+        ),
+        (
+            'lodge account ledger',
+            models.LodgeAccountMovement.objects.filter(
+                lodge_account=1,
+                is_active=True
+            ).order_by('-created_on', '-id')[:51],
+            False
+        ),
+        (
+            'category prices',
+            users.CategoryPrice.objects.filter(
+                Q(category__in=[1, 2]),
+                Q(is_active=True),
+                Q(date_from__lte='2018-04-01'),
+                Q(date_until__gte='2018-04-01'),
+                Q(date_from__lte='2018-04-30'),
+                Q(date_until__gte='2018-04-30')
+            ).order_by().values_list('category_id', 'price'),
+            False
+        ),
+        (
+            'debt summaries',
+            models.Account.objects.filter(
+                affiliation__lodge__in=[1, 2],
+                balance__lt=Decimal('0.00')
+            ).order_by().values('affiliation__lodge').annotate(
+                debt_sum=Sum('balance')
+            ),
+            False
+        ),
+        (
+            # Accounts have no lodge of their own, so the debtors of a lodge
+            # are found through its affiliations and then sorted.
+            'lodge debtors',
+            models.Account.objects.filter(
+                affiliation__lodge=1,
+                balance__lt=Decimal('0.00')
+            ).order_by('balance', 'id')[:51],
+            True
+        ),
+        (
+            'lodge periods',
+            models.Period.objects.filter(
+                lodge=1
+            ).order_by('-begin', '-id')[:51],
+            False
+        )
+    ]
+
+
+class Command(BaseCommand):
+    help = (
+        "Prints the query plan of the treasure's known queries and flags the "
+        "ones doing full table scans or sorting."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help="Exit with an error if any query is flagged."
+        )
+
+    def handle(self, *args, **options):
+        flagged = []
+        for name, queryset, expect_sort in known_queries():
+            plan = queryset.explain()
+            lines = plan.splitlines()
+            scans = [line for line in lines if FULL_SCAN.search(line)]
+            sorts = [
+                line for line in lines
+                if SORT.search(line) and not expect_sort
+            ]
+            if scans or sorts:
+                flagged.append(name)
+                self.stdout.write(self.style.WARNING(name))
+            else:
+                self.stdout.write(self.style.SUCCESS(name))
+            self.stdout.write(plan)
+            for line in scans:
+                self.stdout.write('  full scan: ' + line.strip())
+            for line in sorts:
+                self.stdout.write('  sort: ' + line.strip())
+            self.stdout.write('')
+
+        if flagged and options['check']:
+            raise CommandError(
+                "Queries needing an index: " + ', '.join(flagged)
+            )
@@ -0,0 +1,332 @@
+import calendar
+import random
+from datetime import date, datetime, time
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from hijos.treasure import checkpoints, invoicing, models, posting, rollups
+from hijos.users import models as users
+
+PRICE = Decimal('100.00')
+
+
+def months_back(count, today):
+    """
+    Returns the first day of the `count` months before the one of `today`,
+    oldest first.
+    """
+    year, month = today.year, today.month
+    months = []
+    for i in range(count):
+        month -= 1
+        if month == 0:
+            year, month = year - 1, 12
+        months.append(date(year, month, 1))
+    return months[::-1]
+
+
+def month_end(day):
+    return day.replace(day=calendar.monthrange(day.year, day.month)[1])
+
+
+def pinned_now(day, hour):
+    """
+    Patches the current time to `hour` of `day`, so that rows saved under it
+    (auto_now fields, movements, debt dates) look made back then.
+    """
+    return mock.patch(
+        'django.utils.timezone.now',
+        return_value=timezone.make_aware(datetime.combine(day, time(hour)))
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills the database with lodges, members and years of monthly "
+        "periods, deposits, charges and transfers, to benchmark against. "
+        "Rows are bulk inserted and posted month by month."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lodges',
+            type=int,
+            default=5,
+            help="Number of lodges."
+        )
+        parser.add_argument(
+            '--members',
+            type=int,
+            default=200,
+            help="Number of affiliations per lodge."
+        )
+        parser.add_argument(
+            '--years',
+            type=int,
+            default=3,
+            help="Years of history, up to last month."
+        )
+        parser.add_argument(
+            '--transfers',
+            type=int,
+            default=2,
+            help="Transfers per lodge and month."
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help="Random seed, the same one seeds the same history."
+        )
+        parser.add_argument(
+            '--prefix',
+            default='Benchmark',
+            help="Prefix of the names of the lodges, users and category."
+        )
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if users.Lodge.objects.filter(name__startswith=prefix + ' ').exists():
+            raise CommandError(
+                "There are already lodges named '%s ...'." % prefix
+            )
+        self.random = random.Random(options['seed'])
+        months = months_back(options['years'] * 12, timezone.localdate())
+
+        with pinned_now(months[0], 9), transaction.atomic():
+            self.user = self.create_user(prefix)
+            lodges = self.create_lodges(prefix, options['lodges'])
+            affiliations = self.create_affiliations(
+                prefix, lodges, options['members'], months[0]
+            )
+            lodge_accounts = self.create_lodge_accounts(lodges, affiliations)
+
+        counts = {'periods': 0, 'invoices': 0}
+        for month in months:
+            with transaction.atomic():
+                with pinned_now(month, 10):
+                    for lodge in lodges:
+                        period = self.create_period(lodge, month)
+                        counts['periods'] += 1
+                        counts['invoices'] += (
+                            invoicing.create_period_invoices(period)
+                        )
+                with pinned_now(month.replace(day=15), 12):
+                    for name, count in self.create_documents(
+                        affiliations,
+                        lodge_accounts,
+                        options['transfers']
+                    ).items():
+                        counts[name] = counts.get(name, 0) + count
+
+        # Month end balances, as the periodic task would have taken them.
+        for month in months:
+            for account_model in checkpoints.LEDGERS:
+                checkpoints.take_checkpoints(account_model, month_end(month))
+        rollups.refresh_debt_summaries([lodge.pk for lodge in lodges])
+
+        self.stdout.write(
+            '%d lodges, %d affiliations, %d months: ' % (
+                len(lodges),
+                sum(len(members) for members in affiliations.values()),
+                len(months)
+            ) + ', '.join(
+                '%d %s' % (count, name) for name, count in counts.items()
+            )
+        )
+
+    def create_user(self, prefix):
+        """
+        Returns the user treasuring the lodges and creating everything.
+        """
+        user, created = users.User.objects.get_or_create(
+            username=prefix.lower(),
+            defaults={
+                'first_name': prefix,
+                'last_name': 'Treasurer',
+                'email': '%s@example.com' % prefix.lower(),
+                'password': make_password(None)
+            }
+        )
+        return user
+
+    def audit(self, **fields):
+        return dict(
+            fields, created_by=self.user, last_modified_by=self.user
+        )
+
+    def create_lodges(self, prefix, count):
+        """
+        Creates the lodges and their global accounts, which bulk inserts
+        don't create by signal.
+        """
+        users.Lodge.objects.bulk_create([
+            users.Lodge(**self.audit(
+                name='%s %d' % (prefix, i),
+                treasurer=self.user
+            ))
+            for i in range(count)
+        ])
+        lodges = list(
+            users.Lodge.objects.filter(
+                name__startswith=prefix + ' '
+            ).order_by('pk')
+        )
+        models.LodgeGlobalAccount.objects.bulk_create([
+            models.LodgeGlobalAccount(**self.audit(lodge=lodge))
+            for lodge in lodges
+        ])
+        return lodges
+
+    def create_affiliations(self, prefix, lodges, count, since):
+        """
+        Creates `count` members per lodge in a category priced `PRICE`
+        `since` the given day, with their affiliations and accounts. Returns
+        the affiliation ids by lodge.
+        """
+        category, created = users.Category.objects.get_or_create(
+            name=prefix,
+            defaults=self.audit()
+        )
+        if created:
+            users.CategoryPrice.objects.create(**self.audit(
+                category=category,
+                price=PRICE,
+                date_from=since
+            ))
+
+        password = make_password(None)
+        users.User.objects.bulk_create(
+            [
+                users.User(
+                    username='%s-%d-%d' % (prefix.lower(), lodge.pk, i),
+                    first_name='Member %d' % i,
+                    last_name=lodge.name,
+                    email='%s-%d-%d@example.com' % (
+                        prefix.lower(), lodge.pk, i
+                    ),
+                    password=password
+                )
+                for lodge in lodges
+                for i in range(count)
+            ],
+            batch_size=500
+        )
+        for lodge in lodges:
+            users.Affiliation.objects.bulk_create(
+                [
+                    users.Affiliation(**self.audit(
+                        lodge=lodge,
+                        user_id=user_id,
+                        category=category
+                    ))
+                    for user_id in users.User.objects.filter(
+                        username__startswith='%s-%d-' % (
+                            prefix.lower(), lodge.pk
+                        )
+                    ).values_list('pk', flat=True)
+                ],
+                batch_size=500
+            )
+
+        affiliations = {lodge.pk: [] for lodge in lodges}
+        for pk, lodge_id in users.Affiliation.objects.filter(
+            lodge__in=lodges
+        ).order_by('pk').values_list('pk', 'lodge'):
+            affiliations[lodge_id].append(pk)
+        models.Account.objects.bulk_create(
+            [
+                models.Account(**self.audit(affiliation_id=pk))
+                for pks in affiliations.values()
+                for pk in pks
+            ],
+            batch_size=500
+        )
+        return affiliations
+
+    def create_lodge_accounts(self, lodges, affiliations):
+        """
+        Creates two lodge accounts per lodge, handled by its first members,
+        and returns their ids by lodge.
+        """
+        models.LodgeAccount.objects.bulk_create([
+            models.LodgeAccount(**self.audit(
+                handler_id=affiliations[lodge.pk][i],
+                description=description
+            ))
+            for lodge in lodges
+            for i, description in enumerate(('Bank', 'Cash'))
+        ])
+        lodge_accounts = {lodge.pk: [] for lodge in lodges}
+        for pk, lodge_id in models.LodgeAccount.objects.filter(
+            handler__lodge__in=lodges
+        ).order_by('pk').values_list('pk', 'handler__lodge'):
+            lodge_accounts[lodge_id].append(pk)
+        return lodge_accounts
+
+    def create_period(self, lodge, month):
+        """
+        Creates a monthly period, bypassing the signal that would invoice it
+        in a job, so it can be invoiced right away.
+        """
+        return posting.bulk_insert(models.Period, [
+            models.Period(**self.audit(
+                lodge=lodge,
+                begin=month,
+                end=month_end(month)
+            ))
+        ])[0]
+
+    def create_documents(self, affiliations, lodge_accounts, transfers):
+        """
+        Creates and posts a month of deposits (most members pay one or two
+        months), a few charges and the `transfers` between lodge accounts,
+        and returns how many of each.
+        """
+        deposits = []
+        charges = []
+        lodge_transfers = []
+        for lodge_id, pks in affiliations.items():
+            accounts = lodge_accounts[lodge_id]
+            for pk in pks:
+                if self.random.random() < 0.6:
+                    deposits.append(models.Deposit(**self.audit(
+                        payer_id=pk,
+                        lodge_account_id=self.random.choice(accounts),
+                        amount=PRICE * self.random.randint(1, 2)
+                    )))
+                if self.random.random() < 0.02:
+                    charges.append(models.Charge(**self.audit(
+                        debtor_id=pk,
+                        amount=Decimal(self.random.randrange(50, 500, 10)),
+                        charge_type=models.CHARGE_OTHER
+                    )))
+            for i in range(transfers):
+                account_from, account_to = self.random.sample(accounts, 2)
+                lodge_transfers.append(models.LodgeAccountTransfer(
+                    **self.audit(
+                        lodge_account_from_id=account_from,
+                        lodge_account_to_id=account_to,
+                        amount=Decimal(self.random.randrange(10, 1000, 10))
+                    )
+                ))
+
+        documents = []
+        for model, objects in (
+            (models.Deposit, deposits),
+            (models.Charge, charges),
+            (models.LodgeAccountTransfer, lodge_transfers)
+        ):
+            if objects:
+                documents += posting.bulk_insert(model, objects)
+        posting.PostingService(self.user).post(documents)
+        return {
+            'deposits': len(deposits),
+            'charges': len(charges),
+            'transfers': len(lodge_transfers)
+        }
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from hijos.treasure import checkpoints
+
+
+class Command(BaseCommand):
+    help = (
+        "Takes the month end balance checkpoints still missing, as the "
+        "daily task does. Run it once to backfill the existing history."
+    )
+
+    def handle(self, *args, **options):
+        for account_model in checkpoints.LEDGERS:
+            count, months = checkpoints.catch_up(account_model)
+            self.stdout.write('%s: %d checkpoints of %d month ends' % (
+                account_model._meta.verbose_name_plural, count, months
+            ))
@@ -0,0 +1,201 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+
+from hijos.treasure import checkpoints, models, posting, rollups, signals
+from hijos.users import caching
+
+ZERO = Decimal('0.00')
+
+# (name, account model, account key, movement model, path from the movement
+# to the account key, path from the account to its lodge)
+LEDGERS = (
+    (
+        'accounts',
+        models.Account,
+        'pk',
+        models.AccountMovement,
+        'account',
+        'affiliation__lodge'
+    ),
+    (
+        'lodge accounts',
+        models.LodgeAccount,
+        'pk',
+        models.LodgeAccountMovement,
+        'lodge_account',
+        'handler__lodge'
+    ),
+    (
+        'lodge global accounts',
+        models.LodgeGlobalAccount,
+        'lodge',
+        models.LodgeAccountMovement,
+        'lodge_account__handler__lodge',
+        'lodge'
+    )
+)
+
+
+def find_discrepancies(account_model, key, movement_model, path):
+    """
+    Returns `{key: (stored balance, sum of active movements)}` of the accounts
+    whose balance doesn't match their movements.
+
+    Movements are summed with a single grouped query, and the balances are
+    read with another, streamed.
+    """
+    totals = dict(
+        movement_model.objects.filter(
+            is_active=True
+        ).order_by().values_list(path).annotate(total=Sum('amount'))
+    )
+    discrepancies = {}
+    for k, balance in account_model.objects.order_by().values_list(
+        key, 'balance'
+    ).iterator(chunk_size=5000):
+        total = (totals.get(k) or ZERO).quantize(ZERO)
+        if balance != total:
+            discrepancies[k] = (balance, total)
+    return discrepancies
+
+
+def rebuild_running_balances(
+    movement_model, field, batch_size=posting.PostingService.batch_size
+):
+    """
+    Rewrites the running balance of every movement whose balance isn't the
+    sum of the active movements of its account up to it (in creation order),
+    and returns how many were rewritten.
+
+    Movements are streamed in order, so memory doesn't grow with them. The
+    lodges of every rewritten batch get a new version.
+    """
+    rewritten = 0
+    pending = []
+    account_id = None
+    running = ZERO
+    for pk, movement_account_id, amount, is_active, balance in (
+        movement_model.objects.order_by(
+            field, 'created_on', 'id'
+        ).values_list(
+            'pk', field, 'amount', 'is_active', 'balance'
+        ).iterator(chunk_size=5000)
+    ):
+        if movement_account_id != account_id:
+            account_id = movement_account_id
+            running = ZERO
+        if is_active:
+            running += amount
+        if balance != running:
+            pending.append(movement_model(pk=pk, balance=running))
+        if len(pending) >= batch_size:
+            rewritten += rewrite_balances(movement_model, pending)
+            pending = []
+    if pending:
+        rewritten += rewrite_balances(movement_model, pending)
+    return rewritten
+
+
+def rewrite_balances(movement_model, movements):
+    movement_model.objects.bulk_update(movements, ['balance'])
+    caching.bump_lodges(
+        movement_model.objects.filter(
+            pk__in=[movement.pk for movement in movements]
+        ).values(signals.LODGE_LOOKUPS[movement_model])
+    )
+    return len(movements)
+
+
+class Command(BaseCommand):
+    help = (
+        "Checks that the balance of every account, lodge account and lodge "
+        "global account is the sum of its active movements, and optionally "
+        "fixes it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help="Set the wrong balances to the sum of their movements."
+        )
+        parser.add_argument(
+            '--running',
+            action='store_true',
+            help="Rewrite the wrong running balances of the movements."
+        )
+
+    def handle(self, *args, **options):
+        wrong = 0
+        for (
+            name, account_model, key, movement_model, path, lodge_path
+        ) in LEDGERS:
+            # Balances and movements are read in the same transaction, so a
+            # concurrent posting can't show up in only one of them.
+            with transaction.atomic():
+                discrepancies = find_discrepancies(
+                    account_model, key, movement_model, path
+                )
+                if discrepancies and options['fix']:
+                    self.fix(account_model, key, lodge_path, discrepancies)
+
+            self.stdout.write('%s: %d wrong' % (name, len(discrepancies)))
+            for k, (balance, total) in sorted(discrepancies.items()):
+                self.stdout.write(
+                    '  %s %s: balance %s, movements %s' % (
+                        account_model._meta.verbose_name, k, balance, total
+                    )
+                )
+            if not options['fix']:
+                wrong += len(discrepancies)
+
+        if options['running']:
+            for checkpoint_model, movement_model, field in (
+                checkpoints.LEDGERS.values()
+            ):
+                with transaction.atomic():
+                    rewritten = rebuild_running_balances(movement_model, field)
+                self.stdout.write('%s: %d running balances rewritten' % (
+                    movement_model._meta.verbose_name_plural, rewritten
+                ))
+
+        if wrong:
+            raise CommandError(
+                "%d balances don't match their movements." % wrong
+            )
+
+    def fix(self, account_model, key, lodge_path, discrepancies):
+        """
+        Adds to every wrong balance the difference to its movements, and
+        updates what's derived from it.
+        """
+        deltas = {
+            k: total - balance
+            for k, (balance, total) in discrepancies.items()
+        }
+        # Batched as postings are, so no query has too many parameters.
+        batch_size = posting.PostingService.batch_size
+        posting.apply_deltas(
+            account_model.objects.all(), key, deltas, None, None, batch_size
+        )
+        if account_model is models.Account:
+            rollups.update_debts('pk', deltas, batch_size)
+        keys = list(deltas)
+        for i in range(0, len(keys), batch_size):
+            caching.bump_lodges(
+                account_model.objects.filter(
+                    **{key + '__in': keys[i:i + batch_size]}
+                ).values(lodge_path)
+            )
+            # Checkpoints were taken from the wrong balances; without them
+            # the balances as of any day are summed from the movements again.
+            if account_model in checkpoints.LEDGERS:
+                checkpoint_model, movement_model, field = checkpoints.LEDGERS[
+                    account_model
+                ]
+                checkpoint_model.objects.filter(
+                    **{field + '__in': keys[i:i + batch_size]}
+                ).delete()
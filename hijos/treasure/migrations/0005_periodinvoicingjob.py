@@ -0,0 +1,40 @@
+# Generated by Django 2.2.28 on 2026-10-18 11:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('treasure', '0004_auto_20180524_1147'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PeriodInvoicingJob',
+            fields=[
+                ('id', models.BigAutoField(editable=False, primary_key=True, serialize=False)),
+                ('is_active', models.BooleanField(default=True, verbose_name='is active?')),
+                ('created_on', models.DateTimeField(auto_now_add=True, verbose_name='created on')),
+                ('last_modified_on', models.DateTimeField(auto_now=True, verbose_name='last modified on')),
+                ('status', models.CharField(blank=True, choices=[('P', 'Pending'), ('R', 'Running'), ('D', 'Done'), ('F', 'Failed')], default='P', max_length=1, verbose_name='status')),
+                ('error', models.TextField(blank=True, default='', verbose_name='error')),
+                ('invoices_total', models.PositiveIntegerField(blank=True, default=0, verbose_name='invoices total')),
+                ('invoices_created', models.PositiveIntegerField(blank=True, default=0, verbose_name='invoices created')),
+                ('emails_total', models.PositiveIntegerField(blank=True, default=0, verbose_name='emails total')),
+                ('emails_queued', models.PositiveIntegerField(blank=True, default=0, verbose_name='emails queued')),
+                ('created_by', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', related_query_name='+', to=settings.AUTH_USER_MODEL, verbose_name='created by')),
+                ('last_modified_by', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', related_query_name='+', to=settings.AUTH_USER_MODEL, verbose_name='last modified by')),
+                ('period', models.OneToOneField(on_delete=django.db.models.deletion.PROTECT, related_name='invoicing_job', to='treasure.Period', verbose_name='period')),
+            ],
+            options={
+                'verbose_name': 'period invoicing job',
+                'verbose_name_plural': 'period invoicing jobs',
+                'ordering': ['-created_on'],
+                'default_permissions': ('add', 'change', 'delete', 'view'),
+            },
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('users', '0003_auto_20190301_1434'),
+        ('treasure', '0005_periodinvoicingjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceMailingJob',
+            fields=[
+                ('id', models.BigAutoField(editable=False, primary_key=True, serialize=False)),
+                ('is_active', models.BooleanField(default=True, verbose_name='is active?')),
+                ('created_on', models.DateTimeField(auto_now_add=True, verbose_name='created on')),
+                ('last_modified_on', models.DateTimeField(auto_now=True, verbose_name='last modified on')),
+                ('status', models.CharField(blank=True, choices=[('P', 'Pending'), ('R', 'Running'), ('D', 'Done'), ('F', 'Failed')], default='P', max_length=1, verbose_name='status')),
+                ('error', models.TextField(blank=True, default='', verbose_name='error')),
+                ('emails_total', models.PositiveIntegerField(blank=True, default=0, verbose_name='emails total')),
+                ('emails_sent', models.PositiveIntegerField(blank=True, default=0, verbose_name='emails sent')),
+                ('emails_failed', models.PositiveIntegerField(blank=True, default=0, verbose_name='emails failed')),
+                ('failed_recipients', models.TextField(blank=True, default='', verbose_name='failed recipients')),
+                ('created_by', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', related_query_name='+', to=settings.AUTH_USER_MODEL, verbose_name='created by')),
+                ('last_modified_by', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', related_query_name='+', to=settings.AUTH_USER_MODEL, verbose_name='last modified by')),
+                ('lodge', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='balance_mailing_jobs', related_query_name='balance_mailing_job', to='users.Lodge', verbose_name='lodge')),
+            ],
+            options={
+                'verbose_name': 'balance mailing job',
+                'verbose_name_plural': 'balance mailing jobs',
+                'ordering': ['-created_on'],
+                'default_permissions': ('add', 'change', 'delete', 'view'),
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:22
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def date_debts(apps, schema_editor):
+    """
+    Dates every current debt from the first active movement after the last
+    time the account's running balance wasn't negative.
+    """
+    Account = apps.get_model('treasure', 'Account')
+    AccountMovement = apps.get_model('treasure', 'AccountMovement')
+    for account in Account.objects.filter(balance__lt=Decimal('0.00')):
+        debt_since = account.created_on
+        for created_on, balance in AccountMovement.objects.filter(
+            account=account,
+            is_active=True
+        ).order_by('created_on', 'id').values_list('created_on', 'balance'):
+            if balance >= 0:
+                debt_since = None
+            elif debt_since is None:
+                debt_since = created_on
+        account.debt_since = (debt_since or account.created_on).date()
+        account.save(update_fields=['debt_since'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_auto_20190301_1434'),
+        ('treasure', '0006_balancemailingjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LodgeDebtSummary',
+            fields=[
+                ('lodge', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='debt_summary', serialize=False, to='users.Lodge', verbose_name='lodge')),
+                ('debtors', models.PositiveIntegerField(default=0, verbose_name='debtors')),
+                ('debt_sum', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15, verbose_name='debt sum')),
+                ('debt_min', models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True, verbose_name='debt min')),
+                ('debt_max', models.DecimalField(blank=True, decimal_places=2, max_digits=15, null=True, verbose_name='debt max')),
+                ('debt_0_30', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15, verbose_name='debt 0-30 days')),
+                ('debt_31_90', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15, verbose_name='debt 31-90 days')),
+                ('debt_91_180', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15, verbose_name='debt 91-180 days')),
+                ('debt_over_180', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15, verbose_name='debt over 180 days')),
+                ('aged_on', models.DateField(blank=True, help_text='Date the aging buckets are relative to.', null=True, verbose_name='aged on')),
+            ],
+            options={
+                'verbose_name': 'lodge debt summary',
+                'verbose_name_plural': 'lodge debt summaries',
+                'ordering': ['lodge'],
+                'default_permissions': ('view',),
+            },
+        ),
+        migrations.AddField(
+            model_name='account',
+            name='debt_since',
+            field=models.DateField(blank=True, help_text='Date the balance became negative, if it is.', null=True, verbose_name='debt since'),
+        ),
+        migrations.RunPython(date_debts, migrations.RunPython.noop),
+    ]
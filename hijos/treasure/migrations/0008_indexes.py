@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('treasure', '0007_lodgedebtsummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='accountmovement',
+            index=models.Index(condition=models.Q(is_active=True), fields=['account', '-created_on', '-id'], name='accountmovement_ledger_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lodgeaccountmovement',
+            index=models.Index(condition=models.Q(is_active=True), fields=['lodge_account', '-created_on', '-id'], name='lodgemovement_ledger_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='period',
+            index=models.Index(fields=['lodge', '-begin', '-id'], name='period_lodge_idx'),
+        ),
+    ]
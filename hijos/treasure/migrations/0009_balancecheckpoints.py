@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('treasure', '0008_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LodgeAccountBalanceCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='date')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=15, verbose_name='balance')),
+                ('lodge_account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='treasure.LodgeAccount', verbose_name='lodge account')),
+            ],
+            options={
+                'verbose_name': 'lodge account balance checkpoint',
+                'verbose_name_plural': 'lodge account balance checkpoints',
+                'ordering': ['lodge_account', '-date'],
+                'default_permissions': ('view',),
+                'unique_together': {('lodge_account', 'date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='AccountBalanceCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='date')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=15, verbose_name='balance')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='treasure.Account', verbose_name='account')),
+            ],
+            options={
+                'verbose_name': 'account balance checkpoint',
+                'verbose_name_plural': 'account balance checkpoints',
+                'ordering': ['account', '-date'],
+                'default_permissions': ('view',),
+                'unique_together': {('account', 'date')},
+            },
+        ),
+    ]
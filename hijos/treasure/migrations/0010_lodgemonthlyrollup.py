@@ -0,0 +1,80 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:19
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+
+def roll_up_movements(apps, schema_editor):
+    """
+    Sums the active movements made so far by lodge, month and type.
+    """
+    LodgeMonthlyRollup = apps.get_model('treasure', 'LodgeMonthlyRollup')
+    for ledger, model_name, lodge_path, type_field in (
+        (
+            'A',
+            'AccountMovement',
+            'account__affiliation__lodge',
+            'account_movement_type'
+        ),
+        (
+            'L',
+            'LodgeAccountMovement',
+            'lodge_account__handler__lodge',
+            'lodgeaccount_movement_type'
+        )
+    ):
+        movements = apps.get_model('treasure', model_name).objects.filter(
+            is_active=True
+        ).annotate(month=TruncMonth('created_on')).order_by().values_list(
+            lodge_path, 'month', type_field
+        ).annotate(total=Sum('amount'), count=Count('id'))
+        LodgeMonthlyRollup.objects.bulk_create(
+            [
+                LodgeMonthlyRollup(
+                    lodge_id=lodge_id,
+                    month=timezone.localtime(month).date(),
+                    ledger=ledger,
+                    movement_type=movement_type,
+                    amount=total,
+                    movements=count
+                )
+                for lodge_id, month, movement_type, total, count in movements
+            ],
+            batch_size=500
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_indexes'),
+        ('treasure', '0009_balancecheckpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LodgeMonthlyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month.', verbose_name='month')),
+                ('ledger', models.CharField(choices=[('A', 'Accounts'), ('L', 'Lodge accounts')], max_length=1, verbose_name='ledger')),
+                ('movement_type', models.CharField(max_length=1, verbose_name='movement type')),
+                ('amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15, verbose_name='amount')),
+                ('movements', models.IntegerField(default=0, verbose_name='movements')),
+                ('lodge', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_rollups', to='users.Lodge', verbose_name='lodge')),
+            ],
+            options={
+                'verbose_name': 'lodge monthly rollup',
+                'verbose_name_plural': 'lodge monthly rollups',
+                'ordering': ['lodge', 'month'],
+                'default_permissions': ('view',),
+                'unique_together': {('lodge', 'month', 'ledger', 'movement_type')},
+            },
+        ),
+        migrations.RunPython(roll_up_movements, migrations.RunPython.noop),
+    ]
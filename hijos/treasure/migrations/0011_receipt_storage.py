@@ -0,0 +1,35 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:39
+
+from django.db import migrations, models
+
+import hijos.treasure.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('treasure', '0010_lodgemonthlyrollup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deposit',
+            name='receipt',
+            field=models.FileField(blank=True, null=True, storage=hijos.treasure.storage.ReceiptStorage(), upload_to='receipts', verbose_name='receipt'),
+        ),
+        migrations.AlterField(
+            model_name='grandlodgedeposit',
+            name='receipt',
+            field=models.FileField(blank=True, null=True, storage=hijos.treasure.storage.ReceiptStorage(), upload_to='receipts', verbose_name='receipt'),
+        ),
+        migrations.AlterField(
+            model_name='lodgeaccountegress',
+            name='receipt',
+            field=models.FileField(blank=True, null=True, storage=hijos.treasure.storage.ReceiptStorage(), upload_to='receipts', verbose_name='receipt'),
+        ),
+        migrations.AlterField(
+            model_name='lodgeaccountingress',
+            name='receipt',
+            field=models.FileField(blank=True, null=True, storage=hijos.treasure.storage.ReceiptStorage(), upload_to='receipts', verbose_name='receipt'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('treasure', '0011_receipt_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='periodinvoicingjob',
+            name='last_queued_invoice',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='treasure.Invoice', verbose_name='last queued invoice'),
+        ),
+    ]
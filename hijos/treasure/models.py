@@ -8,6 +8,7 @@ from django.db import models
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
 
+from hijos.treasure import emails, storage
 from hijos.users import models as users
 
 
@@ -102,6 +103,12 @@ class Account(users.Model):
         default=Decimal('0.00'),
         blank=True
     )
+    debt_since = models.DateField(
+        _('debt since'),
+        blank=True,
+        null=True,
+        help_text=_("Date the balance became negative, if it is.")
+    )
 
     def __str__(self):
         return str(self.affiliation) + ' - $ ' + str(self.balance)
@@ -110,101 +117,19 @@ class Account(users.Model):
         return reverse('treasure:account-detail', kwargs={'pk': self.pk})
 
     def send_treasure_mail(self, title, content=""):
-        if self.affiliation.user.most_worshipful:
-            body = _("Dear M.·.W.·.B.·. %(full_name)s:")
-        elif self.affiliation.user.worshipful:
-            body = _("Dear W.·.B.·. %(full_name)s:")
-        elif self.affiliation.user.past_master:
-            body = _("Dear P.·.M.·. %(full_name)s:")
-        else:
-            body = _("Dear B.·. %(full_name)s:")
-
-        body = body % {'full_name': self.affiliation.user.get_full_name()}
-        body_html = '<p>' + body + '</p>'
-        body += "\n\t" + content + "\n\t"
-
-        if content is not None and content != "":
-            body_html += (
-                "<p>&nbsp;&nbsp;&nbsp;&nbsp;" + content +
-                "</p>&nbsp;&nbsp;&nbsp;&nbsp;"
-            )
-
-        account_balance = _(
-            "Your current account balance with %(lodge)s is of $ %(balance)s"
-        ) % {
-            'lodge': str(self.affiliation.lodge),
-            'balance': str(self.balance)
-        }
-        account_balance_html = (
-            "<p>&nbsp;&nbsp;&nbsp;&nbsp;" + account_balance + "</p>"
+        title, text, html, from_email, recipient_list = emails.balance_email(
+            self, title, content
         )
-
-        last_movements = (_(
-            "\n\nYour last 10 movements are:"
-            "\n\nDate\tType\t\tAmount\t\tBalance\n\n"
-        ))
-        last_movements_html = (_(
-            "<br><br>Your last 10 movements are:"
-            "<br><br>"
-            "<table>"
-            "<thead>"
-            "<tr>"
-            "<th>Date</th>"
-            "<th>Type</th>"
-            "<th>Amount</th>"
-            "<th>Balance</th>"
-            "</tr>"
-            "</thead>"
-            "<tbody>"
-        ))
-
-        account_movements = self.movements.filter(is_active=True)[:10]
-        for m in account_movements.all():
-            if m.account_movement_type == ACCOUNTMOVEMENT_INVOICE:
-                movement_type = _('Invoice')
-            elif m.account_movement_type == ACCOUNTMOVEMENT_DEPOSIT:
-                movement_type = _('Deposit')
-            elif m.account_movement_type == ACCOUNTMOVEMENT_GRANDLODGEDEPOSIT:
-                movement_type = _('Grand Lodge Deposit')
-            elif m.account_movement_type == ACCOUNTMOVEMENT_CHARGE:
-                movement_type = _('Charge')
-            else:
-                movement_type = _('Unknown')
-
-            last_movements += (
-                "%(date)s\t%(type)s\t\t%(amount)s\t\t%(balance)s\n"
-            ) % {
-                'date': str(m.created_on.date()),
-                'type': movement_type,
-                'amount': str(m.amount),
-                'balance': str(m.balance)
-            }
-            last_movements_html += (
-                "<tr>"
-                "<td>%(date)s</td>"
-                "<td>%(type)s</td>"
-                "<td>%(amount)s</td>"
-                "<td>%(balance)s</td>"
-                "</tr>"
-            ) % {
-                'date': str(m.created_on.date()),
-                'type': movement_type,
-                'amount': str(m.amount),
-                'balance': str(m.balance)
-            }
-
-        last_movements_html += "</tbody></table>"
-        from_email = self.affiliation.lodge.treasurer.email
         send_mail(
             title,
-            body + account_balance + last_movements,
+            text,
             from_email,
-            [self.affiliation.user.email],
+            recipient_list,
             False,
             None,
             None,
             None,
-            body_html + account_balance_html + last_movements_html
+            html
         )
 
     class Meta:
@@ -214,6 +139,210 @@ class Account(users.Model):
         ordering = ['affiliation']
 
 
+class LodgeDebtSummary(models.Model):
+    """
+    Debt totals of the accounts of a lodge, maintained by the posting layer
+    (see `rollups.update_debts`). Debts are negative, so the largest debt is
+    `debt_min`.
+    """
+    lodge = models.OneToOneField(
+        users.Lodge,
+        verbose_name=_('lodge'),
+        related_name='debt_summary',
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    debtors = models.PositiveIntegerField(
+        _('debtors'),
+        default=0
+    )
+    debt_sum = models.DecimalField(
+        _('debt sum'),
+        max_digits=15,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    debt_min = models.DecimalField(
+        _('debt min'),
+        max_digits=15,
+        decimal_places=2,
+        blank=True,
+        null=True
+    )
+    debt_max = models.DecimalField(
+        _('debt max'),
+        max_digits=15,
+        decimal_places=2,
+        blank=True,
+        null=True
+    )
+    debt_0_30 = models.DecimalField(
+        _('debt 0-30 days'),
+        max_digits=15,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    debt_31_90 = models.DecimalField(
+        _('debt 31-90 days'),
+        max_digits=15,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    debt_91_180 = models.DecimalField(
+        _('debt 91-180 days'),
+        max_digits=15,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    debt_over_180 = models.DecimalField(
+        _('debt over 180 days'),
+        max_digits=15,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    aged_on = models.DateField(
+        _('aged on'),
+        blank=True,
+        null=True,
+        help_text=_("Date the aging buckets are relative to.")
+    )
+
+    @property
+    def debt_avg(self):
+        if self.debtors:
+            return (self.debt_sum / self.debtors).quantize(Decimal('0.01'))
+        return None
+
+    def __str__(self):
+        return str(self.lodge) + ' $ ' + str(self.debt_sum)
+
+    class Meta:
+        verbose_name = _('lodge debt summary')
+        verbose_name_plural = _('lodge debt summaries')
+        default_permissions = ('view',)
+        ordering = ['lodge']
+
+
+ROLLUP_ACCOUNTS = 'A'
+ROLLUP_LODGEACCOUNTS = 'L'
+ROLLUP_LEDGERS = (
+    (ROLLUP_ACCOUNTS, _('Accounts')),
+    (ROLLUP_LODGEACCOUNTS, _('Lodge accounts'))
+)
+
+
+class LodgeMonthlyRollup(models.Model):
+    """
+    Totals of the active movements of a lodge in a month, per ledger and
+    movement type, maintained by the posting layer (see
+    `rollups.update_monthly`).
+    """
+    lodge = models.ForeignKey(
+        users.Lodge,
+        verbose_name=_('lodge'),
+        related_name='monthly_rollups',
+        on_delete=models.CASCADE
+    )
+    month = models.DateField(
+        _('month'),
+        help_text=_("First day of the month.")
+    )
+    ledger = models.CharField(
+        _('ledger'),
+        max_length=1,
+        choices=ROLLUP_LEDGERS
+    )
+    movement_type = models.CharField(
+        _('movement type'),
+        max_length=1
+    )
+    amount = models.DecimalField(
+        _('amount'),
+        max_digits=15,
+        decimal_places=2,
+        default=Decimal('0.00')
+    )
+    movements = models.IntegerField(
+        _('movements'),
+        default=0
+    )
+
+    def __str__(self):
+        return '%s %s %s%s $ %s' % (
+            self.lodge_id, self.month, self.ledger, self.movement_type,
+            self.amount
+        )
+
+    class Meta:
+        verbose_name = _('lodge monthly rollup')
+        verbose_name_plural = _('lodge monthly rollups')
+        default_permissions = ('view',)
+        ordering = ['lodge', 'month']
+        unique_together = ('lodge', 'month', 'ledger', 'movement_type')
+
+
+class AccountBalanceCheckpoint(models.Model):
+    """
+    Balance of an account at the end of a day, computed from its active
+    movements (see `checkpoints`).
+    """
+    account = models.ForeignKey(
+        Account,
+        verbose_name=_('account'),
+        related_name='checkpoints',
+        on_delete=models.CASCADE
+    )
+    date = models.DateField(
+        _('date')
+    )
+    balance = models.DecimalField(
+        _('balance'),
+        max_digits=15,
+        decimal_places=2
+    )
+
+    def __str__(self):
+        return str(self.date) + ' $ ' + str(self.balance)
+
+    class Meta:
+        verbose_name = _('account balance checkpoint')
+        verbose_name_plural = _('account balance checkpoints')
+        default_permissions = ('view',)
+        ordering = ['account', '-date']
+        unique_together = ('account', 'date')
+
+
+class LodgeAccountBalanceCheckpoint(models.Model):
+    """
+    Balance of a lodge account at the end of a day, computed from its active
+    movements (see `checkpoints`).
+    """
+    lodge_account = models.ForeignKey(
+        LodgeAccount,
+        verbose_name=_('lodge account'),
+        related_name='checkpoints',
+        on_delete=models.CASCADE
+    )
+    date = models.DateField(
+        _('date')
+    )
+    balance = models.DecimalField(
+        _('balance'),
+        max_digits=15,
+        decimal_places=2
+    )
+
+    def __str__(self):
+        return str(self.date) + ' $ ' + str(self.balance)
+
+    class Meta:
+        verbose_name = _('lodge account balance checkpoint')
+        verbose_name_plural = _('lodge account balance checkpoints')
+        default_permissions = ('view',)
+        ordering = ['lodge_account', '-date']
+        unique_together = ('lodge_account', 'date')
+
+
 LODGEACCOUNTMOVEMENT_INGRESS = 'I'
 LODGEACCOUNTMOVEMENT_EGRESS = 'E'
 LODGEACCOUNTMOVEMENT_TRANSFER = 'T'
@@ -276,6 +405,14 @@ class LodgeAccountMovement(users.Model):
         verbose_name_plural = _('lodge account movements')
         default_permissions = ('add', 'change', 'delete', 'view')
         ordering = ['-created_on']
+        indexes = [
+            # Ledgers, which only show active movements, latest first.
+            models.Index(
+                fields=['lodge_account', '-created_on', '-id'],
+                name='lodgemovement_ledger_idx',
+                condition=models.Q(is_active=True)
+            )
+        ]
 
 
 class LodgeAccountTransfer(users.Model):
@@ -388,6 +525,15 @@ class AccountMovement(users.Model):
         verbose_name_plural = _('account movements')
         default_permissions = ('add', 'change', 'delete', 'view')
         ordering = ['-created_on']
+        indexes = [
+            # Ledgers and the last movements of the balance emails, which
+            # only show active movements, latest first.
+            models.Index(
+                fields=['account', '-created_on', '-id'],
+                name='accountmovement_ledger_idx',
+                condition=models.Q(is_active=True)
+            )
+        ]
 
 
 class Period(users.Model):
@@ -439,6 +585,152 @@ class Period(users.Model):
         verbose_name_plural = _('periods')
         default_permissions = ('add', 'change', 'delete', 'view')
         ordering = ['-begin']
+        indexes = [
+            models.Index(
+                fields=['lodge', '-begin', '-id'],
+                name='period_lodge_idx'
+            )
+        ]
+
+
+JOB_PENDING = 'P'
+JOB_RUNNING = 'R'
+JOB_DONE = 'D'
+JOB_FAILED = 'F'
+JOB_STATUSES = (
+    (JOB_PENDING, _('Pending')),
+    (JOB_RUNNING, _('Running')),
+    (JOB_DONE, _('Done')),
+    (JOB_FAILED, _('Failed'))
+)
+
+
+class Job(users.Model):
+    """
+    Work done in the background by a Celery task.
+    """
+    status = models.CharField(
+        _('status'),
+        max_length=1,
+        choices=JOB_STATUSES,
+        default=JOB_PENDING,
+        blank=True
+    )
+    error = models.TextField(
+        _('error'),
+        default="",
+        blank=True
+    )
+
+    @property
+    def is_finished(self):
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    class Meta:
+        abstract = True
+
+
+class PeriodInvoicingJob(Job):
+    """
+    Invoices every active affiliation of the period's lodge.
+    """
+    period = models.OneToOneField(
+        Period,
+        verbose_name=_('period'),
+        related_name='invoicing_job',
+        on_delete=models.PROTECT,
+        db_index=True
+    )
+    invoices_total = models.PositiveIntegerField(
+        _('invoices total'),
+        default=0,
+        blank=True
+    )
+    invoices_created = models.PositiveIntegerField(
+        _('invoices created'),
+        default=0,
+        blank=True
+    )
+    emails_total = models.PositiveIntegerField(
+        _('emails total'),
+        default=0,
+        blank=True
+    )
+    emails_queued = models.PositiveIntegerField(
+        _('emails queued'),
+        default=0,
+        blank=True
+    )
+    last_queued_invoice = models.ForeignKey(
+        'Invoice',
+        verbose_name=_('last queued invoice'),
+        related_name='+',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL
+    )
+
+    def __str__(self):
+        return str(self.period) + ' (' + self.get_status_display() + ')'
+
+    def get_absolute_url(self):
+        return reverse(
+            'treasure:period-status', kwargs={'pk': self.period_id}
+        )
+
+    class Meta:
+        verbose_name = _('period invoicing job')
+        verbose_name_plural = _('period invoicing jobs')
+        default_permissions = ('add', 'change', 'delete', 'view')
+        ordering = ['-created_on']
+
+
+class BalanceMailingJob(Job):
+    """
+    Emails their account balance to every active affiliation of the lodge.
+    """
+    lodge = models.ForeignKey(
+        users.Lodge,
+        verbose_name=_('lodge'),
+        related_name='balance_mailing_jobs',
+        related_query_name='balance_mailing_job',
+        on_delete=models.PROTECT,
+        db_index=True
+    )
+    emails_total = models.PositiveIntegerField(
+        _('emails total'),
+        default=0,
+        blank=True
+    )
+    emails_sent = models.PositiveIntegerField(
+        _('emails sent'),
+        default=0,
+        blank=True
+    )
+    emails_failed = models.PositiveIntegerField(
+        _('emails failed'),
+        default=0,
+        blank=True
+    )
+    failed_recipients = models.TextField(
+        _('failed recipients'),
+        default="",
+        blank=True
+    )
+
+    def __str__(self):
+        return str(self.lodge) + ' (' + self.get_status_display() + ')'
+
+    def get_absolute_url(self):
+        return reverse(
+            'treasure:balancemailingjob-detail', kwargs={'pk': self.pk}
+        )
+
+    class Meta:
+        verbose_name = _('balance mailing job')
+        verbose_name_plural = _('balance mailing jobs')
+        default_permissions = ('add', 'change', 'delete', 'view')
+        ordering = ['-created_on']
 
 
 class Invoice(users.Model):
@@ -528,6 +820,7 @@ class Deposit(users.Model):
     receipt = models.FileField(
         _('receipt'),
         upload_to='receipts',
+        storage=storage.receipt_storage,
         blank=True,
         null=True
     )
@@ -602,6 +895,7 @@ class GrandLodgeDeposit(users.Model):
     receipt = models.FileField(
         _('receipt'),
         upload_to='receipts',
+        storage=storage.receipt_storage,
         blank=True,
         null=True
     )
@@ -757,6 +1051,7 @@ class LodgeAccountEgress(users.Model):
     receipt = models.FileField(
         _('receipt'),
         upload_to='receipts',
+        storage=storage.receipt_storage,
         blank=True,
         null=True
     )
@@ -829,6 +1124,7 @@ class LodgeAccountIngress(users.Model):
     receipt = models.FileField(
         _('receipt'),
         upload_to='receipts',
+        storage=storage.receipt_storage,
         blank=True,
         null=True
     )
@@ -0,0 +1,144 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.http import Http404
+from django.utils.translation import ugettext_lazy as _
+
+from hijos.users import caching
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(
+        json.dumps([str(value) for value in values]).encode()
+    ).decode()
+
+
+def decode_cursor(cursor, fields):
+    """
+    Returns the values encoded in `cursor`, converted by their model fields.
+    Raises `ValueError` on a malformed cursor.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(values) != len(fields):
+            raise ValueError(cursor)
+        return [
+            field.to_python(value) for field, value in zip(fields, values)
+        ]
+    except (TypeError, ValidationError, UnicodeError) as e:
+        raise ValueError(cursor) from e
+
+
+class KeysetPage:
+    """
+    A page of a keyset paginated queryset. Unlike an offset page, there's no
+    total count, only a cursor pointing right after its last row.
+    """
+
+    def __init__(self, object_list, next_cursor, cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def keyset_paginate(queryset, ordering, cursor, per_page):
+    """
+    Returns the `KeysetPage` of `queryset`, sorted by `ordering`, that comes
+    right after `cursor` (or the first one if `cursor` is None).
+
+    The last field of `ordering` must be unique (usually the primary key), so
+    the page is found with an indexed range filter instead of an OFFSET that
+    has to skip every previous row.
+    """
+    names = [name.lstrip('-') for name in ordering]
+    queryset = queryset.order_by(*ordering)
+    if cursor is not None:
+        values = decode_cursor(
+            cursor, [queryset.model._meta.get_field(name) for name in names]
+        )
+        # (a, b) after (x, y) is: a > x OR (a = x AND b > y).
+        condition = None
+        for order, name, value in reversed(list(zip(ordering, names, values))):
+            lookup = '__lt' if order.startswith('-') else '__gt'
+            after = Q(**{name + lookup: value})
+            if condition is not None:
+                after |= Q(**{name: value}) & condition
+            condition = after
+        queryset = queryset.filter(condition)
+
+    rows = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(
+            [getattr(rows[-1], name) for name in names]
+        )
+    return KeysetPage(rows, next_cursor, cursor)
+
+
+class KeysetPaginationMixin:
+    """
+    Keyset pagination for `ListView`. The page is selected by the `cursor`
+    GET parameter and the `page_obj` in the context is a `KeysetPage`.
+    """
+    paginate_by = 50
+    keyset_ordering = ('-created_on', '-id')
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        try:
+            page = keyset_paginate(
+                queryset,
+                self.keyset_ordering,
+                self.request.GET.get(self.cursor_kwarg),
+                page_size
+            )
+        except ValueError:
+            raise Http404(_("Invalid cursor."))
+        return None, page, page.object_list, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Other GET parameters (filters) are kept when following the cursor.
+        query = self.request.GET.copy()
+        query.pop(self.cursor_kwarg, None)
+        context['cursor_query'] = query.urlencode()
+        return context
+
+
+class CachedKeysetPaginationMixin(KeysetPaginationMixin):
+    """
+    Keyset pagination for the lists of a lodge (`self.lodge`, set by
+    `get_queryset`) whose pages are cached until the lodge's version changes
+    (see `hijos.users.caching`).
+    """
+
+    def paginate_queryset(self, queryset, page_size):
+        return caching.cached(
+            caching.lodge_key(
+                self.lodge,
+                type(self).__name__,
+                self.request.GET.get(self.cursor_kwarg),
+                page_size
+            ),
+            lambda: super(
+                CachedKeysetPaginationMixin, self
+            ).paginate_queryset(queryset, page_size)
+        )
@@ -0,0 +1,486 @@
+from collections import OrderedDict, defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Value, When
+from django.utils import timezone
+
+from hijos.treasure import checkpoints, models, rollups
+from hijos.users import caching
+
+BALANCE_FIELD = DecimalField(max_digits=15, decimal_places=2)
+
+
+def post_account_delta(account_id, amount, user):
+    """
+    Adds `amount` to the balance of the account and returns the resulting
+    balance.
+
+    The balance is changed by the database with an F() expression instead of
+    being read, modified and saved from Python. The UPDATE locks the row (on
+    SQLite, the whole database, which serializes every writer) until the
+    transaction ends, so the balance read back right after it is the one
+    this posting produced and concurrent postings can't lose each other's
+    updates.
+    """
+    with transaction.atomic():
+        models.Account.objects.filter(pk=account_id).update(
+            balance=F('balance') + amount,
+            last_modified_by=user,
+            last_modified_on=timezone.now()
+        )
+        return models.Account.objects.values_list(
+            'balance', flat=True
+        ).get(pk=account_id)
+
+
+def post_lodge_account_delta(lodge_account_id, amount, user):
+    """
+    Adds `amount` to the balance of the lodge account and to the global
+    account of its lodge, and returns the resulting lodge account balance.
+
+    See `post_account_delta`.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        models.LodgeAccount.objects.filter(pk=lodge_account_id).update(
+            balance=F('balance') + amount,
+            last_modified_by=user,
+            last_modified_on=now
+        )
+        models.LodgeGlobalAccount.objects.filter(
+            lodge__affiliation__lodge_account=lodge_account_id
+        ).update(
+            balance=F('balance') + amount,
+            last_modified_by=user,
+            last_modified_on=now
+        )
+        return models.LodgeAccount.objects.values_list(
+            'balance', flat=True
+        ).get(pk=lodge_account_id)
+
+
+def apply_deltas(queryset, key, deltas, user, now, batch_size):
+    """
+    Adds to the balance of every row of `queryset` the delta mapped to its
+    `key` in `deltas`.
+
+    Rows sharing the same delta are grouped in the same WHEN, so posting a
+    batch costs one UPDATE per `batch_size` rows. Without a `user`, the
+    last modification of the rows is left as it was.
+    """
+    modified = {}
+    if user is not None:
+        modified = {'last_modified_by': user, 'last_modified_on': now}
+    keys = list(deltas)
+    for i in range(0, len(keys), batch_size):
+        chunk = defaultdict(list)
+        for k in keys[i:i + batch_size]:
+            chunk[deltas[k]].append(k)
+        queryset.filter(**{key + '__in': keys[i:i + batch_size]}).update(
+            balance=F('balance') + Case(
+                *[
+                    When(**{key + '__in': chunk_keys, 'then': Value(delta)})
+                    for delta, chunk_keys in chunk.items()
+                ],
+                output_field=BALANCE_FIELD
+            ),
+            **modified
+        )
+
+
+def bulk_insert(model, objects):
+    """
+    Inserts the objects with `bulk_create` and sets their primary keys, so
+    they can be posted right after. Must run in a transaction, or it raises
+    `TransactionManagementError`.
+    """
+    if not transaction.get_connection().in_atomic_block:
+        # Outside of one, the rows inserted by someone else between the
+        # insert and the read of the keys would be taken for these ones.
+        raise transaction.TransactionManagementError(
+            'bulk_insert() must run in a transaction.'
+        )
+    model.objects.bulk_create(objects)
+    if objects and objects[0].pk is None:
+        # Only PostgreSQL returns the ids of bulk inserted rows. On SQLite,
+        # the transaction holds the write lock since the insert, so the
+        # newest rows are these ones, in order.
+        pks = model.objects.order_by('-pk').values_list(
+            'pk', flat=True
+        )[:len(objects)]
+        for obj, pk in zip(objects, reversed(list(pks))):
+            obj.pk = pk
+    return objects
+
+
+def running_balances(entries, balances):
+    """
+    Given the `(key, amount)` of every entry, in posting order, and the
+    balance of every key after all of them were applied, returns the balance
+    right after each entry.
+    """
+    totals = defaultdict(int)
+    for key, amount in entries:
+        totals[key] += amount
+    running = {key: balances[key] - totals[key] for key in totals}
+    result = []
+    for key, amount in entries:
+        running[key] += amount
+        result.append(running[key])
+    return result
+
+
+class PostingService:
+    """
+    Writes the account and lodge account movements of a batch of source
+    documents (invoices, charges, deposits, grand lodge deposits, lodge
+    account ingresses, egresses and transfers) together with the resulting
+    balances, in a single transaction.
+
+    Every balance is updated once per batch with a set-based UPDATE and read
+    back right after (see `post_account_delta`), and the movements are
+    inserted with `bulk_create`, so posting doesn't go through the
+    `post_save` receivers of the movements. The version of every lodge
+    touched is bumped once per batch, which invalidates what's cached for it.
+    """
+    batch_size = 300
+
+    def __init__(self, user):
+        self.user = user
+
+    def account_entries(self, document):
+        """
+        Returns the `(affiliation id, amount, movement type)` of every
+        account movement the document produces.
+        """
+        if type(document) is models.Invoice:
+            return [(
+                document.affiliation_id,
+                -document.amount,
+                models.ACCOUNTMOVEMENT_INVOICE
+            )]
+        elif type(document) is models.Charge:
+            return [(
+                document.debtor_id,
+                -document.amount,
+                models.ACCOUNTMOVEMENT_CHARGE
+            )]
+        elif type(document) is models.Deposit:
+            return [(
+                document.payer_id,
+                document.amount,
+                models.ACCOUNTMOVEMENT_DEPOSIT
+            )]
+        elif type(document) is models.GrandLodgeDeposit:
+            return [(
+                document.payer_id,
+                document.amount,
+                models.ACCOUNTMOVEMENT_GRANDLODGEDEPOSIT
+            )]
+        return []
+
+    def lodge_account_entries(self, document):
+        """
+        Returns the `(lodge account id, amount, movement type)` of every
+        lodge account movement the document produces.
+        """
+        if type(document) is models.Deposit:
+            return [(
+                document.lodge_account_id,
+                document.amount,
+                models.LODGEACCOUNTMOVEMENT_DEPOSIT
+            )]
+        elif type(document) is models.LodgeAccountIngress:
+            return [(
+                document.lodge_account_id,
+                document.amount,
+                models.LODGEACCOUNTMOVEMENT_INGRESS
+            )]
+        elif type(document) is models.LodgeAccountEgress:
+            return [(
+                document.lodge_account_id,
+                -document.amount,
+                models.LODGEACCOUNTMOVEMENT_EGRESS
+            )]
+        elif type(document) is models.LodgeAccountTransfer:
+            return [
+                (
+                    document.lodge_account_from_id,
+                    -document.amount,
+                    models.LODGEACCOUNTMOVEMENT_TRANSFER
+                ),
+                (
+                    document.lodge_account_to_id,
+                    document.amount,
+                    models.LODGEACCOUNTMOVEMENT_TRANSFER
+                )
+            ]
+        return []
+
+    def post(self, documents):
+        """
+        Posts the documents, which must already be saved, in the given order.
+        """
+        now = timezone.now()
+        account_entries = [
+            (document, entry)
+            for document in documents
+            for entry in self.account_entries(document)
+        ]
+        lodge_account_entries = [
+            (document, entry)
+            for document in documents
+            for entry in self.lodge_account_entries(document)
+        ]
+        lodges = set()
+        with transaction.atomic():
+            if account_entries:
+                lodges |= self.post_accounts(account_entries, now)
+            if lodge_account_entries:
+                lodges |= self.post_lodge_accounts(lodge_account_entries, now)
+            caching.bump_lodges(lodges)
+
+    def post_accounts(self, entries, now):
+        deltas = OrderedDict()
+        for document, (affiliation_id, amount, movement_type) in entries:
+            deltas[affiliation_id] = deltas.get(affiliation_id, 0) + amount
+
+        accounts = models.Account.objects.all()
+        apply_deltas(
+            accounts, 'affiliation', deltas, self.user, now, self.batch_size
+        )
+        fields = ('affiliation_id', 'id', 'affiliation__lodge_id')
+        rows = self.read_balances(accounts, 'affiliation', deltas, fields)
+        if len(rows) < len(deltas):
+            # Every affiliation should have an account, but just in case.
+            models.Account.objects.bulk_create([
+                models.Account(
+                    affiliation_id=affiliation_id,
+                    balance=delta,
+                    created_by=self.user,
+                    last_modified_by=self.user
+                )
+                for affiliation_id, delta in deltas.items()
+                if affiliation_id not in rows
+            ])
+            rows = self.read_balances(accounts, 'affiliation', deltas, fields)
+
+        balances = running_balances(
+            [(entry[0], entry[1]) for document, entry in entries],
+            {key: balance for key, (pk, lodge_id, balance) in rows.items()}
+        )
+        models.AccountMovement.objects.bulk_create([
+            models.AccountMovement(
+                object_ct=ContentType.objects.get_for_model(document),
+                object_id=document.pk,
+                account_id=rows[affiliation_id][0],
+                account_movement_type=movement_type,
+                amount=amount,
+                balance=balance,
+                created_by_id=document.created_by_id,
+                last_modified_by_id=document.last_modified_by_id
+            )
+            for (document, (affiliation_id, amount, movement_type)), balance
+            in zip(entries, balances)
+        ], batch_size=self.batch_size)
+        rollups.update_debts('affiliation', deltas, self.batch_size)
+        today = timezone.localdate(now)
+        rollups.update_monthly(models.ROLLUP_ACCOUNTS, (
+            (rows[affiliation_id][1], today, movement_type, amount, 1)
+            for document, (affiliation_id, amount, movement_type) in entries
+        ))
+        return {lodge_id for pk, lodge_id, balance in rows.values()}
+
+    def post_lodge_accounts(self, entries, now):
+        deltas = OrderedDict()
+        for document, (lodge_account_id, amount, movement_type) in entries:
+            deltas[lodge_account_id] = deltas.get(lodge_account_id, 0) + amount
+
+        lodge_accounts = models.LodgeAccount.objects.all()
+        apply_deltas(
+            lodge_accounts, 'pk', deltas, self.user, now, self.batch_size
+        )
+        rows = self.read_balances(
+            lodge_accounts, 'pk', deltas, ('id', 'handler__lodge_id')
+        )
+
+        lodge_deltas = OrderedDict()
+        for lodge_account_id, delta in deltas.items():
+            lodge_id = rows[lodge_account_id][0]
+            lodge_deltas[lodge_id] = lodge_deltas.get(lodge_id, 0) + delta
+        apply_deltas(
+            models.LodgeGlobalAccount.objects.all(),
+            'lodge',
+            lodge_deltas,
+            self.user,
+            now,
+            self.batch_size
+        )
+
+        balances = running_balances(
+            [(entry[0], entry[1]) for document, entry in entries],
+            {key: balance for key, (lodge_id, balance) in rows.items()}
+        )
+        models.LodgeAccountMovement.objects.bulk_create([
+            models.LodgeAccountMovement(
+                object_ct=ContentType.objects.get_for_model(document),
+                object_id=document.pk,
+                lodge_account_id=lodge_account_id,
+                lodgeaccount_movement_type=movement_type,
+                amount=amount,
+                balance=balance,
+                created_by_id=document.created_by_id,
+                last_modified_by_id=document.last_modified_by_id
+            )
+            for (document, (lodge_account_id, amount, movement_type)), balance
+            in zip(entries, balances)
+        ], batch_size=self.batch_size)
+        today = timezone.localdate(now)
+        rollups.update_monthly(models.ROLLUP_LODGEACCOUNTS, (
+            (rows[lodge_account_id][0], today, movement_type, amount, 1)
+            for document, (lodge_account_id, amount, movement_type) in entries
+        ))
+        return set(lodge_deltas)
+
+    def read_balances(self, queryset, key, keys, fields):
+        """
+        Returns `{key: (other fields..., balance)}` for the rows matching
+        `keys`, `fields` being the key and the other fields.
+        """
+        keys = list(keys)
+        rows = {}
+        for i in range(0, len(keys), self.batch_size):
+            rows.update(
+                (row[0], row[1:])
+                for row in queryset.filter(
+                    **{key + '__in': keys[i:i + self.batch_size]}
+                ).values_list(*fields, 'balance')
+            )
+        return rows
+
+    def set_active(self, documents, is_active):
+        """
+        Activates or deactivates the movements of the documents, applying or
+        reverting their amounts to the balances.
+
+        Running balances of later movements aren't rewritten, see the
+        `verify_ledger` command.
+        """
+        now = timezone.now()
+        sign = 1 if is_active else -1
+        documents_by_ct = defaultdict(list)
+        for document in documents:
+            documents_by_ct[
+                ContentType.objects.get_for_model(document)
+            ].append(document.pk)
+
+        lodges = set()
+        with transaction.atomic():
+            for object_ct, object_ids in documents_by_ct.items():
+                movements = models.AccountMovement.objects.filter(
+                    object_ct=object_ct,
+                    object_id__in=object_ids
+                ).exclude(is_active=is_active)
+                deltas = defaultdict(int)
+                changes = []
+                rolled_up = []
+                for (
+                    account_id, lodge_id, created_on, movement_type, amount
+                ) in movements.values_list(
+                    'account_id',
+                    'account__affiliation__lodge_id',
+                    'created_on',
+                    'account_movement_type',
+                    'amount'
+                ):
+                    deltas[account_id] += sign * amount
+                    changes.append((account_id, created_on, sign * amount))
+                    rolled_up.append((
+                        lodge_id,
+                        timezone.localdate(created_on),
+                        movement_type,
+                        sign * amount,
+                        sign
+                    ))
+                if deltas:
+                    movements.update(
+                        is_active=is_active,
+                        last_modified_by=self.user,
+                        last_modified_on=now
+                    )
+                    apply_deltas(
+                        models.Account.objects.all(),
+                        'pk',
+                        deltas,
+                        self.user,
+                        now,
+                        self.batch_size
+                    )
+                    rollups.update_debts('pk', deltas, self.batch_size)
+                    rollups.update_monthly(models.ROLLUP_ACCOUNTS, rolled_up)
+                    lodges.update(entry[0] for entry in rolled_up)
+                    checkpoints.shift_checkpoints(
+                        models.Account, changes, self.batch_size
+                    )
+
+                movements = models.LodgeAccountMovement.objects.filter(
+                    object_ct=object_ct,
+                    object_id__in=object_ids
+                ).exclude(is_active=is_active)
+                deltas = defaultdict(int)
+                lodge_deltas = defaultdict(int)
+                changes = []
+                rolled_up = []
+                for (
+                    lodge_account_id, lodge_id, created_on, movement_type,
+                    amount
+                ) in movements.values_list(
+                    'lodge_account_id',
+                    'lodge_account__handler__lodge_id',
+                    'created_on',
+                    'lodgeaccount_movement_type',
+                    'amount'
+                ):
+                    deltas[lodge_account_id] += sign * amount
+                    lodge_deltas[lodge_id] += sign * amount
+                    changes.append(
+                        (lodge_account_id, created_on, sign * amount)
+                    )
+                    rolled_up.append((
+                        lodge_id,
+                        timezone.localdate(created_on),
+                        movement_type,
+                        sign * amount,
+                        sign
+                    ))
+                if deltas:
+                    movements.update(
+                        is_active=is_active,
+                        last_modified_by=self.user,
+                        last_modified_on=now
+                    )
+                    apply_deltas(
+                        models.LodgeAccount.objects.all(),
+                        'pk',
+                        deltas,
+                        self.user,
+                        now,
+                        self.batch_size
+                    )
+                    apply_deltas(
+                        models.LodgeGlobalAccount.objects.all(),
+                        'lodge',
+                        lodge_deltas,
+                        self.user,
+                        now,
+                        self.batch_size
+                    )
+                    rollups.update_monthly(
+                        models.ROLLUP_LODGEACCOUNTS, rolled_up
+                    )
+                    lodges.update(lodge_deltas)
+                    checkpoints.shift_checkpoints(
+                        models.LodgeAccount, changes, self.batch_size
+                    )
+            caching.bump_lodges(lodges)
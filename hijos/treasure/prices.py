@@ -0,0 +1,101 @@
+from bisect import bisect_right
+from collections import defaultdict
+
+from django.utils.translation import ugettext_lazy as _
+
+from hijos.users import models as users
+
+
+class PriceNotFound(LookupError):
+    """
+    There's no single price of a category in force during a range: none or
+    more than one.
+    """
+
+
+class PriceBook:
+    """
+    The active category prices, in memory. Every category has its prices
+    sorted by `date_from`, so the ones in force on a day are found with a
+    bisect instead of a query.
+    """
+
+    def __init__(self, rows):
+        """
+        `rows` are the `(category id, date from, date until, price)` of the
+        prices.
+        """
+        self.rows = rows
+        by_category = defaultdict(list)
+        for category_id, date_from, date_until, price in rows:
+            by_category[category_id].append((date_from, date_until, price))
+        self.categories = {}
+        for category_id, prices in by_category.items():
+            prices.sort(key=lambda price: price[0])
+            # reach[i] is the latest `date_until` of the first i + 1 prices,
+            # so a lookup stops as soon as no earlier price can cover it.
+            reach = []
+            for date_from, date_until, price in prices:
+                reach.append(max(reach[-1:] + [date_until]))
+            self.categories[category_id] = (
+                [date_from for date_from, date_until, price in prices],
+                [date_until for date_from, date_until, price in prices],
+                [price for date_from, date_until, price in prices],
+                reach
+            )
+
+    def prices(self, category_id, begin, end=None):
+        """
+        Returns every price of the category in force during the whole range
+        from `begin` to `end` (the day `begin` if no `end`).
+        """
+        end = end or begin
+        if category_id not in self.categories:
+            return []
+        froms, untils, prices, reach = self.categories[category_id]
+        found = []
+        i = bisect_right(froms, begin) - 1
+        while i >= 0 and reach[i] >= end:
+            if untils[i] >= end:
+                found.append(prices[i])
+            i -= 1
+        return found
+
+    def price(self, category_id, begin, end=None):
+        """
+        Returns the only price of the category in force during the whole
+        range. Raises `PriceNotFound` if there's none or more than one.
+        """
+        prices = self.prices(category_id, begin, end)
+        if len(prices) > 1:
+            raise PriceNotFound(_("More than one price found."))
+        if not prices:
+            raise PriceNotFound(_("Category's price not found."))
+        return prices[0]
+
+
+_book = None
+
+
+def get_price_book():
+    """
+    Returns the `PriceBook` of the active prices, building it again only if
+    they changed.
+
+    Prices can change from any process (web workers, Celery) and the cache
+    is per process, so every call reads the active prices with a single
+    query (there's a handful of them) and compares them with the ones the
+    book was built from. Get the book once per operation and use it for all
+    of its lookups.
+    """
+    global _book
+    rows = tuple(
+        users.CategoryPrice.objects.filter(
+            is_active=True
+        ).order_by('pk').values_list(
+            'category_id', 'date_from', 'date_until', 'price'
+        )
+    )
+    if _book is None or _book.rows != rows:
+        _book = PriceBook(rows)
+    return _book
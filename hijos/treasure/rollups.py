@@ -0,0 +1,306 @@
+from collections import OrderedDict, defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, Max, Min, Q, Sum, When
+from django.utils import timezone
+
+from hijos.treasure import models
+
+ZERO = Decimal('0.00')
+
+AGING_BUCKETS = (
+    ('debt_0_30', 0, 30),
+    ('debt_31_90', 31, 90),
+    ('debt_91_180', 91, 180),
+    ('debt_over_180', 181, None)
+)
+
+
+def aging_bucket(debt_since, today):
+    """
+    Returns the summary field a debt started on `debt_since` is aged into.
+    """
+    if debt_since is None:
+        return None
+    days = (today - debt_since).days
+    for name, days_from, days_until in AGING_BUCKETS:
+        if days_until is None or days <= days_until:
+            return name
+
+
+def aged_debt(today, days_from, days_until):
+    """
+    The SQL counterpart of `aging_bucket`: sums the balances aged into the
+    bucket.
+    """
+    condition = Q(debt_since__isnull=False)
+    if days_from:
+        condition &= Q(debt_since__lte=today - timedelta(days=days_from))
+    if days_until is not None:
+        condition &= Q(debt_since__gte=today - timedelta(days=days_until))
+    return Sum(
+        Case(
+            When(condition, then='balance'),
+            default=ZERO,
+            output_field=DecimalField(max_digits=15, decimal_places=2)
+        )
+    )
+
+
+def refresh_debt_summaries(lodge_ids, today=None):
+    """
+    Recomputes from scratch the debt summary of every lodge, with one
+    aggregate query for all of them.
+    """
+    lodge_ids = sorted(set(lodge_ids))
+    if not lodge_ids:
+        return
+    today = today or timezone.localdate()
+    with transaction.atomic():
+        models.LodgeDebtSummary.objects.bulk_create(
+            [models.LodgeDebtSummary(lodge_id=pk) for pk in lodge_ids],
+            ignore_conflicts=True
+        )
+        list(
+            models.LodgeDebtSummary.objects.select_for_update().filter(
+                lodge__in=lodge_ids
+            ).order_by('lodge').values_list('pk', flat=True)
+        )
+        totals = {
+            row.pop('affiliation__lodge'): row
+            for row in models.Account.objects.filter(
+                affiliation__lodge__in=lodge_ids,
+                balance__lt=ZERO
+            ).order_by().values('affiliation__lodge').annotate(
+                debtors=Count('id'),
+                debt_sum=Sum('balance'),
+                debt_min=Min('balance'),
+                debt_max=Max('balance'),
+                **{
+                    name: aged_debt(today, days_from, days_until)
+                    for name, days_from, days_until in AGING_BUCKETS
+                }
+            )
+        }
+        for lodge_id in lodge_ids:
+            row = totals.get(lodge_id, {
+                'debtors': 0,
+                'debt_sum': ZERO,
+                'debt_min': None,
+                'debt_max': None,
+                **{name: ZERO for name, days_from, days_until in AGING_BUCKETS}
+            })
+            models.LodgeDebtSummary.objects.filter(lodge=lodge_id).update(
+                aged_on=today, **row
+            )
+
+
+def apply_debt_changes(summary, changes, today):
+    """
+    Applies to the summary the `(old balance, old debt date, balance, debt
+    date)` of every account of its lodge that changed.
+
+    Counts, sums and buckets are adjusted by difference. The minimum and
+    maximum only are too while no account that held them moves; otherwise
+    they're queried again.
+    """
+    extremes = (summary.debt_min, summary.debt_max)
+    extremes_moved = False
+    for old_balance, old_since, balance, since in changes:
+        if old_balance < ZERO:
+            summary.debtors -= 1
+            summary.debt_sum -= old_balance
+            bucket = aging_bucket(old_since, today)
+            if bucket:
+                setattr(summary, bucket, getattr(summary, bucket) - old_balance)
+            extremes_moved |= old_balance in extremes
+        if balance < ZERO:
+            summary.debtors += 1
+            summary.debt_sum += balance
+            bucket = aging_bucket(since, today)
+            if bucket:
+                setattr(summary, bucket, getattr(summary, bucket) + balance)
+            if summary.debt_min is None or balance < summary.debt_min:
+                summary.debt_min = balance
+            if summary.debt_max is None or balance > summary.debt_max:
+                summary.debt_max = balance
+
+    if extremes_moved:
+        extremes = models.Account.objects.filter(
+            affiliation__lodge=summary.lodge_id,
+            balance__lt=ZERO
+        ).aggregate(debt_min=Min('balance'), debt_max=Max('balance'))
+        summary.debt_min = extremes['debt_min']
+        summary.debt_max = extremes['debt_max']
+    summary.save()
+
+
+def update_debts(key, deltas, batch_size=300):
+    """
+    Given the balance deltas just applied to some accounts, mapped to their
+    `key`, dates the debts that just started, clears the ones paid off and
+    updates the debt summaries of their lodges by difference.
+
+    The summary rows are locked while being updated, so concurrent postings
+    to the same lodge apply their differences one after the other. A
+    summary missing, or aged on another day, is recomputed instead.
+    """
+    today = timezone.localdate()
+    key_field = 'affiliation_id' if key == 'affiliation' else 'id'
+    keys = list(deltas)
+    rows = []
+    for i in range(0, len(keys), batch_size):
+        rows.extend(
+            models.Account.objects.filter(
+                **{key + '__in': keys[i:i + batch_size]}
+            ).values_list(
+                key_field, 'id', 'affiliation__lodge', 'balance', 'debt_since'
+            )
+        )
+
+    started = []
+    paid_off = []
+    changes = defaultdict(list)
+    for k, account_id, lodge_id, balance, debt_since in rows:
+        since = debt_since
+        if balance < ZERO and debt_since is None:
+            since = today
+            started.append(account_id)
+        elif balance >= ZERO and debt_since is not None:
+            since = None
+            paid_off.append(account_id)
+        changes[lodge_id].append(
+            (balance - deltas[k], debt_since, balance, since)
+        )
+
+    with transaction.atomic():
+        for i in range(0, len(started), batch_size):
+            models.Account.objects.filter(
+                pk__in=started[i:i + batch_size]
+            ).update(debt_since=today)
+        for i in range(0, len(paid_off), batch_size):
+            models.Account.objects.filter(
+                pk__in=paid_off[i:i + batch_size]
+            ).update(debt_since=None)
+
+        summaries = {
+            summary.pk: summary
+            for summary in models.LodgeDebtSummary.objects.select_for_update(
+            ).filter(lodge__in=list(changes)).order_by('lodge')
+        }
+        stale = []
+        for lodge_id, lodge_changes in changes.items():
+            summary = summaries.get(lodge_id)
+            if summary is None or summary.aged_on != today:
+                stale.append(lodge_id)
+            else:
+                apply_debt_changes(summary, lodge_changes, today)
+        refresh_debt_summaries(stale, today)
+
+
+def update_monthly(ledger, entries):
+    """
+    Adds the `(lodge id, day, movement type, amount, movements)` of the
+    movements just posted (or deactivated, with the amount and movements
+    negated) to the monthly rollups of their lodges.
+
+    Entries are summed by lodge, month and type first, so a batch costs one
+    UPDATE per distinct total (a handful) whatever its number of movements.
+    """
+    totals = defaultdict(lambda: [ZERO, 0])
+    for lodge_id, day, movement_type, amount, movements in entries:
+        total = totals[(lodge_id, day.replace(day=1), movement_type)]
+        total[0] += amount
+        total[1] += movements
+    if not totals:
+        return
+    with transaction.atomic():
+        models.LodgeMonthlyRollup.objects.bulk_create(
+            [
+                models.LodgeMonthlyRollup(
+                    lodge_id=lodge_id,
+                    month=month,
+                    ledger=ledger,
+                    movement_type=movement_type
+                )
+                for lodge_id, month, movement_type in totals
+            ],
+            ignore_conflicts=True
+        )
+        # Always in the same order, so concurrent postings don't deadlock.
+        for (lodge_id, month, movement_type), (amount, movements) in sorted(
+            totals.items()
+        ):
+            models.LodgeMonthlyRollup.objects.filter(
+                lodge=lodge_id,
+                month=month,
+                ledger=ledger,
+                movement_type=movement_type
+            ).update(
+                amount=F('amount') + amount,
+                movements=F('movements') + movements
+            )
+
+
+def add_months(month, count):
+    """
+    Returns the first day of the month `count` months after (or before, if
+    negative) the one of `month`.
+    """
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def monthly_summary(lodge_id, balance, months=12, today=None):
+    """
+    Returns the totals of the last `months` months of a lodge (the current
+    one included), oldest first, read from its monthly rollups with a single
+    query. Invoiced counts charges too.
+
+    `balance` is the current global balance of the lodge; the balance at the
+    end of every month is worked back from it.
+    """
+    current = (today or timezone.localdate()).replace(day=1)
+    summary = OrderedDict(
+        (month, {
+            'month': month,
+            'ingress': ZERO,
+            'egress': ZERO,
+            'deposits': ZERO,
+            'invoiced': ZERO,
+            'collected': ZERO,
+            'net': ZERO
+        })
+        for month in (
+            add_months(current, i) for i in range(1 - months, 1)
+        )
+    )
+    rows = models.LodgeMonthlyRollup.objects.filter(
+        lodge=lodge_id,
+        month__gte=add_months(current, 1 - months)
+    ).values_list('month', 'ledger', 'movement_type', 'amount')
+    for month, ledger, movement_type, amount in rows:
+        row = summary.get(month)
+        if row is None:
+            continue
+        if ledger == models.ROLLUP_LODGEACCOUNTS:
+            row['net'] += amount
+            if movement_type == models.LODGEACCOUNTMOVEMENT_INGRESS:
+                row['ingress'] += amount
+            elif movement_type == models.LODGEACCOUNTMOVEMENT_EGRESS:
+                row['egress'] -= amount
+            elif movement_type == models.LODGEACCOUNTMOVEMENT_DEPOSIT:
+                row['deposits'] += amount
+        elif movement_type in (
+            models.ACCOUNTMOVEMENT_INVOICE, models.ACCOUNTMOVEMENT_CHARGE
+        ):
+            row['invoiced'] -= amount
+        else:
+            row['collected'] += amount
+
+    for row in reversed(summary.values()):
+        row['balance'] = balance
+        balance -= row['net']
+    return list(summary.values())
@@ -1,116 +1,86 @@
-from django.db.models import Q
+from django.db import transaction
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
-from hijos.treasure import models
-from hijos.users import models as users
+from hijos.treasure import checkpoints, invoicing, models, posting, rollups, tasks
+from hijos.users import caching
+
+# The lookup from every model listed by lodge to its lodge.
+LODGE_LOOKUPS = {
+    models.Period: 'lodge',
+    models.Invoice: 'affiliation__lodge',
+    models.Charge: 'debtor__lodge',
+    models.Deposit: 'payer__lodge',
+    models.GrandLodgeDeposit: 'payer__lodge',
+    models.LodgeAccount: 'handler__lodge',
+    models.LodgeAccountIngress: 'lodge_account__handler__lodge',
+    models.LodgeAccountEgress: 'lodge_account__handler__lodge',
+    models.LodgeAccountTransfer: 'lodge_account_from__handler__lodge',
+    models.AccountMovement: 'account__affiliation__lodge',
+    models.LodgeAccountMovement: 'lodge_account__handler__lodge'
+}
 
 
 def period(sender, instance, created, raw, **kwargs):
     if created and not raw:
-        affiliations = users.Affiliation.objects.filter(
-            lodge=instance.lodge,
-            is_active=True
+        job = models.PeriodInvoicingJob.objects.create(
+            period=instance,
+            created_by=instance.created_by,
+            last_modified_by=instance.last_modified_by
         )
-        for affiliation in affiliations.all():
-            try:
-                category_price = users.CategoryPrice.objects.get(
-                    Q(category=affiliation.category),
-                    Q(is_active=True),
-                    Q(date_from__lte=instance.begin),
-                    Q(date_until__gte=instance.begin),
-                    Q(date_from__lte=instance.end),
-                    Q(date_until__gte=instance.end)
-                )
-            except users.CategoryPrice.DoesNotExist:
-                raise Exception(_("Category's price not found."))
-            except users.CategoryPrice.MultipleObjectsReturned:
-                raise Exception(_("More than one price found."))
-            else:
-                models.Invoice.objects.create(
-                    period=instance,
-                    affiliation=affiliation,
-                    amount=category_price.price * instance.price_multiplier,
-                    send_email=instance.send_email,
-                    created_by=instance.created_by,
-                    last_modified_by=instance.last_modified_by
-                )
+        tasks.delay_on_commit(tasks.invoice_period, job.pk)
 
 
-def invoice_and_charge(sender, instance, created, update_fields, raw, **kwargs):
-    if created and not raw:
-        if type(instance) is models.Invoice:
-            affiliation = instance.affiliation
-        elif type(instance) is models.Charge:
-            affiliation = instance.debtor
+def lodge_version(sender, instance, raw=False, **kwargs):
+    # Saved or deleted: the lodge is looked up from the foreign key of the
+    # instance, since a deleted row can't be joined anymore.
+    if not raw:
+        name, *path = LODGE_LOOKUPS[sender].split('__', 1)
+        field = sender._meta.get_field(name)
+        related_id = getattr(instance, field.attname)
+        if not path:
+            caching.bump_lodges([related_id])
         else:
-            affiliation = ""
+            caching.bump_lodges(
+                field.related_model.objects.filter(
+                    pk=related_id
+                ).values(path[0])
+            )
 
-        account, new = models.Account.objects.get_or_create(
-            affiliation=affiliation
-        )
-        if type(instance) is models.Invoice:
-            account_movement_type = models.ACCOUNTMOVEMENT_INVOICE
-            title = _("New invoice")
-            content = _(
-                "A new invoice has been issued to you for the period "
-                "%(period)s of an amount $ %(amount)s."
-            ) % {
-                'period': str(instance.period),
-                'amount': str(instance.amount)
-            }
-        elif type(instance) is models.Charge:
-            account_movement_type = models.ACCOUNTMOVEMENT_CHARGE
-            title = _("New charge")
-            content = _(
-                "A new charge has been issued to you of an amount $ %(amount)s."
-            ) % {'amount': str(instance.amount)}
-        else:
-            raise Exception(_("Invalid account movement type."))
 
-        models.AccountMovement.objects.create(
-            content_object=instance,
-            account=account,
-            account_movement_type=account_movement_type,
-            amount=-instance.amount,
-            balance=account.balance - instance.amount,
-            created_by=instance.created_by,
-            last_modified_by=instance.last_modified_by
-        )
+def post(instance):
+    posting.PostingService(instance.last_modified_by).post([instance])
+
+
+def set_active(instance):
+    posting.PostingService(instance.last_modified_by).set_active(
+        [instance], instance.is_active
+    )
+
+
+def invoice_and_charge(sender, instance, created, update_fields, raw, **kwargs):
+    if created and not raw:
+        post(instance)
         if instance.send_email:
+            if type(instance) is models.Invoice:
+                affiliation = instance.affiliation
+                title, content = invoicing.invoice_email(instance)
+            else:
+                affiliation = instance.debtor
+                title = _("New charge")
+                content = _(
+                    "A new charge has been issued to you of an amount "
+                    "$ %(amount)s."
+                ) % {'amount': str(instance.amount)}
             affiliation.account.send_treasure_mail(title, content)
 
     elif not created and update_fields and 'is_active' in update_fields:
-        instance.account_movement.is_active = instance.is_active
-        instance.account_movement.last_modified_by = instance.last_modified_by
-        instance.account_movement.save(
-            update_fields=('is_active', 'last_modified_by', 'last_modified_on')
-        )
+        set_active(instance)
 
 
 def deposit(sender, instance, created, update_fields, raw, **kwargs):
     if created and not raw:
-        account, new = models.Account.objects.get_or_create(
-            affiliation=instance.payer
-        )
-
-        models.AccountMovement.objects.create(
-            content_object=instance,
-            account=account,
-            account_movement_type=models.ACCOUNTMOVEMENT_DEPOSIT,
-            amount=instance.amount,
-            balance=account.balance + instance.amount,
-            created_by=instance.created_by,
-            last_modified_by=instance.last_modified_by
-        )
-        models.LodgeAccountMovement.objects.create(
-            content_object=instance,
-            lodge_account=instance.lodge_account,
-            lodgeaccount_movement_type=models.LODGEACCOUNTMOVEMENT_DEPOSIT,
-            amount=instance.amount,
-            balance=instance.lodge_account.balance + instance.amount,
-            created_by=instance.created_by,
-            last_modified_by=instance.last_modified_by
-        )
+        post(instance)
         if instance.send_email:
             title = _("New deposit")
             content = _(
@@ -120,53 +90,97 @@ def deposit(sender, instance, created, update_fields, raw, **kwargs):
             instance.payer.account.send_treasure_mail(title, content)
 
     elif not created and update_fields and 'is_active' in update_fields:
-        instance.account_movement.is_active = instance.is_active
-        instance.account_movement.last_modified_by = instance.last_modified_by
-        instance.account_movement.save(
-            update_fields=('is_active', 'last_modified_by', 'last_modified_on')
-        )
-        instance.lodge_account_movement.is_active = instance.is_active
-        instance.lodge_account_movement.last_modified_by = (
-            instance.last_modified_by
-        )
-        instance.lodge_account_movement.save(
-            update_fields=('is_active', 'last_modified_by', 'last_modified_on')
-        )
+        set_active(instance)
 
 
 def account_movement(sender, instance, created, update_fields, raw, **kwargs):
     if created and not raw:
-        instance.account.balance += instance.amount
+        with transaction.atomic():
+            # The running balance is taken from the locked account row, not
+            # from whatever (possibly stale) balance the movement was created
+            # with.
+            instance.balance = posting.post_account_delta(
+                instance.account_id, instance.amount, instance.last_modified_by
+            )
+            models.AccountMovement.objects.filter(pk=instance.pk).update(
+                balance=instance.balance
+            )
+            rollups.update_debts('pk', {instance.account_id: instance.amount})
+            account_movement_roll_up(instance, instance.amount, 1)
     elif not created and update_fields and 'is_active' in update_fields:
-        instance.account.balance += -instance.amount
+        amount = instance.amount if instance.is_active else -instance.amount
+        with transaction.atomic():
+            posting.post_account_delta(
+                instance.account_id, amount, instance.last_modified_by
+            )
+            rollups.update_debts('pk', {instance.account_id: amount})
+            account_movement_roll_up(
+                instance, amount, 1 if instance.is_active else -1
+            )
+            checkpoints.shift_checkpoints(
+                models.Account,
+                [(instance.account_id, instance.created_on, amount)]
+            )
 
-    instance.account.last_modified_by = instance.last_modified_by
-    instance.account.save(
-        update_fields=('balance', 'last_modified_by', 'last_modified_on')
-    )
+
+def account_movement_roll_up(instance, amount, count):
+    """
+    Adds a movement saved by itself, not posted from a document, to the
+    monthly rollup of its lodge (or takes it out, with `count` -1).
+    """
+    rollups.update_monthly(models.ROLLUP_ACCOUNTS, [(
+        models.Account.objects.values_list(
+            'affiliation__lodge', flat=True
+        ).get(pk=instance.account_id),
+        timezone.localdate(instance.created_on),
+        instance.account_movement_type,
+        amount,
+        count
+    )])
 
 
 def lodge_account_movement(
     sender, instance, created, update_fields, raw, **kwargs
 ):
-    lodge_global_account = (
-        instance.lodge_account.handler.lodge.lodge_global_account
-    )
     if created and not raw:
-        instance.lodge_account.balance += instance.amount
-        lodge_global_account.balance += instance.amount
+        with transaction.atomic():
+            instance.balance = posting.post_lodge_account_delta(
+                instance.lodge_account_id,
+                instance.amount,
+                instance.last_modified_by
+            )
+            models.LodgeAccountMovement.objects.filter(pk=instance.pk).update(
+                balance=instance.balance
+            )
+            lodge_account_movement_roll_up(instance, instance.amount, 1)
     elif not created and update_fields and 'is_active' in update_fields:
-        instance.lodge_account.balance += -instance.amount
-        lodge_global_account.balance += -instance.amount
+        amount = instance.amount if instance.is_active else -instance.amount
+        with transaction.atomic():
+            posting.post_lodge_account_delta(
+                instance.lodge_account_id, amount, instance.last_modified_by
+            )
+            lodge_account_movement_roll_up(
+                instance, amount, 1 if instance.is_active else -1
+            )
+            checkpoints.shift_checkpoints(
+                models.LodgeAccount,
+                [(instance.lodge_account_id, instance.created_on, amount)]
+            )
 
-    instance.lodge_account.last_modified_by = instance.last_modified_by
-    instance.lodge_account.save(
-        update_fields=('balance', 'last_modified_by', 'last_modified_on')
-    )
-    lodge_global_account.last_modified_by = instance.last_modified_by
-    lodge_global_account.save(
-        update_fields=('balance', 'last_modified_by', 'last_modified_on')
-    )
+
+def lodge_account_movement_roll_up(instance, amount, count):
+    """
+    See `account_movement_roll_up`.
+    """
+    rollups.update_monthly(models.ROLLUP_LODGEACCOUNTS, [(
+        models.LodgeAccount.objects.values_list(
+            'handler__lodge', flat=True
+        ).get(pk=instance.lodge_account_id),
+        timezone.localdate(instance.created_on),
+        instance.lodgeaccount_movement_type,
+        amount,
+        count
+    )])
 
 
 def grand_lodge_deposit(
@@ -181,20 +195,8 @@ def grand_lodge_deposit(
         ) % {'amount': str(instance.amount)}
         instance.payer.account.send_treasure_mail(title, content)
     if not created and update_fields and 'status' in update_fields:
-        account, new = models.Account.objects.get_or_create(
-            affiliation=instance.payer
-        )
-
         if instance.status == models.GRANDLODGEDEPOSIT_ACCREDITED:
-            models.AccountMovement.objects.create(
-                content_object=instance,
-                account=account,
-                account_movement_type=models.ACCOUNTMOVEMENT_GRANDLODGEDEPOSIT,
-                amount=instance.amount,
-                balance=account.balance + instance.amount,
-                created_by=instance.created_by,
-                last_modified_by=instance.last_modified_by
-            )
+            post(instance)
             if instance.send_email and not raw:
                 title = _("Your pending GL deposit has been accredited")
                 content = _(
@@ -210,76 +212,23 @@ def grand_lodge_deposit(
                     "$ %(amount)s has been rejected."
                 ) % {'amount': str(instance.amount)}
                 instance.payer.account.send_treasure_mail(title, content)
+    elif not created and update_fields and 'is_active' in update_fields:
+        set_active(instance)
 
 
 def lodge_account_ingress_and_egress(
     sender, instance, created, update_fields, raw, **kwargs
 ):
     if created and not raw:
-        if type(instance) is models.LodgeAccountIngress:
-            models.LodgeAccountMovement.objects.create(
-                content_object=instance,
-                lodge_account=instance.lodge_account,
-                lodgeaccount_movement_type=models.LODGEACCOUNTMOVEMENT_INGRESS,
-                amount=instance.amount,
-                balance=instance.lodge_account.balance + instance.amount,
-                created_by=instance.created_by,
-                last_modified_by=instance.last_modified_by
-            )
-        elif type(instance) is models.LodgeAccountEgress:
-            models.LodgeAccountMovement.objects.create(
-                content_object=instance,
-                lodge_account=instance.lodge_account,
-                lodgeaccount_movement_type=models.LODGEACCOUNTMOVEMENT_EGRESS,
-                amount=-instance.amount,
-                balance=instance.lodge_account.balance - instance.amount,
-                created_by=instance.created_by,
-                last_modified_by=instance.last_modified_by
-            )
+        post(instance)
     elif not created and update_fields and 'is_active' in update_fields:
-        instance.lodge_account_movement.is_active = instance.is_active
-        instance.lodge_account_movement.last_modified_by = (
-            instance.last_modified_by
-        )
-        instance.lodge_account_movement.save(
-            update_fields=('is_active', 'last_modified_by', 'last_modified_on')
-        )
+        set_active(instance)
 
 
 def lodge_account_transfer(
     sender, instance, created, update_fields, raw, **kwargs
 ):
     if created and not raw:
-        models.LodgeAccountMovement.objects.create(
-            content_object=instance,
-            lodge_account=instance.lodge_account_from,
-            lodgeaccount_movement_type=models.LODGEACCOUNTMOVEMENT_TRANSFER,
-            amount=-instance.amount,
-            balance=instance.lodge_account_from.balance - instance.amount,
-            created_by=instance.created_by,
-            last_modified_by=instance.last_modified_by
-        )
-        models.LodgeAccountMovement.objects.create(
-            content_object=instance,
-            lodge_account=instance.lodge_account_to,
-            lodgeaccount_movement_type=models.LODGEACCOUNTMOVEMENT_TRANSFER,
-            amount=instance.amount,
-            balance=instance.lodge_account_to.balance + instance.amount,
-            created_by=instance.created_by,
-            last_modified_by=instance.last_modified_by
-        )
+        post(instance)
     elif not created and update_fields and 'is_active' in update_fields:
-        instance.lodge_account_movement_from.is_active = instance.is_active
-        instance.lodge_account_movement_from.last_modified_by = (
-            instance.last_modified_by
-        )
-        instance.lodge_account_movement_from.save(
-            update_fields=('is_active', 'last_modified_by', 'last_modified_on')
-        )
-        instance.lodge_account_movement_to.is_active = instance.is_active
-        instance.lodge_account_movement_to.last_modified_by = (
-            instance.last_modified_by
-        )
-        instance.lodge_account_movement_to.save(
-            update_fields=('is_active', 'last_modified_by', 'last_modified_on')
-        )
+        set_active(instance)
@@ -0,0 +1,155 @@
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.deconstruct import deconstructible
+from django.utils.http import quote_etag
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+RECEIPTS_DIR = 'receipts'
+
+
+@deconstructible
+class ReceiptStorage(FileSystemStorage):
+    """
+    Stores receipts by the SHA-256 of their content, in directories sharded
+    by its first characters (`receipts/ab/cd/abcd....jpg`), so an identical
+    upload is stored once and every directory stays small.
+
+    Uploads are streamed by chunks into a temporary file next to its final
+    place, hashing them on the way, and then renamed, so they're never held
+    in memory and a half written receipt is never seen. Files are shared by
+    every receipt with the same content, so they're never overwritten and
+    shouldn't be deleted through a single one of them.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # The name is chosen by `_save`, from the content.
+        return name
+
+    def _save(self, name, content):
+        directory, filename = posixpath.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        os.makedirs(self.path(directory), exist_ok=True)
+        digest = hashlib.sha256()
+        fd, temporary = tempfile.mkstemp(
+            prefix='.upload-', dir=self.path(directory)
+        )
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    file.write(chunk)
+            digest = digest.hexdigest()
+            name = posixpath.join(
+                directory, digest[:2], digest[2:4], digest + extension
+            )
+            if self.exists(name):
+                os.remove(temporary)
+            else:
+                os.makedirs(os.path.dirname(self.path(name)), exist_ok=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(temporary, self.file_permissions_mode)
+                os.replace(temporary, self.path(name))
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return name
+
+    def url(self, name):
+        # Receipts are served by `views.ReceiptView`, to members only.
+        return reverse('treasure:receipt', args=[name])
+
+
+receipt_storage = ReceiptStorage()
+
+
+def is_receipt_name(name):
+    """
+    Whether `name` is a receipt's, under `RECEIPTS_DIR`: no `..`, `.` or
+    empty parts (which would lead out of it) and no hidden files (uploads
+    being written).
+    """
+    parts = name.split('/')
+    return (
+        len(parts) > 1 and
+        parts[0] == RECEIPTS_DIR and
+        '\\' not in name and
+        all(part and not part.startswith('.') for part in parts)
+    )
+
+
+def read_range(path, start, length, chunk_size):
+    with open(path, 'rb') as file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve(request, storage, name, chunk_size=64 * 1024):
+    """
+    Returns the response serving a stored file: an empty one with the
+    `settings.RECEIPTS_SENDFILE_HEADER` for the web server to send the file,
+    if set, or else the file itself, or the single byte range the request
+    asks for.
+
+    Stored files never change, so they're cached for good and their name is
+    their ETag.
+    """
+    path = storage.path(name)
+    etag = quote_etag(posixpath.basename(name))
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return response
+
+    header = settings.RECEIPTS_SENDFILE_HEADER
+    if header == 'X-Accel-Redirect':
+        response = HttpResponse()
+        response[header] = settings.RECEIPTS_SENDFILE_ROOT + name
+        del response['Content-Type']
+    elif header:
+        response = HttpResponse()
+        response[header] = path
+        del response['Content-Type']
+    else:
+        size = os.path.getsize(path)
+        match = RANGE.match(request.META.get('HTTP_RANGE', ''))
+        if match and any(match.groups()):
+            first, last = match.groups()
+            if first:
+                start, end = int(first), int(last or size - 1)
+            else:
+                # The last bytes, `bytes=-500`.
+                start, end = max(size - int(last), 0), size - 1
+            end = min(end, size - 1)
+            if start > end:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */%d' % size
+                return response
+            content_type, encoding = mimetypes.guess_type(name)
+            response = StreamingHttpResponse(
+                read_range(path, start, end - start + 1, chunk_size),
+                status=206,
+                content_type=content_type or 'application/octet-stream'
+            )
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        else:
+            response = FileResponse(open(path, 'rb'))
+        response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
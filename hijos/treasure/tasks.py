@@ -0,0 +1,240 @@
+from common.mail import send_mass_html_mail
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+from hijos.celery import app
+from hijos.treasure import checkpoints, emails, invoicing, models, rollups
+from hijos.users import models as users
+
+
+def delay_on_commit(task, *args):
+    """
+    Queues `task` once the current transaction is committed, so the worker
+    never looks for rows that don't exist yet. Eager tasks run right away.
+    """
+    if app.conf.task_always_eager:
+        task.delay(*args)
+    else:
+        transaction.on_commit(lambda: task.delay(*args))
+
+
+@app.task(name='treasure.invoice_period')
+def invoice_period(job_id):
+    """
+    Invoices the period of the job in batches, recording the progress on the
+    job, and queues one email per invoice if the period asks for it.
+
+    Affiliations already invoiced for the period, and invoices whose email
+    was already queued, are skipped, so running the task again after a
+    failure resumes where it stopped.
+    """
+    job = models.PeriodInvoicingJob.objects.select_related(
+        'period__lodge'
+    ).get(pk=job_id)
+    if job.status == models.JOB_DONE:
+        return
+    period = job.period
+    affiliations = users.Affiliation.objects.filter(
+        lodge=period.lodge,
+        is_active=True
+    )
+
+    job.status = models.JOB_RUNNING
+    job.invoices_total = affiliations.count()
+    job.invoices_created = period.invoices.count()
+    job.save(update_fields=(
+        'status', 'invoices_total', 'invoices_created', 'last_modified_on'
+    ))
+
+    try:
+        pending = list(
+            affiliations.exclude(
+                invoice__period=period
+            ).order_by('pk').values_list('pk', flat=True)
+        )
+        batch_size = settings.TREASURE_INVOICING_BATCH_SIZE
+        for i in range(0, len(pending), batch_size):
+            with transaction.atomic():
+                created = invoicing.create_period_invoices(
+                    period,
+                    users.Affiliation.objects.filter(
+                        pk__in=pending[i:i + batch_size]
+                    )
+                )
+                models.PeriodInvoicingJob.objects.filter(pk=job.pk).update(
+                    invoices_created=F('invoices_created') + created
+                )
+
+        if period.send_email:
+            invoices = list(period.invoices.order_by(
+                'affiliation__user__last_name',
+                'affiliation__user__first_name',
+                'pk'
+            ).values_list('pk', 'is_active'))
+            job.emails_total = sum(
+                is_active for invoice_id, is_active in invoices
+            )
+            job.save(update_fields=('emails_total', 'last_modified_on'))
+            ids = [invoice_id for invoice_id, is_active in invoices]
+            if job.last_queued_invoice_id in ids:
+                # The ones up to it were queued by a previous run.
+                invoices = invoices[ids.index(job.last_queued_invoice_id) + 1:]
+            for invoice_id, is_active in invoices:
+                if not is_active:
+                    continue
+                send_invoice_email.delay(invoice_id)
+                models.PeriodInvoicingJob.objects.filter(pk=job.pk).update(
+                    emails_queued=F('emails_queued') + 1,
+                    last_queued_invoice=invoice_id
+                )
+    except Exception as e:
+        job.status = models.JOB_FAILED
+        job.error = str(e)
+        job.save(update_fields=('status', 'error', 'last_modified_on'))
+        raise
+
+    job.status = models.JOB_DONE
+    job.save(update_fields=('status', 'last_modified_on'))
+
+
+@app.task(
+    name='treasure.send_invoice_email',
+    autoretry_for=(OSError,),
+    retry_backoff=True,
+    max_retries=5
+)
+def send_invoice_email(invoice_id):
+    invoice = models.Invoice.objects.select_related(
+        'period',
+        'affiliation__account',
+        'affiliation__user',
+        'affiliation__lodge__treasurer'
+    ).get(pk=invoice_id)
+    title, content = invoicing.invoice_email(invoice)
+    invoice.affiliation.account.send_treasure_mail(title, content)
+
+
+@app.task(name='treasure.mail_balances')
+def mail_balances(job_id):
+    """
+    Splits the active affiliations of the job's lodge in chunks and queues
+    one `send_balance_emails` per chunk.
+    """
+    job = models.BalanceMailingJob.objects.get(pk=job_id)
+    if job.status != models.JOB_PENDING:
+        return
+    affiliation_ids = list(
+        users.Affiliation.objects.filter(
+            lodge=job.lodge_id,
+            is_active=True,
+            account__isnull=False
+        ).values_list('pk', flat=True)
+    )
+
+    job.emails_total = len(affiliation_ids)
+    job.status = (
+        models.JOB_RUNNING if affiliation_ids else models.JOB_DONE
+    )
+    job.save(update_fields=('status', 'emails_total', 'last_modified_on'))
+
+    batch_size = settings.TREASURE_MAILING_BATCH_SIZE
+    for i in range(0, len(affiliation_ids), batch_size):
+        send_balance_emails.delay(job.pk, affiliation_ids[i:i + batch_size])
+
+
+@app.task(
+    bind=True,
+    name='treasure.send_balance_emails',
+    autoretry_for=(OSError,),
+    retry_backoff=True,
+    max_retries=5
+)
+def send_balance_emails(self, job_id, affiliation_ids):
+    """
+    Sends the balance email of every affiliation of the chunk over a single
+    SMTP connection, with their accounts and last movements fetched in a
+    couple of queries.
+
+    Recipients whose email fails are retried later on their own, and
+    recorded on the job once the retries are exhausted.
+    """
+    job = models.BalanceMailingJob.objects.select_related('lodge').get(
+        pk=job_id
+    )
+    title = _("Your current account balance on %(lodge)s") % {
+        'lodge': str(job.lodge)
+    }
+    affiliations = users.Affiliation.objects.filter(
+        pk__in=affiliation_ids
+    ).select_related(
+        'user', 'account', 'lodge__treasurer'
+    ).prefetch_related(emails.last_movements_prefetch())
+
+    sent = 0
+    failed = []
+    connection = get_connection()
+    connection.open()
+    try:
+        for affiliation in affiliations:
+            try:
+                send_mass_html_mail(
+                    [emails.balance_email(affiliation.account, title)],
+                    connection=connection
+                )
+            except OSError:
+                failed.append(affiliation)
+            else:
+                sent += 1
+    finally:
+        connection.close()
+
+    jobs = models.BalanceMailingJob.objects.filter(pk=job_id)
+    if sent:
+        jobs.update(emails_sent=F('emails_sent') + sent)
+    if failed:
+        if self.request.retries < self.max_retries:
+            raise self.retry(
+                args=(job_id, [affiliation.pk for affiliation in failed]),
+                countdown=60 * 2 ** self.request.retries
+            )
+        jobs.update(
+            emails_failed=F('emails_failed') + len(failed),
+            failed_recipients=Concat(
+                F('failed_recipients'),
+                Value(''.join(
+                    affiliation.user.email + '\n' for affiliation in failed
+                ))
+            )
+        )
+    jobs.filter(
+        status=models.JOB_RUNNING,
+        emails_total__lte=F('emails_sent') + F('emails_failed')
+    ).update(status=models.JOB_DONE, last_modified_on=timezone.now())
+
+
+@app.task(name='treasure.refresh_debt_summaries')
+def refresh_debt_summaries():
+    """
+    Refreshes the debt summary of every lodge, so that debts move to the
+    older aging buckets as days go by even if nothing is posted.
+    """
+    rollups.refresh_debt_summaries(
+        users.Lodge.objects.values_list('pk', flat=True)
+    )
+
+
+@app.task(name='treasure.take_balance_checkpoints')
+def take_balance_checkpoints():
+    """
+    Checkpoints the balances of the accounts and lodge accounts at the end
+    of every month since the last one checkpointed (see
+    `checkpoints.catch_up`), so it runs daily and missed runs, even of whole
+    months, are caught up by the next one.
+    """
+    for account_model in checkpoints.LEDGERS:
+        checkpoints.catch_up(account_model)
@@ -0,0 +1,428 @@
+"""
+Benchmarks, not collected by the test runner. `run` times the rendering of
+the balance email. `run_suite` seeds a temporary test database with
+`seed_benchmark` and times the main pages and tasks on it. `run_aging`
+times the debt aging report of a lodge of 100k movements. Run them with:
+
+    python manage.py shell -c \
+        "from hijos.treasure.tests import benchmarks; benchmarks.run()"
+
+`run_suite` can save its results as JSON and compare them with the ones of
+another commit:
+
+    python manage.py shell -c \
+        "from hijos.treasure.tests import benchmarks; \
+        benchmarks.run_suite(output='before.json')"
+    git checkout ...
+    python manage.py shell -c \
+        "from hijos.treasure.tests import benchmarks; \
+        benchmarks.run_suite(compare='before.json')"
+"""
+import json
+import statistics
+import subprocess
+import time
+import timeit
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.timezone import utc
+from django.utils.translation import ugettext_lazy as _
+
+from hijos.celery import app
+from hijos.treasure import aging, emails, models, tasks
+from hijos.treasure.tests import loadtests
+from hijos.users import models as users
+
+
+def legacy_balance_email(account, title, content=""):
+    """
+    The balance email as `Account.send_treasure_mail` used to build it, by
+    string concatenation, kept to compare the rendering cost.
+    """
+    if account.affiliation.user.most_worshipful:
+        body = _("Dear M.·.W.·.B.·. %(full_name)s:")
+    elif account.affiliation.user.worshipful:
+        body = _("Dear W.·.B.·. %(full_name)s:")
+    elif account.affiliation.user.past_master:
+        body = _("Dear P.·.M.·. %(full_name)s:")
+    else:
+        body = _("Dear B.·. %(full_name)s:")
+
+    body = body % {'full_name': account.affiliation.user.get_full_name()}
+    body_html = '<p>' + body + '</p>'
+    body += "\n\t" + content + "\n\t"
+
+    if content is not None and content != "":
+        body_html += (
+            "<p>&nbsp;&nbsp;&nbsp;&nbsp;" + content +
+            "</p>&nbsp;&nbsp;&nbsp;&nbsp;"
+        )
+
+    account_balance = _(
+        "Your current account balance with %(lodge)s is of $ %(balance)s"
+    ) % {
+        'lodge': str(account.affiliation.lodge),
+        'balance': str(account.balance)
+    }
+    account_balance_html = (
+        "<p>&nbsp;&nbsp;&nbsp;&nbsp;" + account_balance + "</p>"
+    )
+
+    last_movements = (_(
+        "\n\nYour last 10 movements are:"
+        "\n\nDate\tType\t\tAmount\t\tBalance\n\n"
+    ))
+    last_movements_html = (_(
+        "<br><br>Your last 10 movements are:"
+        "<br><br>"
+        "<table>"
+        "<thead>"
+        "<tr>"
+        "<th>Date</th>"
+        "<th>Type</th>"
+        "<th>Amount</th>"
+        "<th>Balance</th>"
+        "</tr>"
+        "</thead>"
+        "<tbody>"
+    ))
+
+    for m in account.last_movements:
+        if m.account_movement_type == models.ACCOUNTMOVEMENT_INVOICE:
+            movement_type = _('Invoice')
+        elif m.account_movement_type == models.ACCOUNTMOVEMENT_DEPOSIT:
+            movement_type = _('Deposit')
+        elif m.account_movement_type == (
+            models.ACCOUNTMOVEMENT_GRANDLODGEDEPOSIT
+        ):
+            movement_type = _('Grand Lodge Deposit')
+        elif m.account_movement_type == models.ACCOUNTMOVEMENT_CHARGE:
+            movement_type = _('Charge')
+        else:
+            movement_type = _('Unknown')
+
+        last_movements += (
+            "%(date)s\t%(type)s\t\t%(amount)s\t\t%(balance)s\n"
+        ) % {
+            'date': str(m.created_on.date()),
+            'type': movement_type,
+            'amount': str(m.amount),
+            'balance': str(m.balance)
+        }
+        last_movements_html += (
+            "<tr>"
+            "<td>%(date)s</td>"
+            "<td>%(type)s</td>"
+            "<td>%(amount)s</td>"
+            "<td>%(balance)s</td>"
+            "</tr>"
+        ) % {
+            'date': str(m.created_on.date()),
+            'type': movement_type,
+            'amount': str(m.amount),
+            'balance': str(m.balance)
+        }
+
+    last_movements_html += "</tbody></table>"
+    return (
+        title,
+        body + account_balance + last_movements,
+        body_html + account_balance_html + last_movements_html,
+        account.affiliation.lodge.treasurer.email,
+        [account.affiliation.user.email],
+    )
+
+
+def sample_account():
+    """
+    Returns an unsaved account with 10 movements, so only rendering is
+    measured.
+    """
+    user = users.User(
+        first_name='User',
+        last_name='One',
+        email='user1@user.com'
+    )
+    lodge = users.Lodge(name='Example', treasurer=user)
+    account = models.Account(
+        affiliation=users.Affiliation(user=user, lodge=lodge),
+        balance=Decimal('-300.00')
+    )
+    movement_types = [code for code, name in models.ACCOUNT_MOVEMENT_TYPES]
+    now = datetime(2018, 5, 18, tzinfo=utc)
+    account.last_movements = [
+        models.AccountMovement(
+            account=account,
+            account_movement_type=movement_types[i % len(movement_types)],
+            amount=Decimal('-30.00'),
+            balance=Decimal('-30.00') * (i + 1),
+            created_on=now - timedelta(days=i)
+        )
+        for i in range(emails.LAST_MOVEMENTS)
+    ]
+    return account
+
+
+def run(messages=2000):
+    """
+    Prints the cost per message of rendering the balance email by string
+    concatenation and with the templates, as loaded by the configured
+    loaders (only the cached one of production compiles them once).
+    """
+    account = sample_account()
+    title = 'Your current account balance on Example'
+
+    for name, render in (
+        ('legacy', lambda: legacy_balance_email(account, title)),
+        ('templates', lambda: emails.balance_email(account, title, ""))
+    ):
+        seconds = min(timeit.repeat(render, number=messages, repeat=3))
+        print('%-10s %8.1f us/message' % (name, seconds / messages * 1e6))
+
+
+def debtor_list(client, lodge, affiliation):
+    url = reverse('treasure:debtor-list', kwargs={'pk': lodge.pk})
+    return lambda: client.get(url)
+
+
+def lodge_dashboard(client, lodge, affiliation):
+    url = reverse('treasure:lodge-dashboard', kwargs={'pk': lodge.pk})
+    return lambda: client.get(url)
+
+
+def aging_report(client, lodge, affiliation):
+    url = reverse('treasure:aging-report', kwargs={'pk': lodge.pk})
+    return lambda: client.get(url)
+
+
+def affiliation_detail(client, lodge, affiliation):
+    url = reverse('users:affiliation-detail', kwargs={'pk': affiliation.pk})
+    return lambda: client.get(url)
+
+
+def ledger_export(client, lodge, affiliation):
+    url = reverse('treasure:accountmovement-export')
+
+    def export():
+        # The rows are read while the response is streamed.
+        return b''.join(client.get(url, {'lodge': lodge.pk}).streaming_content)
+    return export
+
+
+def mass_mail(client, lodge, affiliation):
+    def send():
+        job = models.BalanceMailingJob.objects.create(
+            lodge=lodge,
+            created_by=lodge.treasurer,
+            last_modified_by=lodge.treasurer
+        )
+        tasks.mail_balances(job.pk)
+        mail.outbox = []
+    return send
+
+
+def period_creation(client, lodge, affiliation):
+    # Every run invoices a new month, after the seeded ones.
+    months = iter(range(1, 1000))
+
+    def create():
+        begin = date(timezone.localdate().year + next(months), 1, 1)
+        with mock.patch.object(tasks, 'delay_on_commit'):
+            period = models.Period.objects.create(
+                lodge=lodge,
+                begin=begin,
+                end=begin.replace(day=31),
+                created_by=lodge.treasurer,
+                last_modified_by=lodge.treasurer
+            )
+        tasks.invoice_period(period.invoicing_job.pk)
+    return create
+
+
+# Reads first, since creating periods adds to what they read.
+SUITE = (
+    ('debtor list', debtor_list),
+    ('lodge dashboard', lodge_dashboard),
+    ('aging report', aging_report),
+    ('affiliation detail', affiliation_detail),
+    ('ledger export', ledger_export),
+    ('mass mail', mass_mail),
+    ('period creation', period_creation)
+)
+
+
+def measure(function, repeat):
+    """
+    Returns the queries of a first run of `function` and the milliseconds of
+    the `repeat` runs after it.
+    """
+    # Requests reset the queries log, so they're counted as they run.
+    queries = []
+
+    def count(execute, sql, params, many, context):
+        queries.append(sql)
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(count):
+        function()
+    timings = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return len(queries), timings
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(
+    lodges=5, members=200, years=3, repeat=5, output=None, compare=None
+):
+    """
+    Seeds a temporary test database and prints the median and fastest
+    milliseconds, and the queries, of every benchmark of the `SUITE`.
+
+    The results are saved as JSON to the `output` file, and compared with
+    the ones saved to the `compare` file, if given.
+    """
+    seed = {'lodges': lodges, 'members': members, 'years': years}
+    previous = None
+    if compare:
+        with open(compare) as file:
+            previous = json.load(file)
+        if previous['seed'] != seed:
+            print('Warning: %s was seeded with %s.' % (
+                compare, previous['seed']
+            ))
+
+    results = {}
+    setup_test_environment()
+    eager = app.conf.task_always_eager
+    app.conf.task_always_eager = True
+    try:
+        with loadtests.test_database():
+            call_command(
+                'seed_benchmark',
+                lodges=lodges,
+                members=members,
+                years=years,
+                verbosity=0
+            )
+            lodge = users.Lodge.objects.select_related('treasurer').get(
+                name='Benchmark 0'
+            )
+            affiliation = lodge.affiliations.order_by('-pk').first()
+            client = Client()
+            client.force_login(lodge.treasurer)
+            for name, benchmark in SUITE:
+                queries, timings = measure(
+                    benchmark(client, lodge, affiliation), repeat
+                )
+                results[name] = {
+                    'median_ms': statistics.median(timings),
+                    'min_ms': min(timings),
+                    'queries': queries
+                }
+    finally:
+        app.conf.task_always_eager = eager
+        teardown_test_environment()
+
+    print('%-20s %10s %10s %8s' % (
+        'benchmark', 'median ms', 'min ms', 'queries'
+    ))
+    for name, result in results.items():
+        line = '%-20s %10.1f %10.1f %8d' % (
+            name, result['median_ms'], result['min_ms'], result['queries']
+        )
+        if previous and name in previous['results']:
+            before = previous['results'][name]
+            line += '  %+6.1f%% %+4d queries (was %.1f ms, %d queries)' % (
+                (result['median_ms'] / before['median_ms'] - 1) * 100,
+                result['queries'] - before['queries'],
+                before['median_ms'],
+                before['queries']
+            )
+        print(line)
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump(
+                {'commit': git_commit(), 'seed': seed, 'results': results},
+                file,
+                indent=2
+            )
+
+
+def per_account_aging(lodge, today):
+    """
+    The aging of `aging.allocate`, but reading the movements of every
+    account with its own query, to compare with reading them all at once.
+    """
+    aged = []
+    for account_id in models.Account.objects.filter(
+        affiliation__lodge=lodge
+    ).values_list('pk', flat=True):
+        movements = list(
+            models.AccountMovement.objects.filter(
+                account=account_id,
+                is_active=True
+            ).order_by('created_on', 'id').values_list(
+                'created_on', 'amount'
+            )
+        )
+        aged.extend(aging.allocate(
+            [account_id] * len(movements),
+            [
+                timezone.localdate(created_on).toordinal()
+                for created_on, amount in movements
+            ],
+            [int(amount * 100) for created_on, amount in movements],
+            today
+        ))
+    return aged
+
+
+def run_aging(members=1700, years=3):
+    """
+    Prints the seconds taken to age the debts of a lodge of `members`
+    members and `years` of history (about 100k movements with the
+    defaults), reading its movements at once and account by account.
+    """
+    with loadtests.test_database():
+        call_command(
+            'seed_benchmark', lodges=1, members=members, years=years
+        )
+        lodge = users.Lodge.objects.get(name='Benchmark 0')
+        today = timezone.localdate()
+
+        started = time.perf_counter()
+        movements = aging.read_movements(lodge.pk)
+        read = time.perf_counter()
+        aged = aging.allocate(*movements, today)
+        allocated = time.perf_counter()
+        print('%d movements read in %.2fs, %d debts aged in %.2fs' % (
+            len(movements[0]), read - started, len(aged), allocated - read
+        ))
+
+        started = time.perf_counter()
+        per_account = per_account_aging(lodge, today)
+        print('account by account: %d debts aged in %.2fs' % (
+            len(per_account), time.perf_counter() - started
+        ))
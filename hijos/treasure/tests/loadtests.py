@@ -0,0 +1,253 @@
+"""
+Load tests, not collected by the test runner. `run` measures the read
+throughput of a SQLite database file while a period is being invoiced, with
+SQLite's default journal and with the `SQLITE_PRAGMAS`. `run_import` times
+the import of a bank statement. Run them with:
+
+    python manage.py shell -c \
+        "from hijos.treasure.tests import loadtests; loadtests.run()"
+
+Readers are separate processes, like the web workers sharing the file. They
+work on a temporary test database, never on the configured one.
+"""
+import multiprocessing
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import date
+from io import BytesIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.test.utils import override_settings
+
+from hijos.treasure import emails, imports, models, tasks
+from hijos.users import models as users
+
+# SQLite's own rollback journal and durability, with Django's defaults.
+DEFAULT_PRAGMAS = {'journal_mode': 'delete', 'synchronous': 'full'}
+
+
+def create_members(count):
+    """
+    Affiliates `count` new members, with their accounts, to the lodge of
+    the test fixtures.
+    """
+    treasurer = users.User.objects.get(username='user1')
+    lodge = users.Lodge.objects.get(name='Example')
+    users.User.objects.bulk_create([
+        users.User(
+            username='load%d' % i,
+            first_name='Load',
+            last_name=str(i),
+            email='load%d@user.com' % i
+        )
+        for i in range(count)
+    ])
+    users.Affiliation.objects.bulk_create([
+        users.Affiliation(
+            lodge=lodge,
+            user=user,
+            category_id=1,
+            created_by=treasurer,
+            last_modified_by=treasurer
+        )
+        for user in users.User.objects.filter(username__startswith='load')
+    ])
+    models.Account.objects.bulk_create([
+        models.Account(
+            affiliation=affiliation,
+            created_by=treasurer,
+            last_modified_by=treasurer
+        )
+        for affiliation in users.Affiliation.objects.filter(
+            user__username__startswith='load'
+        )
+    ])
+
+
+def read_ledgers(account_ids, done, results):
+    """
+    Reads the first ledger page of the accounts, one after the other, until
+    `done` is set. Puts in `results` the reads done, the ones that found the
+    database locked and the slowest read.
+    """
+    reads = locked = 0
+    slowest = 0
+    try:
+        while not done.is_set():
+            started = time.perf_counter()
+            try:
+                list(
+                    models.AccountMovement.objects.filter(
+                        account=account_ids[reads % len(account_ids)],
+                        is_active=True
+                    ).order_by(*emails.MOVEMENTS_ORDERING)[:50]
+                )
+                reads += 1
+            except OperationalError:
+                locked += 1
+            slowest = max(slowest, time.perf_counter() - started)
+    finally:
+        connections.close_all()
+        results.put((reads, locked, slowest))
+
+
+def invoice_period(month):
+    """
+    Creates a period and invoices it right away, as the Celery task would.
+    """
+    try:
+        treasurer = users.User.objects.get(username='user1')
+        with mock.patch.object(tasks, 'delay_on_commit'):
+            period = models.Period.objects.create(
+                lodge=users.Lodge.objects.get(name='Example'),
+                begin=date(2018, month, 1),
+                end=date(2018, month, 28),
+                created_by=treasurer,
+                last_modified_by=treasurer
+            )
+        tasks.invoice_period(period.invoicing_job.pk)
+    finally:
+        connections.close_all()
+
+
+def measure(account_ids, readers, month=None, seconds=2):
+    """
+    Returns the seconds elapsed, and the reads per second, locked reads and
+    slowest read of `readers` processes while invoicing the `month`, or
+    during `seconds` if no month is given.
+    """
+    # Forked processes must not share the parent's connection.
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    done = context.Event()
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=read_ledgers, args=(account_ids, done, results)
+        )
+        for i in range(readers)
+    ]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    if month is None:
+        time.sleep(seconds)
+    else:
+        invoice_period(month)
+    done.set()
+    results = [results.get() for process in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+    return (
+        elapsed,
+        sum(reads for reads, locked, slowest in results) / elapsed,
+        sum(locked for reads, locked, slowest in results),
+        max(slowest for reads, locked, slowest in results)
+    )
+
+
+@contextmanager
+def test_database():
+    """
+    Creates a temporary test database file with the test fixtures, and
+    destroys it on exit.
+    """
+    test_name = os.path.join(tempfile.mkdtemp(), 'loadtest.db')
+    settings.DATABASES['default']['TEST'] = {'NAME': test_name}
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True
+    )
+    try:
+        call_command(
+            'loaddata',
+            'hijos/treasure/tests/fixtures/users.json',
+            'hijos/treasure/tests/fixtures/treasure.json',
+            verbosity=0
+        )
+        yield
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def run(members=5000, readers=4):
+    """
+    Prints, with SQLite's default pragmas and with the `SQLITE_PRAGMAS`, the
+    read throughput while idle and while a period of `members` invoices is
+    posted.
+    """
+    with test_database():
+        create_members(members)
+        account_ids = list(
+            models.Account.objects.values_list('pk', flat=True)
+        )
+
+        print('%-8s %-9s %8s %10s %8s %12s' % (
+            'pragmas', 'load', 'seconds', 'reads/s', 'locked', 'slowest ms'
+        ))
+        for month, (name, pragmas) in enumerate((
+            ('default', DEFAULT_PRAGMAS),
+            ('tuned', settings.SQLITE_PRAGMAS)
+        ), start=6):
+            with override_settings(SQLITE_PRAGMAS=pragmas):
+                # The journal mode can only change with a single connection
+                # open.
+                connections.close_all()
+                connection.ensure_connection()
+                for load, kwargs in (
+                    ('idle', {}),
+                    ('invoicing', {'month': month})
+                ):
+                    elapsed, throughput, locked, slowest = measure(
+                        account_ids, readers, **kwargs
+                    )
+                    print('%-8s %-9s %8.2f %10.0f %8d %12.1f' % (
+                        name, load, elapsed, throughput, locked,
+                        slowest * 1000
+                    ))
+
+
+def run_import(lines=50000, members=5000):
+    """
+    Prints the seconds taken to read, match and import a CSV statement of
+    `lines` deposits of `members` members.
+    """
+    with test_database():
+        create_members(members)
+        statement = ('date,amount,description\n' + ''.join(
+            '2019-03-01,10.00,Transfer load%d\n' % (i % members)
+            for i in range(lines)
+        )).encode()
+        lodge_account = models.LodgeAccount.objects.select_related(
+            'handler__lodge'
+        ).first()
+        treasurer = users.User.objects.get(username='user1')
+
+        started = time.perf_counter()
+        matcher = imports.Matcher(lodge_account.handler.lodge)
+        summary = imports.summarize(
+            matcher.lines(imports.read_csv(BytesIO(statement)))
+        )
+        matched = time.perf_counter()
+        count = imports.import_deposits(
+            (
+                (line, affiliation_id)
+                for line, affiliation_id, error in matcher.lines(
+                    imports.read_csv(BytesIO(statement))
+                )
+                if error is None
+            ),
+            lodge_account,
+            treasurer
+        )
+        imported = time.perf_counter()
+        print('%d lines, %d matched in %.2fs, %d imported in %.2fs' % (
+            lines, summary['matched_count'], matched - started,
+            count, imported - matched
+        ))
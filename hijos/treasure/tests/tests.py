@@ -1,11 +1,33 @@
-from datetime import date
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from array import array
+from datetime import date, datetime, timedelta
 from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
+from common.mail import send_mass_html_mail
+from django.contrib.contenttypes.models import ContentType
 from django.core import mail
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, OperationalError, connection, connections, transaction
+from django.db.models import F, Sum
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from django.utils.timezone import utc
 
-from hijos.treasure import models
+from hijos.treasure import aging, api, checkpoints, emails, imports, models, posting, prices, rollups, storage, tasks
+from hijos.users import caching
 from hijos.users import models as users
 
 
@@ -133,7 +155,7 @@ class PeriodTestCase(TestCase):
         self.lodge = users.Lodge.objects.get(name='Example')
         self.period = models.Period.objects.get(lodge=self.lodge)
         self.url_login = reverse('account_login')
-        self.today = date.today()
+        self.today = timezone.localdate()
 
     def test_str(self):
         self.assertEqual(
@@ -320,8 +342,8 @@ class PeriodTestCase(TestCase):
             "Your last 10 movements are:"
             "\n\nDate\tType\t\tAmount\t\tBalance\n\n" +
             str(self.today) + "\tInvoice\t\t-100.00\t\t-400.00\n"
-            "2018-05-18\tInvoice\t\t-300.00\t\t-300.00\n"
             "2018-05-18\tDeposit\t\t200.00\t\t0.00\n"
+            "2018-05-18\tInvoice\t\t-300.00\t\t-300.00\n"
             "2018-05-17\tCharge\t\t-200.00\t\t-200.00\n"
         )
 
@@ -571,6 +593,176 @@ class PeriodTestCase(TestCase):
             'treasure/period_detail.html'
         )
 
+    def test_invoicing_job(self):
+        url_create = reverse('treasure:period-create')
+        data = {
+            'lodge': self.lodge.pk,
+            'begin': '2018-04-01',
+            'end': '2018-04-30',
+            'price_multiplier': 1,
+            'send_email': True
+        }
+
+        self.client.force_login(user=self.user1)
+        response = self.client.post(url_create, data, follow=True)
+        self.assertEqual(response.status_code, 200)
+        period = models.Period.objects.get(
+            lodge=self.lodge,
+            begin=date(year=2018, month=4, day=1)
+        )
+        job = period.invoicing_job
+        self.assertEqual(job.status, models.JOB_DONE)
+        self.assertEqual(job.invoices_total, 3)
+        self.assertEqual(job.invoices_created, 3)
+        self.assertEqual(job.emails_total, 3)
+        self.assertEqual(job.emails_queued, 3)
+        self.assertEqual(len(mail.outbox), 3)
+
+        url_status = reverse('treasure:period-status', args=[period.pk])
+        self.client.logout()
+        response = self.client.get(url_status, follow=True)
+        self.assertRedirects(
+            response,
+            self.url_login + '?next=' + url_status
+        )
+        self.client.force_login(user=self.user2)
+        response = self.client.get(url_status)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'treasure/period_status.html')
+        self.assertEqual(response.context['job'], job)
+
+    def test_invoicing_job_resume(self):
+        delay = tasks.send_invoice_email.delay
+        queued = []
+
+        def failing(invoice_id):
+            if len(queued) == 1:
+                raise OSError('Broker unavailable')
+            queued.append(invoice_id)
+            return delay(invoice_id)
+
+        with mock.patch.object(tasks.send_invoice_email, 'delay', failing):
+            models.Period.objects.create(
+                lodge=self.lodge,
+                begin=date(year=2018, month=4, day=1),
+                end=date(year=2018, month=4, day=30),
+                send_email=True,
+                created_by=self.user1,
+                last_modified_by=self.user1
+            )
+        period = models.Period.objects.get(
+            lodge=self.lodge,
+            begin=date(year=2018, month=4, day=1)
+        )
+        job = period.invoicing_job
+        self.assertEqual(job.status, models.JOB_FAILED)
+        self.assertEqual(job.emails_queued, 1)
+        self.assertEqual(len(mail.outbox), 1)
+
+        # Running it again only queues the emails still missing.
+        tasks.invoice_period(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, models.JOB_DONE)
+        self.assertEqual(job.emails_total, 3)
+        self.assertEqual(job.emails_queued, 3)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(
+            len({message.to[0] for message in mail.outbox}), 3
+        )
+
+    def test_create_without_price(self):
+        users.CategoryPrice.objects.filter(category=2).update(
+            is_active=False
+        )
+        url_create = reverse('treasure:period-create')
+        data = {
+            'lodge': self.lodge.pk,
+            'begin': '2018-04-01',
+            'end': '2018-04-30',
+            'price_multiplier': 1,
+            'send_email': False
+        }
+
+        self.client.force_login(user=self.user1)
+        response = self.client.post(url_create, data)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'treasure/period_add.html')
+        self.assertFalse(
+            models.Period.objects.filter(
+                lodge=self.lodge,
+                begin=date(year=2018, month=4, day=1)
+            ).exists()
+        )
+
+    def test_create_query_count(self):
+        def create_period(begin, end):
+            with CaptureQueriesContext(connection) as queries:
+                models.Period.objects.create(
+                    lodge=self.lodge,
+                    begin=begin,
+                    end=end,
+                    created_by=self.user1,
+                    last_modified_by=self.user1
+                )
+            return len(queries)
+
+        # Otherwise the first posting of the day builds the debt summary, and
+        # the first one of the process looks up the content type.
+        rollups.refresh_debt_summaries([self.lodge.pk])
+        ContentType.objects.get_for_model(models.Invoice)
+        queries = create_period(
+            date(year=2018, month=4, day=1),
+            date(year=2018, month=4, day=30)
+        )
+
+        category = users.Category.objects.get(pk=1)
+        for i in range(20):
+            user = users.User.objects.create(
+                username='member' + str(i),
+                first_name='Member',
+                last_name=str(i)
+            )
+            users.Affiliation.objects.create(
+                lodge=self.lodge,
+                user=user,
+                category=category,
+                created_by=self.user1,
+                last_modified_by=self.user1
+            )
+
+        self.assertEqual(
+            create_period(
+                date(year=2018, month=5, day=1),
+                date(year=2018, month=5, day=31)
+            ),
+            queries
+        )
+        period = models.Period.objects.get(
+            lodge=self.lodge,
+            begin=date(year=2018, month=5, day=1)
+        )
+        self.assertEqual(period.invoices.count(), 23)
+        self.assertEqual(
+            models.Account.objects.get(
+                affiliation__user__username='member0'
+            ).balance,
+            Decimal('-100.00')
+        )
+        self.assertEqual(
+            models.Account.objects.get(
+                affiliation__user=self.user3
+            ).balance,
+            Decimal('-250.00')
+        )
+        self.assertTrue(
+            models.AccountMovement.objects.filter(
+                account__affiliation__user=self.user3,
+                account_movement_type=models.ACCOUNTMOVEMENT_INVOICE,
+                amount=Decimal('-50.00'),
+                balance=Decimal('-250.00')
+            ).exists()
+        )
+
 
 class InvoiceTestCase(TestCase):
     """
@@ -594,7 +786,7 @@ class InvoiceTestCase(TestCase):
             affiliation=self.affiliation
         )
         self.url_login = reverse('account_login')
-        self.today = date.today()
+        self.today = timezone.localdate()
 
     def test_str(self):
         self.assertEqual(
@@ -793,7 +985,7 @@ class ChargeTestCase(TestCase):
             amount=Decimal('200.00')
         )
         self.url_login = reverse('account_login')
-        self.today = date.today()
+        self.today = timezone.localdate()
 
     def test_str(self):
         self.assertEqual(
@@ -997,7 +1189,7 @@ class DepositTestCase(TestCase):
             amount=Decimal('200.00')
         )
         self.url_login = reverse('account_login')
-        self.today = date.today()
+        self.today = timezone.localdate()
 
     def test_str(self):
         self.assertEqual(
@@ -1197,7 +1389,7 @@ class LodgeAccountIngressTestCase(TestCase):
             amount=Decimal('400.00')
         )
         self.url_login = reverse('account_login')
-        self.today = date.today()
+        self.today = timezone.localdate()
 
     def test_str(self):
         self.assertEqual(
@@ -1330,7 +1522,7 @@ class LodgeAccountEgressTestCase(TestCase):
             amount=Decimal('200.00')
         )
         self.url_login = reverse('account_login')
-        self.today = date.today()
+        self.today = timezone.localdate()
 
     def test_str(self):
         self.assertEqual(
@@ -1467,7 +1659,7 @@ class LodgeAccountTransferTestCase(TestCase):
             amount=Decimal('200.00')
         )
         self.url_login = reverse('account_login')
-        self.today = date.today()
+        self.today = timezone.localdate()
 
     def test_str(self):
         self.assertEqual(
@@ -1619,7 +1811,7 @@ class GrandLodgeDepositTestCase(TestCase):
             amount=Decimal('200.00')
         )
         self.url_login = reverse('account_login')
-        self.today = date.today()
+        self.today = timezone.localdate()
 
     def test_str(self):
         self.assertEqual(
@@ -1945,3 +2137,2313 @@ class GrandLodgeDepositTestCase(TestCase):
             response,
             'treasure/grandlodgedeposit_detail.html'
         )
+
+
+class ByLodgeListTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def setUp(self):
+        self.user1 = users.User.objects.get(username='user1')
+        self.lodge = users.Lodge.objects.get(name='Example')
+        self.affiliations = list(
+            users.Affiliation.objects.filter(lodge=self.lodge)
+        )
+        self.period = models.Period.objects.filter(lodge=self.lodge).first()
+        self.lodge_accounts = list(
+            models.LodgeAccount.objects.filter(handler__lodge=self.lodge)
+        )
+        self.urls = [
+            reverse('treasure:' + name + '-list', args=[self.lodge.pk])
+            for name in (
+                'lodgeaccount',
+                'period',
+                'invoice',
+                'deposit',
+                'charge',
+                'grandlodgedeposit',
+                'lodgeaccountingress',
+                'lodgeaccountegress',
+                'lodgeaccounttransfer',
+                'debtor'
+            )
+        ]
+        self.client.force_login(user=self.user1)
+
+    def add_history(self, count):
+        """
+        Saves `count` documents of every kind without posting them.
+        """
+        def cycle(items, i):
+            return items[i % len(items)]
+
+        common = {'created_by': self.user1, 'last_modified_by': self.user1}
+        models.LodgeAccount.objects.bulk_create([
+            models.LodgeAccount(handler=cycle(self.affiliations, i), **common)
+            for i in range(count)
+        ])
+        models.Period.objects.bulk_create([
+            models.Period(
+                lodge=self.lodge,
+                begin=date(2000 + i, 1, 1),
+                end=date(2000 + i, 12, 31),
+                **common
+            )
+            for i in range(count)
+        ])
+        models.Invoice.objects.bulk_create([
+            models.Invoice(
+                period=self.period,
+                affiliation=cycle(self.affiliations, i),
+                amount=Decimal('10.00'),
+                **common
+            )
+            for i in range(count)
+        ])
+        models.Deposit.objects.bulk_create([
+            models.Deposit(
+                payer=cycle(self.affiliations, i),
+                lodge_account=cycle(self.lodge_accounts, i),
+                amount=Decimal('10.00'),
+                **common
+            )
+            for i in range(count)
+        ])
+        models.Charge.objects.bulk_create([
+            models.Charge(
+                debtor=cycle(self.affiliations, i),
+                charge_type=models.CHARGE_OTHER,
+                amount=Decimal('10.00'),
+                **common
+            )
+            for i in range(count)
+        ])
+        models.GrandLodgeDeposit.objects.bulk_create([
+            models.GrandLodgeDeposit(
+                payer=cycle(self.affiliations, i),
+                amount=Decimal('10.00'),
+                **common
+            )
+            for i in range(count)
+        ])
+        models.LodgeAccountIngress.objects.bulk_create([
+            models.LodgeAccountIngress(
+                lodge_account=cycle(self.lodge_accounts, i),
+                ingress_type=models.INGRESS_TYPE_DONATION,
+                amount=Decimal('10.00'),
+                **common
+            )
+            for i in range(count)
+        ])
+        models.LodgeAccountEgress.objects.bulk_create([
+            models.LodgeAccountEgress(
+                lodge_account=cycle(self.lodge_accounts, i),
+                egress_type=models.EGRESS_TYPE_DONATION,
+                amount=Decimal('10.00'),
+                **common
+            )
+            for i in range(count)
+        ])
+        models.LodgeAccountTransfer.objects.bulk_create([
+            models.LodgeAccountTransfer(
+                lodge_account_from=cycle(self.lodge_accounts, i),
+                lodge_account_to=cycle(self.lodge_accounts, i + 1),
+                amount=Decimal('10.00'),
+                **common
+            )
+            for i in range(count)
+        ])
+        models.Account.objects.filter(
+            affiliation__lodge=self.lodge
+        ).update(balance=Decimal('-10.00'))
+        rollups.refresh_debt_summaries([self.lodge.pk])
+
+    def count_queries(self, url):
+        # History is bulk inserted behind the back of the lodge's version,
+        # so pages are counted uncached.
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count(self):
+        self.add_history(3)
+        small = [self.count_queries(url) for url in self.urls]
+        self.add_history(120)
+        large = [self.count_queries(url) for url in self.urls]
+        self.assertEqual(small, large)
+
+    def test_cursor(self):
+        self.add_history(120)
+        url = reverse('treasure:deposit-list', args=[self.lodge.pk])
+        expected = list(
+            models.Deposit.objects.filter(
+                payer__lodge=self.lodge
+            ).order_by('-created_on', '-id').values_list('pk', flat=True)
+        )
+
+        seen = []
+        response = self.client.get(url)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            page = response.context['page_obj']
+            self.assertLessEqual(len(page), 50)
+            seen.extend(deposit.pk for deposit in page)
+            if not page.has_next():
+                break
+            response = self.client.get(url, {'cursor': page.next_cursor})
+        self.assertEqual(seen, expected)
+
+        response = self.client.get(url, {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 404)
+
+
+class ApiTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def setUp(self):
+        self.user1 = users.User.objects.get(username='user1')
+        self.lodge = users.Lodge.objects.get(name='Example')
+        self.affiliations = list(
+            users.Affiliation.objects.filter(lodge=self.lodge)
+        )
+        self.period = models.Period.objects.filter(lodge=self.lodge).first()
+        self.lodge_accounts = list(
+            models.LodgeAccount.objects.filter(handler__lodge=self.lodge)
+        )
+        self.client.force_login(user=self.user1)
+
+    def add_history(self, count):
+        ByLodgeListTestCase.add_history(self, count)
+
+    def count_queries(self, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_login(self):
+        self.client.logout()
+        response = self.client.get(reverse('treasure:api-deposits-list'))
+        self.assertEqual(response.status_code, 401)
+
+    def test_query_count(self):
+        urls = [
+            reverse('treasure:api-%s-list' % name)
+            for name, resource in api.RESOURCES
+        ]
+        self.add_history(3)
+        small = [
+            self.count_queries(url, {'lodge': self.lodge.pk}) for url in urls
+        ]
+        self.add_history(120)
+        large = [
+            self.count_queries(url, {'lodge': self.lodge.pk}) for url in urls
+        ]
+        self.assertEqual(small, large)
+
+    def test_cursor(self):
+        self.add_history(120)
+        url = reverse('treasure:api-deposits-list')
+        expected = list(
+            models.Deposit.objects.filter(
+                payer__lodge=self.lodge
+            ).order_by('-created_on', '-id').values_list('pk', flat=True)
+        )
+
+        seen = []
+        data = {'lodge': self.lodge.pk, 'limit': 50}
+        while True:
+            response = self.client.get(url, data)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page['results']), 50)
+            seen.extend(deposit['id'] for deposit in page['results'])
+            if page['next'] is None:
+                break
+            data['cursor'] = page['next']
+        self.assertEqual(seen, expected)
+
+        response = self.client.get(url, {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url, {'limit': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_fields(self):
+        deposit = models.Deposit.objects.filter(
+            payer__lodge=self.lodge
+        ).select_related('payer__user').first()
+        url = reverse('treasure:api-deposits-detail', args=[deposit.pk])
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['member'], str(deposit.payer.user))
+        self.assertEqual(response.json()['amount'], str(deposit.amount))
+
+        # The member's name is the only field needing a join.
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'fields': 'amount,payer'})
+        self.assertEqual(
+            response.json(),
+            {
+                'id': deposit.pk,
+                'amount': str(deposit.amount),
+                'payer': deposit.payer_id
+            }
+        )
+        deposit_queries = [
+            query['sql'] for query in queries.captured_queries
+            if 'treasure_deposit' in query['sql']
+        ]
+        self.assertEqual(len(deposit_queries), 1)
+        self.assertNotIn('JOIN', deposit_queries[0])
+
+        response = self.client.get(url, {'fields': 'amount,password'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            reverse('treasure:api-deposits-detail', args=[0])
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_conditional(self):
+        url = reverse('treasure:api-accounts-list')
+        data = {'lodge': self.lodge.pk}
+        response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        response = self.client.get(url, data, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        # Dates can't tell balances changed without `last_modified_on`.
+        response = self.client.get(
+            url, data, HTTP_IF_MODIFIED_SINCE=http_date(time.time())
+        )
+        self.assertEqual(response.status_code, 200)
+
+        models.Account.objects.filter(
+            affiliation=self.affiliations[0]
+        ).update(balance=Decimal('-1.00'))
+        response = self.client.get(url, data, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_create(self):
+        url = reverse('treasure:api-deposits-list')
+        affiliation = self.affiliations[0]
+        balance = affiliation.account.balance
+        data = {
+            'payer': affiliation.pk,
+            'lodge_account': self.lodge_accounts[0].pk,
+            'amount': '100.00',
+            'description': 'Sup'
+        }
+
+        response = self.client.post(
+            url, json.dumps(data), content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        deposit = models.Deposit.objects.get(pk=response.json()['id'])
+        self.assertEqual(deposit.created_by, self.user1)
+        self.assertEqual(response.json()['member'], str(affiliation.user))
+        self.assertEqual(
+            models.Account.objects.get(affiliation=affiliation).balance,
+            balance + Decimal('100.00')
+        )
+
+        response = self.client.post(
+            url,
+            json.dumps(dict(data, amount='invalid')),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('amount', response.json()['errors'])
+        response = self.client.post(
+            url, '{', content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+        # Accounts and movements are read-only.
+        response = self.client.post(
+            reverse('treasure:api-accounts-list'),
+            json.dumps({}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 405)
+
+
+class LedgerTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def setUp(self):
+        self.url_login = reverse('account_login')
+        self.user1 = users.User.objects.get(username='user1')
+        self.user2 = users.User.objects.get(username='user2')
+        self.lodge = users.Lodge.objects.get(name='Example')
+        self.affiliation = users.Affiliation.objects.get(
+            lodge=self.lodge,
+            user=self.user1
+        )
+        self.account = self.affiliation.account
+        self.lodge_account = models.LodgeAccount.objects.get(
+            handler=self.affiliation
+        )
+        self.urls = [
+            reverse('treasure:account-ledger', args=[self.affiliation.pk]),
+            reverse(
+                'treasure:lodgeaccount-ledger', args=[self.lodge_account.pk]
+            )
+        ]
+        self.client.force_login(user=self.user1)
+
+    def add_history(self, count, **kwargs):
+        """
+        Saves `count` movements on both accounts without touching balances.
+        """
+        object_ct = ContentType.objects.get_for_model(models.Deposit)
+        common = {
+            'object_ct': object_ct,
+            'object_id': 1,
+            'amount': Decimal('1.00'),
+            'balance': Decimal('1.00'),
+            'last_modified_by': self.user1
+        }
+        common.update(kwargs)
+        last_movement = models.AccountMovement.objects.latest('pk').pk
+        last_lodge_movement = models.LodgeAccountMovement.objects.latest(
+            'pk'
+        ).pk
+        models.AccountMovement.objects.bulk_create([
+            models.AccountMovement(
+                account=self.account,
+                account_movement_type=models.ACCOUNTMOVEMENT_DEPOSIT,
+                created_by=self.user1 if i % 2 else self.user2,
+                **common
+            )
+            for i in range(count)
+        ])
+        models.LodgeAccountMovement.objects.bulk_create([
+            models.LodgeAccountMovement(
+                lodge_account=self.lodge_account,
+                lodgeaccount_movement_type=models.LODGEACCOUNTMOVEMENT_DEPOSIT,
+                created_by=self.user1 if i % 2 else self.user2,
+                **common
+            )
+            for i in range(count)
+        ])
+        return (
+            models.AccountMovement.objects.filter(pk__gt=last_movement),
+            models.LodgeAccountMovement.objects.filter(
+                pk__gt=last_lodge_movement
+            )
+        )
+
+    def test_read(self):
+        self.client.logout()
+        for url in self.urls:
+            response = self.client.get(url, follow=True)
+            self.assertRedirects(response, self.url_login + '?next=' + url)
+
+        self.client.force_login(user=self.user2)
+        response = self.client.get(self.urls[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'treasure/account_ledger.html')
+        response = self.client.get(self.urls[1])
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'treasure/lodgeaccount_ledger.html')
+
+    def test_is_active(self):
+        self.add_history(3, is_active=False)
+        for url, movements in zip(self.urls, (
+            self.account.movements, self.lodge_account.movements
+        )):
+            response = self.client.get(url)
+            self.assertEqual(
+                [movement.pk for movement in response.context['movements']],
+                list(
+                    movements.filter(is_active=True).order_by(
+                        '-created_on', '-id'
+                    ).values_list('pk', flat=True)
+                )
+            )
+
+    def test_date_range(self):
+        for movements in self.add_history(3):
+            movements.update(created_on=datetime(2001, 6, 15, tzinfo=utc))
+        for movements in self.add_history(2):
+            movements.update(created_on=datetime(2002, 6, 15, tzinfo=utc))
+
+        for url in self.urls:
+            response = self.client.get(url, {
+                'date_from': '2001-01-01',
+                'date_until': '2001-12-31'
+            })
+            self.assertEqual(len(response.context['movements']), 3)
+            response = self.client.get(url, {'date_until': '2002-12-31'})
+            self.assertEqual(len(response.context['movements']), 5)
+            response = self.client.get(url, {'date_from': 'invalid'})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.context['form'].errors)
+
+    def test_query_count(self):
+        self.add_history(3)
+        small = []
+        for url in self.urls:
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            small.append(len(queries))
+
+        self.add_history(120)
+        for url, count in zip(self.urls, small):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(len(queries), count)
+            self.assertEqual(len(response.context['movements']), 50)
+            self.assertTrue(response.context['page_obj'].has_next())
+
+
+class MovementExportTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def setUp(self):
+        self.url_login = reverse('account_login')
+        self.user1 = users.User.objects.get(username='user1')
+        self.lodge = users.Lodge.objects.get(name='Example')
+        self.affiliation = users.Affiliation.objects.get(
+            lodge=self.lodge,
+            user=self.user1
+        )
+        self.lodge_account = models.LodgeAccount.objects.get(
+            handler=self.affiliation
+        )
+        self.url_accounts = reverse('treasure:accountmovement-export')
+        self.url_lodge_accounts = reverse(
+            'treasure:lodgeaccountmovement-export'
+        )
+        self.client.force_login(user=self.user1)
+
+    def read_csv(self, url, data=None):
+        response = self.client.get(url, data or {})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(
+            b''.join(response.streaming_content).decode().splitlines()
+        ))
+        return rows[0], rows[1:]
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get(self.url_accounts, follow=True)
+        self.assertRedirects(
+            response,
+            self.url_login + '?next=' + self.url_accounts
+        )
+
+    def test_account_movements(self):
+        header, rows = self.read_csv(self.url_accounts)
+        self.assertEqual(header[0], 'id')
+        movements = models.AccountMovement.objects.order_by(
+            'created_on', 'id'
+        )
+        self.assertEqual(
+            [int(row[0]) for row in rows],
+            [movement.pk for movement in movements]
+        )
+        movement = movements.first()
+        self.assertEqual(
+            rows[0][6], movement.get_account_movement_type_display()
+        )
+        self.assertEqual(rows[0][7], str(movement.amount))
+
+        header, rows = self.read_csv(
+            self.url_accounts, {'account': self.affiliation.pk}
+        )
+        self.assertEqual(
+            [int(row[0]) for row in rows],
+            list(
+                movements.filter(
+                    account__affiliation=self.affiliation
+                ).values_list('pk', flat=True)
+            )
+        )
+
+        header, rows = self.read_csv(
+            self.url_accounts, {'lodge': self.lodge.pk + 1000}
+        )
+        self.assertEqual(rows, [])
+        header, rows = self.read_csv(
+            self.url_accounts, {'date_until': '2000-01-01'}
+        )
+        self.assertEqual(rows, [])
+
+        response = self.client.get(self.url_accounts, {'lodge': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_lodge_account_movements(self):
+        header, rows = self.read_csv(
+            self.url_lodge_accounts,
+            {'lodge': self.lodge.pk, 'account': self.lodge_account.pk}
+        )
+        self.assertEqual(
+            [int(row[0]) for row in rows],
+            list(
+                models.LodgeAccountMovement.objects.filter(
+                    lodge_account=self.lodge_account
+                ).order_by('created_on', 'id').values_list('pk', flat=True)
+            )
+        )
+        self.assertTrue(rows)
+        for row in rows:
+            self.assertEqual(row[2], self.lodge.name)
+            self.assertEqual(row[3], str(self.lodge_account.pk))
+
+
+class BalanceMailingJobTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def setUp(self):
+        self.user1 = users.User.objects.get(username='user1')
+        self.lodge = users.Lodge.objects.get(name='Example')
+        self.affiliation_ids = list(
+            users.Affiliation.objects.filter(
+                lodge=self.lodge,
+                is_active=True
+            ).values_list('pk', flat=True)
+        )
+
+    def create_job(self, **kwargs):
+        return models.BalanceMailingJob.objects.create(
+            lodge=self.lodge,
+            status=models.JOB_RUNNING,
+            emails_total=len(self.affiliation_ids),
+            created_by=self.user1,
+            last_modified_by=self.user1,
+            **kwargs
+        )
+
+    def test_send(self):
+        url_detail = reverse('users:lodge-detail', args=[self.lodge.pk])
+        self.client.force_login(user=self.user1)
+        response = self.client.post(url_detail, follow=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(
+            response,
+            'treasure/balancemailingjob_detail.html'
+        )
+
+        job = models.BalanceMailingJob.objects.get(lodge=self.lodge)
+        self.assertEqual(response.context['job'], job)
+        self.assertEqual(job.status, models.JOB_DONE)
+        self.assertEqual(job.emails_total, 3)
+        self.assertEqual(job.emails_sent, 3)
+        self.assertEqual(job.emails_failed, 0)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_query_count(self):
+        job = self.create_job()
+        counts = []
+        for affiliation_ids in (
+            self.affiliation_ids[:1], self.affiliation_ids
+        ):
+            with CaptureQueriesContext(connection) as queries:
+                tasks.send_balance_emails.delay(job.pk, affiliation_ids)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(len(mail.outbox), 4)
+
+    def test_retry(self):
+        attempts = []
+
+        def flaky(datatuple, **kwargs):
+            recipient = datatuple[0][4][0]
+            attempts.append(recipient)
+            if recipient == 'user2@user.com' and attempts.count(recipient) < 2:
+                raise OSError('Connection unexpectedly closed')
+            return send_mass_html_mail(datatuple, **kwargs)
+
+        job = self.create_job()
+        with mock.patch.object(tasks, 'send_mass_html_mail', flaky):
+            tasks.send_balance_emails.delay(job.pk, self.affiliation_ids)
+        job.refresh_from_db()
+        self.assertEqual(attempts.count('user2@user.com'), 2)
+        self.assertEqual(job.status, models.JOB_DONE)
+        self.assertEqual(job.emails_sent, 3)
+        self.assertEqual(job.emails_failed, 0)
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_failed_recipients(self):
+        def failing(datatuple, **kwargs):
+            if datatuple[0][4][0] == 'user2@user.com':
+                raise OSError('Recipient refused')
+            return send_mass_html_mail(datatuple, **kwargs)
+
+        job = self.create_job()
+        with mock.patch.object(tasks, 'send_mass_html_mail', failing):
+            tasks.send_balance_emails.delay(job.pk, self.affiliation_ids)
+        job.refresh_from_db()
+        self.assertEqual(job.status, models.JOB_DONE)
+        self.assertEqual(job.emails_sent, 2)
+        self.assertEqual(job.emails_failed, 1)
+        self.assertEqual(job.failed_recipients, 'user2@user.com\n')
+        self.assertEqual(len(mail.outbox), 2)
+
+
+class BalanceEmailTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def setUp(self):
+        self.account = users.Affiliation.objects.get(
+            lodge__name='Example',
+            user__username='user1'
+        ).account
+
+    def test_balance_email(self):
+        subject, text, html, from_email, recipient_list = (
+            emails.balance_email(self.account, 'Title', 'Paid <soon>')
+        )
+        self.assertEqual(subject, 'Title')
+        self.assertEqual(
+            text,
+            'Dear M.·.W.·.B.·. User One:\n'
+            '\tPaid <soon>\n'
+            '\tYour current account balance with Example is of $ -300.00'
+            '\n\nYour last 10 movements are:'
+            '\n\nDate\tType\t\tAmount\t\tBalance\n\n'
+            '2018-05-18\tInvoice\t\t-300.00\t\t-300.00\n'
+        )
+        self.assertEqual(
+            html,
+            '<p>Dear M.·.W.·.B.·. User One:</p>\n\n'
+            '<p>&nbsp;&nbsp;&nbsp;&nbsp;Paid &lt;soon&gt;</p>'
+            '&nbsp;&nbsp;&nbsp;&nbsp;\n\n'
+            '<p>&nbsp;&nbsp;&nbsp;&nbsp;Your current account balance with '
+            'Example is of $ -300.00</p>\n'
+            '<br><br>Your last 10 movements are:<br><br>'
+            '<table><thead><tr>'
+            '<th>Date</th><th>Type</th><th>Amount</th><th>Balance</th>'
+            '</tr></thead><tbody>\n\n'
+            '<tr><td>2018-05-18</td><td>Invoice</td><td>-300.00</td>'
+            '<td>-300.00</td></tr>\n\n'
+            '</tbody></table>\n'
+        )
+        self.assertEqual(from_email, 'user1@user.com')
+        self.assertEqual(recipient_list, ['user1@user.com'])
+
+        # Without content, nor movements.
+        self.account.movements.update(is_active=False)
+        subject, text, html, from_email, recipient_list = (
+            emails.balance_email(self.account, 'Title')
+        )
+        self.assertEqual(
+            text,
+            'Dear M.·.W.·.B.·. User One:\n\n'
+            '\tYour current account balance with Example is of $ -300.00'
+            '\n\nYour last 10 movements are:'
+            '\n\nDate\tType\t\tAmount\t\tBalance\n\n'
+        )
+        self.assertNotIn('<tr><td>', html)
+        self.assertNotIn('&nbsp;&nbsp;&nbsp;&nbsp;\n', html)
+
+
+class LodgeDebtSummaryTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def setUp(self):
+        self.user1 = users.User.objects.get(username='user1')
+        self.lodge = users.Lodge.objects.get(name='Example')
+        self.affiliation = users.Affiliation.objects.get(
+            lodge=self.lodge,
+            user=self.user1
+        )
+        self.lodge_account = models.LodgeAccount.objects.get(
+            handler=self.affiliation
+        )
+        self.today = timezone.localdate()
+
+    def test_posting(self):
+        models.Charge.objects.create(
+            debtor=self.affiliation,
+            charge_type=models.CHARGE_OTHER,
+            amount=Decimal('100.00'),
+            created_by=self.user1,
+            last_modified_by=self.user1
+        )
+        account = models.Account.objects.get(affiliation=self.affiliation)
+        self.assertEqual(account.debt_since, self.today)
+        summary = models.LodgeDebtSummary.objects.get(lodge=self.lodge)
+        self.assertEqual(summary.debtors, 3)
+        self.assertEqual(summary.debt_sum, Decimal('-850.00'))
+        self.assertEqual(summary.debt_min, Decimal('-400.00'))
+        self.assertEqual(summary.debt_max, Decimal('-150.00'))
+        self.assertEqual(summary.debt_avg, Decimal('-283.33'))
+        self.assertEqual(summary.debt_0_30, Decimal('-400.00'))
+
+        models.Deposit.objects.create(
+            payer=self.affiliation,
+            lodge_account=self.lodge_account,
+            amount=Decimal('400.00'),
+            created_by=self.user1,
+            last_modified_by=self.user1
+        )
+        account.refresh_from_db()
+        self.assertIsNone(account.debt_since)
+        summary.refresh_from_db()
+        self.assertEqual(summary.debtors, 2)
+        self.assertEqual(summary.debt_sum, Decimal('-450.00'))
+        self.assertEqual(summary.debt_min, Decimal('-300.00'))
+        self.assertEqual(summary.debt_0_30, Decimal('0.00'))
+
+    def test_aging(self):
+        accounts = models.Account.objects.filter(
+            affiliation__lodge=self.lodge
+        ).order_by('pk')
+        for account, days in zip(accounts, (10, 45, 200)):
+            models.Account.objects.filter(pk=account.pk).update(
+                debt_since=self.today - timedelta(days=days)
+            )
+        rollups.refresh_debt_summaries([self.lodge.pk], self.today)
+        summary = models.LodgeDebtSummary.objects.get(lodge=self.lodge)
+        self.assertEqual(summary.debt_0_30, Decimal('-300.00'))
+        self.assertEqual(summary.debt_31_90, Decimal('-300.00'))
+        self.assertEqual(summary.debt_91_180, Decimal('0.00'))
+        self.assertEqual(summary.debt_over_180, Decimal('-150.00'))
+
+        rollups.refresh_debt_summaries(
+            [self.lodge.pk], self.today + timedelta(days=60)
+        )
+        summary.refresh_from_db()
+        self.assertEqual(summary.debt_0_30, Decimal('0.00'))
+        self.assertEqual(summary.debt_31_90, Decimal('-300.00'))
+        self.assertEqual(summary.debt_91_180, Decimal('-300.00'))
+
+    def test_incremental(self):
+        models.Account.objects.filter(affiliation__lodge=self.lodge).update(
+            debt_since=self.today - timedelta(days=45)
+        )
+        rollups.refresh_debt_summaries([self.lodge.pk], self.today)
+        for amount in ('100.00', '-250.00', '-600.00'):
+            models.Charge.objects.create(
+                debtor=self.affiliation,
+                charge_type=models.CHARGE_OTHER,
+                amount=Decimal(amount),
+                created_by=self.user1,
+                last_modified_by=self.user1
+            )
+            summary = models.LodgeDebtSummary.objects.get(lodge=self.lodge)
+            rollups.refresh_debt_summaries([self.lodge.pk], self.today)
+            refreshed = models.LodgeDebtSummary.objects.get(lodge=self.lodge)
+            for field in models.LodgeDebtSummary._meta.concrete_fields:
+                self.assertEqual(
+                    getattr(summary, field.attname),
+                    getattr(refreshed, field.attname)
+                )
+
+    def test_movements(self):
+        def assert_summary():
+            summary = models.LodgeDebtSummary.objects.get(lodge=self.lodge)
+            rollups.refresh_debt_summaries([self.lodge.pk], self.today)
+            refreshed = models.LodgeDebtSummary.objects.get(lodge=self.lodge)
+            for field in models.LodgeDebtSummary._meta.concrete_fields:
+                self.assertEqual(
+                    getattr(summary, field.attname),
+                    getattr(refreshed, field.attname)
+                )
+
+        rollups.refresh_debt_summaries([self.lodge.pk], self.today)
+        account = self.affiliation.account
+        # Movements saved by themselves, not posted from a document.
+        movement = models.AccountMovement.objects.create(
+            account=account,
+            account_movement_type=models.ACCOUNTMOVEMENT_DEPOSIT,
+            amount=-account.balance,
+            balance=Decimal('0.00'),
+            object_ct=ContentType.objects.get_for_model(account),
+            object_id=account.pk,
+            created_by=self.user1,
+            last_modified_by=self.user1
+        )
+        account.refresh_from_db()
+        self.assertEqual(account.balance, Decimal('0.00'))
+        self.assertIsNone(account.debt_since)
+        assert_summary()
+
+        movement.is_active = False
+        movement.save(update_fields=['is_active'])
+        account.refresh_from_db()
+        self.assertEqual(account.debt_since, self.today)
+        assert_summary()
+
+    def test_debtors_list(self):
+        url_list = reverse('treasure:debtor-list', args=[self.lodge.pk])
+        self.client.force_login(user=self.user1)
+        response = self.client.get(url_list)
+        self.assertEqual(response.status_code, 200)
+        summary = response.context['summary']
+        self.assertEqual(summary.debtors, 3)
+        self.assertEqual(summary.debt_sum, Decimal('-750.00'))
+        self.assertEqual(
+            [account.balance for account in response.context['object_list']],
+            [Decimal('-300.00'), Decimal('-300.00'), Decimal('-150.00')]
+        )
+
+
+class PostingServiceTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def setUp(self):
+        self.user1 = users.User.objects.get(username='user1')
+        self.user2 = users.User.objects.get(username='user2')
+        self.lodge = users.Lodge.objects.get(name='Example')
+        self.affiliation1 = users.Affiliation.objects.get(
+            lodge=self.lodge,
+            user=self.user1
+        )
+        self.affiliation2 = users.Affiliation.objects.get(
+            lodge=self.lodge,
+            user=self.user2
+        )
+        self.lodge_account1 = models.LodgeAccount.objects.get(
+            handler=self.affiliation1
+        )
+        self.lodge_account2 = models.LodgeAccount.objects.get(pk=2)
+
+    def create_documents(self, count):
+        """
+        Saves `count` deposits and transfers without posting them.
+        """
+        last_deposit = models.Deposit.objects.latest('pk').pk
+        last_transfer = models.LodgeAccountTransfer.objects.latest('pk').pk
+        models.Deposit.objects.bulk_create([
+            models.Deposit(
+                payer=self.affiliation1 if i % 2 else self.affiliation2,
+                lodge_account=self.lodge_account1,
+                amount=Decimal('10.00') * (i + 1),
+                created_by=self.user1,
+                last_modified_by=self.user1
+            )
+            for i in range(count)
+        ])
+        models.LodgeAccountTransfer.objects.bulk_create([
+            models.LodgeAccountTransfer(
+                lodge_account_from=self.lodge_account1,
+                lodge_account_to=self.lodge_account2,
+                amount=Decimal('5.00'),
+                created_by=self.user1,
+                last_modified_by=self.user1
+            )
+            for i in range(count)
+        ])
+        return list(
+            models.Deposit.objects.filter(pk__gt=last_deposit).order_by('pk')
+        ) + list(
+            models.LodgeAccountTransfer.objects.filter(
+                pk__gt=last_transfer
+            ).order_by('pk')
+        )
+
+    def test_post(self):
+        account1 = self.affiliation1.account
+        account2 = self.affiliation2.account
+        lodge_global_account = self.lodge.lodge_global_account
+        documents = self.create_documents(4)
+        service = posting.PostingService(self.user1)
+        ContentType.objects.get_for_models(
+            models.Deposit, models.LodgeAccountTransfer
+        )
+        # Otherwise the first posting of the day builds the debt summary.
+        rollups.refresh_debt_summaries([self.lodge.pk])
+
+        with CaptureQueriesContext(connection) as queries:
+            service.post(documents)
+
+        self.assertEqual(
+            models.Account.objects.get(pk=account1.pk).balance,
+            account1.balance + Decimal('60.00')
+        )
+        self.assertEqual(
+            models.Account.objects.get(pk=account2.pk).balance,
+            account2.balance + Decimal('40.00')
+        )
+        self.assertEqual(
+            models.LodgeAccount.objects.get(pk=self.lodge_account1.pk).balance,
+            self.lodge_account1.balance + Decimal('80.00')
+        )
+        self.assertEqual(
+            models.LodgeAccount.objects.get(pk=self.lodge_account2.pk).balance,
+            self.lodge_account2.balance + Decimal('20.00')
+        )
+        self.assertEqual(
+            models.LodgeGlobalAccount.objects.get(
+                pk=lodge_global_account.pk
+            ).balance,
+            lodge_global_account.balance + Decimal('100.00')
+        )
+        self.assertEqual(
+            list(
+                models.AccountMovement.objects.filter(
+                    account=account1,
+                    object_id__in=[d.pk for d in documents[:4]],
+                    account_movement_type=models.ACCOUNTMOVEMENT_DEPOSIT
+                ).order_by('pk').values_list('amount', 'balance')
+            ),
+            [
+                (Decimal('20.00'), account1.balance + Decimal('20.00')),
+                (Decimal('40.00'), account1.balance + Decimal('60.00'))
+            ]
+        )
+        self.assertEqual(
+            models.LodgeAccountMovement.objects.filter(
+                lodge_account=self.lodge_account2,
+                lodgeaccount_movement_type=models.LODGEACCOUNTMOVEMENT_TRANSFER,
+                amount=Decimal('5.00')
+            ).count(),
+            4
+        )
+
+        # The number of queries doesn't depend on the size of the batch.
+        documents = self.create_documents(40)
+        with CaptureQueriesContext(connection) as more_queries:
+            service.post(documents)
+        self.assertEqual(len(more_queries), len(queries))
+
+    def test_set_active(self):
+        account = self.affiliation1.account
+        lodge_global_account = self.lodge.lodge_global_account
+        deposit = models.Deposit.objects.create(
+            payer=self.affiliation1,
+            lodge_account=self.lodge_account1,
+            amount=Decimal('100.00'),
+            created_by=self.user1,
+            last_modified_by=self.user1
+        )
+
+        deposit.is_active = False
+        deposit.last_modified_by = self.user2
+        deposit.save(
+            update_fields=('is_active', 'last_modified_by', 'last_modified_on')
+        )
+        self.assertEqual(
+            models.Account.objects.get(pk=account.pk).balance,
+            account.balance
+        )
+        self.assertEqual(
+            models.LodgeAccount.objects.get(pk=self.lodge_account1.pk).balance,
+            self.lodge_account1.balance
+        )
+        self.assertEqual(
+            models.LodgeGlobalAccount.objects.get(
+                pk=lodge_global_account.pk
+            ).balance,
+            lodge_global_account.balance
+        )
+        self.assertFalse(deposit.account_movement.get().is_active)
+        self.assertFalse(deposit.lodge_account_movement.get().is_active)
+
+        # Saving it again as inactive doesn't revert it twice.
+        deposit.save(
+            update_fields=('is_active', 'last_modified_by', 'last_modified_on')
+        )
+        self.assertEqual(
+            models.Account.objects.get(pk=account.pk).balance,
+            account.balance
+        )
+
+        deposit.is_active = True
+        deposit.save(
+            update_fields=('is_active', 'last_modified_by', 'last_modified_on')
+        )
+        self.assertEqual(
+            models.Account.objects.get(pk=account.pk).balance,
+            account.balance + Decimal('100.00')
+        )
+        self.assertEqual(
+            models.LodgeGlobalAccount.objects.get(
+                pk=lodge_global_account.pk
+            ).balance,
+            lodge_global_account.balance + Decimal('100.00')
+        )
+        self.assertTrue(deposit.account_movement.get().is_active)
+
+    def test_bulk_insert_outside_transaction(self):
+        deposit = models.Deposit(
+            payer=self.affiliation1,
+            lodge_account=self.lodge_account1,
+            amount=Decimal('10.00'),
+            created_by=self.user1,
+            last_modified_by=self.user1
+        )
+        # Tests always run in one.
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            with self.assertRaises(transaction.TransactionManagementError):
+                posting.bulk_insert(models.Deposit, [deposit])
+        self.assertIsNone(deposit.pk)
+        self.assertEqual(
+            posting.bulk_insert(models.Deposit, [deposit])[0],
+            models.Deposit.objects.latest('pk')
+        )
+
+    def test_movement_saved_by_itself(self):
+        balance = self.lodge_account1.balance
+        movement = models.LodgeAccountMovement(
+            lodge_account=self.lodge_account1,
+            lodgeaccount_movement_type=models.LODGEACCOUNTMOVEMENT_DEPOSIT,
+            amount=Decimal('10.00'),
+            balance=Decimal('0.00'),
+            object_ct=ContentType.objects.get_for_model(self.lodge_account1),
+            object_id=self.lodge_account1.pk,
+            created_by=self.user1,
+            last_modified_by=self.user1
+        )
+        # A failure after the balance moved takes it back.
+        with mock.patch(
+            'hijos.treasure.signals.lodge_account_movement_roll_up',
+            side_effect=DatabaseError
+        ):
+            with self.assertRaises(DatabaseError):
+                movement.save()
+        self.lodge_account1.refresh_from_db()
+        self.assertEqual(self.lodge_account1.balance, balance)
+
+
+class PostingConcurrencyTestCase(TransactionTestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+    threads = 4
+    deposits_per_thread = 500
+
+    def setUp(self):
+        self.user1 = users.User.objects.get(username='user1')
+        self.lodge = users.Lodge.objects.get(name='Example')
+        self.affiliation = users.Affiliation.objects.get(
+            lodge=self.lodge,
+            user=self.user1
+        )
+        self.lodge_account = models.LodgeAccount.objects.get(
+            handler=self.affiliation
+        )
+
+    def post_deposits(self, errors):
+        try:
+            for i in range(self.deposits_per_thread):
+                while True:
+                    try:
+                        with transaction.atomic():
+                            models.Deposit.objects.create(
+                                payer=self.affiliation,
+                                lodge_account=self.lodge_account,
+                                amount=Decimal('1.00'),
+                                created_by=self.user1,
+                                last_modified_by=self.user1
+                            )
+                    except OperationalError:
+                        # The database is locked by another writer, try again.
+                        time.sleep(0.001)
+                        continue
+                    break
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connections.close_all()
+
+    def test_concurrent_deposits(self):
+        account = self.affiliation.account
+        lodge_global_account = self.lodge.lodge_global_account
+        errors = []
+        threads = [
+            threading.Thread(target=self.post_deposits, args=(errors,))
+            for i in range(self.threads)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertFalse(errors)
+
+        total = Decimal('1.00') * self.threads * self.deposits_per_thread
+        self.assertEqual(
+            models.Account.objects.get(pk=account.pk).balance,
+            account.balance + total
+        )
+        self.assertEqual(
+            models.LodgeAccount.objects.get(pk=self.lodge_account.pk).balance,
+            self.lodge_account.balance + total
+        )
+        self.assertEqual(
+            models.LodgeGlobalAccount.objects.get(
+                pk=lodge_global_account.pk
+            ).balance,
+            lodge_global_account.balance + total
+        )
+
+        # Every movement got its own running balance.
+        balances = sorted(
+            models.AccountMovement.objects.filter(
+                account=account,
+                created_on__gt=account.last_modified_on
+            ).values_list('balance', flat=True)
+        )
+        self.assertEqual(
+            balances,
+            [
+                account.balance + i + 1
+                for i in range(self.threads * self.deposits_per_thread)
+            ]
+        )
+
+
+class AdviseIndexesTestCase(TestCase):
+    """
+    """
+
+    def test_known_queries(self):
+        out = StringIO()
+        call_command('advise_indexes', check=True, stdout=out)
+        self.assertIn('accountmovement_ledger_idx', out.getvalue())
+        self.assertIn('categoryprice_range_idx', out.getvalue())
+
+
+class BalanceCheckpointTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def setUp(self):
+        self.user1 = users.User.objects.get(username='user1')
+        self.account = models.Account.objects.get(pk=2)
+        self.may = date(year=2018, month=5, day=31)
+        self.june = date(year=2018, month=6, day=15)
+
+    def test_take_checkpoints(self):
+        self.assertEqual(
+            checkpoints.take_checkpoints(models.Account, self.may), 3
+        )
+        self.assertEqual(
+            checkpoints.take_checkpoints(models.LodgeAccount, self.may), 2
+        )
+        # Taking them again keeps the ones already taken.
+        checkpoints.take_checkpoints(models.Account, self.may)
+        self.assertEqual(
+            list(
+                self.account.checkpoints.values_list('date', 'balance')
+            ),
+            [(self.may, Decimal('-300.00'))]
+        )
+        self.assertEqual(
+            checkpoints.take_checkpoints(models.Account, self.june), 0
+        )
+
+    def test_catch_up(self):
+        today = date(2018, 9, 10)
+        self.assertEqual(
+            checkpoints.missing_month_ends(models.Account, today)[-1],
+            date(2018, 8, 31)
+        )
+        months = len(checkpoints.missing_month_ends(models.Account, today))
+        self.assertEqual(
+            checkpoints.catch_up(models.Account, today), (3, months)
+        )
+        self.assertEqual(
+            self.account.checkpoints.filter(date=self.may).get().balance,
+            Decimal('-300.00')
+        )
+        self.assertEqual(
+            checkpoints.missing_month_ends(models.Account, today), []
+        )
+        self.assertGreater(months, 1)
+
+        models.AccountBalanceCheckpoint.objects.all().delete()
+        out = StringIO()
+        call_command('take_checkpoints', stdout=out)
+        self.assertIn('accounts: 3 checkpoints', out.getvalue())
+        self.assertTrue(
+            self.account.checkpoints.filter(date=self.may).exists()
+        )
+
+    def test_balance_as_of(self):
+        self.assertEqual(
+            checkpoints.balance_as_of(self.account, date(2018, 5, 17)),
+            Decimal('-200.00')
+        )
+        checkpoints.take_checkpoints(models.Account, self.may)
+        models.Charge.objects.create(
+            debtor=self.account.affiliation,
+            charge_type=models.CHARGE_OTHER,
+            amount=Decimal('100.00'),
+            created_by=self.user1,
+            last_modified_by=self.user1
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(
+                checkpoints.balance_as_of(self.account, self.june),
+                Decimal('-300.00')
+            )
+        self.assertEqual(len(queries), 2)
+        self.assertEqual(
+            checkpoints.balance_as_of(self.account, timezone.localdate()),
+            Decimal('-400.00')
+        )
+
+        # Deactivating a movement made before the checkpoint corrects it.
+        movement = models.AccountMovement.objects.get(pk=5)
+        movement.is_active = False
+        movement.save(update_fields=['is_active'])
+        self.assertEqual(
+            checkpoints.balance_as_of(self.account, self.june),
+            Decimal('-500.00')
+        )
+        self.assertEqual(
+            checkpoints.balance_as_of(self.account, timezone.localdate()),
+            models.Account.objects.get(pk=self.account.pk).balance
+        )
+
+
+class VerifyLedgerTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def test_verify(self):
+        call_command('verify_ledger', stdout=StringIO())
+
+        models.Account.objects.filter(pk=1).update(balance=Decimal('0.00'))
+        models.LodgeGlobalAccount.objects.update(balance=Decimal('1.00'))
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('verify_ledger', stdout=out)
+        self.assertIn('balance 0.00, movements -300.00', out.getvalue())
+
+        call_command('verify_ledger', fix=True, stdout=StringIO())
+        self.assertEqual(
+            models.Account.objects.get(pk=1).balance, Decimal('-300.00')
+        )
+        self.assertEqual(
+            models.LodgeGlobalAccount.objects.get().balance,
+            Decimal('200.00')
+        )
+        self.assertEqual(
+            models.LodgeDebtSummary.objects.get().debt_sum,
+            Decimal('-750.00')
+        )
+        call_command('verify_ledger', stdout=StringIO())
+
+    def test_running(self):
+        out = StringIO()
+        call_command('verify_ledger', running=True, stdout=out)
+        self.assertIn('account movements: 2 running', out.getvalue())
+        self.assertEqual(
+            list(
+                models.AccountMovement.objects.filter(
+                    account=2
+                ).order_by('created_on', 'id').values_list('balance', flat=True)
+            ),
+            [Decimal('-200.00'), Decimal('-500.00'), Decimal('-300.00')]
+        )
+
+
+class DepositImportTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def setUp(self):
+        self.user1 = users.User.objects.get(username='user1')
+        self.lodge = users.Lodge.objects.get(name='Example')
+        self.affiliation1 = users.Affiliation.objects.get(
+            lodge=self.lodge,
+            user=self.user1
+        )
+        self.affiliation2 = users.Affiliation.objects.get(
+            lodge=self.lodge,
+            user__username='user2'
+        )
+        self.lodge_account = models.LodgeAccount.objects.get(
+            handler=self.affiliation1
+        )
+        self.client.force_login(user=self.user1)
+        self.imports_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.imports_root)
+        statements = override_settings(
+            TREASURE_IMPORTS_ROOT=self.imports_root
+        )
+        statements.enable()
+        self.addCleanup(statements.disable)
+
+    def statement(self, lines):
+        return (
+            'Date,Amount,Description\n' + ''.join(
+                '2019-03-%02d,%s,%s\n' % (i % 28 + 1, amount, description)
+                for i, (amount, description) in enumerate(lines)
+            )
+        ).encode()
+
+    def test_read(self):
+        lines = list(imports.read_csv(BytesIO(
+            b'\xef\xbb\xbfDate, AMOUNT ,description\n'
+            b'2019-03-01,"1.500,50",Transfer user1\n'
+            b'01/03/2019,20.00,\n'
+            b'yesterday,x,Other\n'
+        )))
+        self.assertEqual(lines, [
+            (2, date(2019, 3, 1), Decimal('1500.50'), 'Transfer user1'),
+            (3, date(2019, 3, 1), Decimal('20.00'), ''),
+            (4, None, None, 'Other')
+        ])
+
+        lines = list(imports.read_ofx(BytesIO(
+            b'OFXHEADER:100\n<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS>'
+            b'<BANKTRANLIST>\n'
+            b'<STMTTRN>\n<TRNTYPE>CREDIT\n<DTPOSTED>20190301120000\n'
+            b'<TRNAMT>150.00\n<NAME>One User\n<MEMO>March\n</STMTTRN>\n'
+            b'<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20190302<TRNAMT>-10.00'
+            b'<MEMO>Fee</STMTTRN>\n'
+            b'</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>\n'
+        )))
+        self.assertEqual(lines, [
+            (1, date(2019, 3, 1), Decimal('150.00'), 'One User March'),
+            (2, date(2019, 3, 2), Decimal('-10.00'), 'Fee')
+        ])
+
+    def test_parse_amount(self):
+        for value, amount in (
+            ('1,234.56', Decimal('1234.56')),
+            ('1.234,56', Decimal('1234.56')),
+            ('12,5', Decimal('12.50')),
+            ('100.00', Decimal('100.00')),
+            (' -1.234.567,8 ', Decimal('-1234567.80')),
+            ('100', Decimal('100.00')),
+            # Either a thousands or a decimal separator.
+            ('1,234', None),
+            ('1.234', None),
+            ('1,23,4.00', None),
+            ('1.234.56', None),
+            ('x', None),
+            ('', None)
+        ):
+            self.assertEqual(imports.parse_amount(value), amount, value)
+
+    def test_match(self):
+        matcher = imports.Matcher(self.lodge)
+        self.assertEqual(
+            matcher.match('Transfer from USER1.'), self.affiliation1.pk
+        )
+        self.assertEqual(
+            matcher.match('user2@user.com: March'), self.affiliation2.pk
+        )
+        self.assertEqual(
+            matcher.match('TRANSF. ÓNE, USER'), self.affiliation1.pk
+        )
+        self.assertEqual(
+            matcher.match('user two march'), self.affiliation2.pk
+        )
+        self.assertIsNone(matcher.match('User March'))
+
+        lines = [
+            imports.StatementLine(1, date(2019, 3, 1), Decimal('1.00'), 'x'),
+            imports.StatementLine(2, date(2019, 3, 1), Decimal('-1.00'), 'x'),
+            imports.StatementLine(3, None, Decimal('1.00'), 'user1')
+        ]
+        self.assertEqual(
+            [error for line, pk, error in matcher.lines(lines)],
+            [imports.NO_MEMBER, imports.NOT_A_CREDIT, imports.NOT_READABLE]
+        )
+
+    def test_import(self):
+        account1 = self.affiliation1.account
+        account2 = self.affiliation2.account
+        lodge_global_account = self.lodge.lodge_global_account
+        statement = self.statement(
+            [('100.00', 'user1'), ('-5.00', 'Fee'), ('nothing', 'user1')] +
+            [('10.00', 'user2 march')] * 20 +
+            [('30.00', 'Someone else')]
+        )
+
+        upload = SimpleUploadedFile('statement.csv', statement)
+        response = self.client.post(
+            reverse('treasure:deposit-import'),
+            {'lodge_account': self.lodge_account.pk, 'statement': upload}
+        )
+        self.assertEqual(response.status_code, 200)
+        summary = response.context['summary']
+        self.assertEqual(summary['matched_count'], 21)
+        self.assertEqual(summary['matched_total'], Decimal('300.00'))
+        self.assertEqual(summary['unmatched_count'], 3)
+        self.assertEqual(summary['matched'][0][1], 'One, User')
+        self.assertFalse(models.Deposit.objects.filter(
+            description__endswith='user2 march'
+        ).exists())
+
+        data = response.context['confirm_form'].initial
+        # Kept out of MEDIA_ROOT, which is (or may be) served.
+        self.assertTrue(os.path.isfile(
+            os.path.join(self.imports_root, data['token'])
+        ))
+        ContentType.objects.get_for_model(models.Deposit)
+        rollups.refresh_debt_summaries([self.lodge.pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse('treasure:deposit-import-confirm'), data
+            )
+        self.assertRedirects(
+            response, reverse('treasure:deposit-list', args=[self.lodge.pk])
+        )
+        # Posting doesn't depend on the number of deposits.
+        self.assertLess(len(queries), 40)
+        self.assertEqual(len(mail.outbox), 0)
+
+        deposits = models.Deposit.objects.filter(
+            description__in=['2019-03-01 user1', '2019-03-04 user2 march']
+        )
+        self.assertEqual(len(deposits), 2)
+        self.assertEqual(
+            models.Account.objects.get(pk=account1.pk).balance,
+            account1.balance + Decimal('100.00')
+        )
+        self.assertEqual(
+            models.Account.objects.get(pk=account2.pk).balance,
+            account2.balance + Decimal('200.00')
+        )
+        self.assertEqual(
+            models.LodgeGlobalAccount.objects.get(
+                pk=lodge_global_account.pk
+            ).balance,
+            lodge_global_account.balance + Decimal('300.00')
+        )
+        movements = models.AccountMovement.objects.filter(
+            account=account2,
+            treasure_account_deposit__description__endswith='user2 march'
+        ).order_by('id')
+        self.assertEqual(len(movements), 20)
+        self.assertEqual(
+            movements.last().balance, account2.balance + Decimal('200.00')
+        )
+        self.assertEqual(
+            models.LodgeAccountMovement.objects.filter(
+                lodge_account=self.lodge_account,
+                lodgeaccount_movement_type=models.LODGEACCOUNTMOVEMENT_DEPOSIT,
+                object_id__in=models.Deposit.objects.filter(
+                    description__endswith='user2 march'
+                ).values('pk')
+            ).count(),
+            20
+        )
+
+        # The statement is gone once imported.
+        response = self.client.post(
+            reverse('treasure:deposit-import-confirm'), data
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('token', response.context['errors'])
+
+        upload = SimpleUploadedFile('statement.pdf', statement)
+        response = self.client.post(
+            reverse('treasure:deposit-import'),
+            {'lodge_account': self.lodge_account.pk, 'statement': upload}
+        )
+        self.assertIn('statement', response.context['form'].errors)
+
+
+class PriceBookTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def setUp(self):
+        self.user1 = users.User.objects.get(username='user1')
+        self.lodge = users.Lodge.objects.get(name='Example')
+        self.affiliation = users.Affiliation.objects.get(
+            lodge=self.lodge,
+            user=self.user1
+        )
+        self.period = models.Period.objects.get(pk=1)
+
+    def test_prices(self):
+        book = prices.PriceBook([
+            (1, date(2018, 1, 1), date(2018, 12, 31), Decimal('10.00')),
+            (1, date(2020, 1, 1), date(2020, 12, 31), Decimal('30.00')),
+            (1, date(2019, 1, 1), date(2019, 12, 31), Decimal('20.00')),
+            (2, date(2018, 1, 1), date(3000, 12, 31), Decimal('5.00')),
+            (2, date(2018, 6, 1), date(2018, 6, 30), Decimal('6.00'))
+        ])
+        self.assertEqual(book.prices(1, date(2019, 3, 1)), [Decimal('20.00')])
+        self.assertEqual(book.prices(1, date(2019, 1, 1)), [Decimal('20.00')])
+        self.assertEqual(book.prices(1, date(2017, 12, 31)), [])
+        self.assertEqual(book.prices(1, date(2021, 1, 1)), [])
+        self.assertEqual(book.prices(3, date(2019, 1, 1)), [])
+        # A range spanning two prices has none in force for all of it.
+        self.assertEqual(
+            book.prices(1, date(2018, 12, 1), date(2019, 1, 31)), []
+        )
+        self.assertEqual(
+            book.price(2, date(2019, 1, 1), date(2019, 12, 31)),
+            Decimal('5.00')
+        )
+        self.assertEqual(
+            sorted(book.prices(2, date(2018, 6, 15))),
+            [Decimal('5.00'), Decimal('6.00')]
+        )
+        with self.assertRaisesMessage(
+            prices.PriceNotFound, "More than one price found."
+        ):
+            book.price(2, date(2018, 6, 15))
+        with self.assertRaisesMessage(
+            prices.PriceNotFound, "Category's price not found."
+        ):
+            book.price(1, date(2021, 1, 1))
+
+    def test_reload(self):
+        category_price = users.CategoryPrice.objects.get(
+            category=self.affiliation.category
+        )
+        book = prices.get_price_book()
+        self.assertEqual(
+            book.price(
+                self.affiliation.category_id,
+                self.period.begin,
+                self.period.end
+            ),
+            category_price.price
+        )
+        with self.assertNumQueries(1):
+            self.assertIs(prices.get_price_book(), book)
+
+        category_price.price = Decimal('120.00')
+        category_price.save()
+        self.assertEqual(
+            prices.get_price_book().price(
+                self.affiliation.category_id, self.period.begin
+            ),
+            Decimal('120.00')
+        )
+
+        # Even changes that don't go through save(), as from other processes.
+        users.CategoryPrice.objects.filter(pk=category_price.pk).update(
+            is_active=False
+        )
+        self.assertEqual(
+            prices.get_price_book().prices(
+                self.affiliation.category_id, self.period.begin
+            ),
+            []
+        )
+
+    def test_invoice_initial(self):
+        self.client.force_login(user=self.user1)
+        price = users.CategoryPrice.objects.get(
+            category=self.affiliation.category
+        ).price
+        response = self.client.get(
+            reverse('treasure:invoice-create'),
+            {'period': self.period.pk, 'affiliation': self.affiliation.pk}
+        )
+        self.assertEqual(
+            response.context['form'].initial['amount'],
+            price * self.period.price_multiplier
+        )
+        response = self.client.get(
+            reverse('treasure:invoice-create'), {'period': 'x'}
+        )
+        self.assertNotIn('amount', response.context['form'].initial)
+
+        # Without a price in force, the amount is left to the treasurer.
+        users.CategoryPrice.objects.filter(
+            category=self.affiliation.category
+        ).update(is_active=False)
+        response = self.client.get(
+            reverse('treasure:invoice-create'),
+            {'period': self.period.pk, 'affiliation': self.affiliation.pk}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('amount', response.context['form'].initial)
+
+
+class SeedBenchmarkTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def test_seed(self):
+        out = StringIO()
+        call_command(
+            'seed_benchmark', lodges=2, members=3, years=1, stdout=out
+        )
+        self.assertIn('2 lodges, 6 affiliations, 12 months', out.getvalue())
+        lodges = users.Lodge.objects.filter(name__startswith='Benchmark ')
+        self.assertEqual(
+            models.Invoice.objects.filter(period__lodge__in=lodges).count(),
+            2 * 3 * 12
+        )
+        self.assertEqual(
+            models.LodgeGlobalAccount.objects.filter(lodge__in=lodges).count(),
+            2
+        )
+        # The history is spread over the last year, not made today.
+        first = models.AccountMovement.objects.filter(
+            account__affiliation__lodge__in=lodges
+        ).order_by('created_on').first()
+        self.assertLess(
+            first.created_on, timezone.now() - timedelta(days=300)
+        )
+        self.assertEqual(models.LodgeDebtSummary.objects.filter(
+            lodge__in=lodges
+        ).count(), 2)
+        call_command('verify_ledger', stdout=StringIO())
+
+        with self.assertRaises(CommandError):
+            call_command('seed_benchmark', lodges=1, stdout=StringIO())
+
+    def test_repeatable(self):
+        call_command(
+            'seed_benchmark', lodges=1, members=5, years=1, stdout=StringIO()
+        )
+        call_command(
+            'seed_benchmark', lodges=1, members=5, years=1, prefix='Other',
+            stdout=StringIO()
+        )
+        self.assertEqual(
+            list(
+                models.Deposit.objects.filter(
+                    payer__lodge__name='Benchmark 0'
+                ).order_by('pk').values_list('amount', flat=True)
+            ),
+            list(
+                models.Deposit.objects.filter(
+                    payer__lodge__name='Other 0'
+                ).order_by('pk').values_list('amount', flat=True)
+            )
+        )
+
+
+class LodgeDashboardTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def setUp(self):
+        self.user1 = users.User.objects.get(username='user1')
+        self.lodge = users.Lodge.objects.get(name='Example')
+        self.affiliation = users.Affiliation.objects.get(
+            lodge=self.lodge,
+            user=self.user1
+        )
+        self.lodge_account = models.LodgeAccount.objects.get(
+            handler=self.affiliation
+        )
+        self.month = timezone.localdate().replace(day=1)
+        self.client.force_login(self.user1)
+
+    def rollup(self, ledger, movement_type):
+        return models.LodgeMonthlyRollup.objects.filter(
+            lodge=self.lodge,
+            month=self.month,
+            ledger=ledger,
+            movement_type=movement_type
+        ).values_list('amount', 'movements').first()
+
+    def test_posting(self):
+        deposit = models.Deposit.objects.create(
+            payer=self.affiliation,
+            lodge_account=self.lodge_account,
+            amount=Decimal('100.00'),
+            created_by=self.user1,
+            last_modified_by=self.user1
+        )
+        models.LodgeAccountEgress.objects.create(
+            lodge_account=self.lodge_account,
+            amount=Decimal('30.00'),
+            egress_type=models.EGRESS_TYPE_EXPENSES,
+            created_by=self.user1,
+            last_modified_by=self.user1
+        )
+        self.assertEqual(
+            self.rollup(
+                models.ROLLUP_ACCOUNTS, models.ACCOUNTMOVEMENT_DEPOSIT
+            ),
+            (Decimal('100.00'), 1)
+        )
+        self.assertEqual(
+            self.rollup(
+                models.ROLLUP_LODGEACCOUNTS,
+                models.LODGEACCOUNTMOVEMENT_DEPOSIT
+            ),
+            (Decimal('100.00'), 1)
+        )
+        self.assertEqual(
+            self.rollup(
+                models.ROLLUP_LODGEACCOUNTS,
+                models.LODGEACCOUNTMOVEMENT_EGRESS
+            ),
+            (Decimal('-30.00'), 1)
+        )
+
+        deposit.is_active = False
+        deposit.save(update_fields=('is_active', 'last_modified_on'))
+        self.assertEqual(
+            self.rollup(
+                models.ROLLUP_ACCOUNTS, models.ACCOUNTMOVEMENT_DEPOSIT
+            ),
+            (Decimal('0.00'), 0)
+        )
+
+        # Movements saved by themselves are rolled up too.
+        models.AccountMovement.objects.create(
+            account=self.affiliation.account,
+            account_movement_type=models.ACCOUNTMOVEMENT_CHARGE,
+            amount=Decimal('-10.00'),
+            balance=Decimal('0.00'),
+            object_ct=ContentType.objects.get_for_model(deposit),
+            object_id=deposit.pk,
+            created_by=self.user1,
+            last_modified_by=self.user1
+        )
+        self.assertEqual(
+            self.rollup(models.ROLLUP_ACCOUNTS, models.ACCOUNTMOVEMENT_CHARGE),
+            (Decimal('-10.00'), 1)
+        )
+
+    def test_monthly_summary(self):
+        last_month = rollups.add_months(self.month, -1)
+        self.assertEqual(rollups.add_months(date(2019, 1, 31), -1), date(
+            2018, 12, 1
+        ))
+        models.LodgeMonthlyRollup.objects.bulk_create([
+            models.LodgeMonthlyRollup(
+                lodge=self.lodge,
+                month=month,
+                ledger=ledger,
+                movement_type=movement_type,
+                amount=Decimal(amount),
+                movements=1
+            )
+            for month, ledger, movement_type, amount in (
+                (last_month, models.ROLLUP_LODGEACCOUNTS, 'I', '50.00'),
+                (last_month, models.ROLLUP_LODGEACCOUNTS, 'T', '0.00'),
+                (last_month, models.ROLLUP_ACCOUNTS, 'I', '-300.00'),
+                (self.month, models.ROLLUP_LODGEACCOUNTS, 'E', '-20.00'),
+                (self.month, models.ROLLUP_LODGEACCOUNTS, 'D', '100.00'),
+                (self.month, models.ROLLUP_ACCOUNTS, 'D', '100.00'),
+                (self.month, models.ROLLUP_ACCOUNTS, 'G', '25.00'),
+                (self.month, models.ROLLUP_ACCOUNTS, 'C', '-40.00')
+            )
+        ])
+        summary = rollups.monthly_summary(
+            self.lodge.pk, Decimal('500.00'), months=3
+        )
+        self.assertEqual(
+            [row['month'] for row in summary],
+            [rollups.add_months(self.month, -2), last_month, self.month]
+        )
+        self.assertEqual(
+            [row['balance'] for row in summary],
+            [Decimal('370.00'), Decimal('420.00'), Decimal('500.00')]
+        )
+        self.assertEqual(summary[1]['ingress'], Decimal('50.00'))
+        self.assertEqual(summary[1]['invoiced'], Decimal('300.00'))
+        self.assertEqual(summary[2]['egress'], Decimal('20.00'))
+        self.assertEqual(summary[2]['deposits'], Decimal('100.00'))
+        self.assertEqual(summary[2]['invoiced'], Decimal('40.00'))
+        self.assertEqual(summary[2]['collected'], Decimal('125.00'))
+
+    def test_view(self):
+        url = reverse('treasure:lodge-dashboard', args=[self.lodge.pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['months']), 12)
+        self.assertEqual(
+            [account.balance for account in response.context['top_debtors']],
+            sorted(
+                models.Account.objects.filter(
+                    affiliation__lodge=self.lodge,
+                    balance__lt=Decimal('0.00')
+                ).values_list('balance', flat=True)
+            )
+        )
+
+        # The page reads the rollups, whatever the number of movements.
+        call_command(
+            'seed_benchmark', lodges=1, members=5, years=1, stdout=StringIO()
+        )
+        lodge = users.Lodge.objects.get(name='Benchmark 0')
+        with CaptureQueriesContext(connection) as more_queries:
+            response = self.client.get(
+                reverse('treasure:lodge-dashboard', args=[lodge.pk])
+            )
+        self.assertEqual(len(more_queries), len(queries))
+        months = response.context['months']
+        self.assertEqual(
+            months[-1]['balance'], lodge.lodge_global_account.balance
+        )
+        last_month = months[-2]
+        self.assertEqual(
+            last_month['collected'],
+            models.Deposit.objects.filter(
+                payer__lodge=lodge,
+                created_on__date__gte=last_month['month']
+            ).aggregate(total=Sum('amount'))['total']
+        )
+
+
+class AgingTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def setUp(self):
+        self.user1 = users.User.objects.get(username='user1')
+        self.lodge = users.Lodge.objects.get(name='Example')
+        self.client.force_login(self.user1)
+
+    def test_allocate(self):
+        today = date(2019, 12, 31)
+        movements = [
+            # Part of the second invoice is still owed, and the last one.
+            (1, 200, -10000),
+            (1, 100, -10000),
+            (1, 50, 15000),
+            (1, 10, -10000),
+            # Paid in advance.
+            (2, 30, 30000),
+            (2, 20, -10000),
+            # Paid off.
+            (3, 400, -5000),
+            (3, 300, 5000),
+            # A credit settles part of a later debit.
+            (4, 60, 2000),
+            (4, 40, -5000)
+        ]
+        aged = aging.allocate(
+            array('q', [account for account, days, amount in movements]),
+            array('l', [
+                (today - timedelta(days=days)).toordinal()
+                for account, days, amount in movements
+            ]),
+            array('q', [amount for account, days, amount in movements]),
+            today
+        )
+        self.assertEqual([debt.account_id for debt in aged], [1, 4])
+        self.assertEqual(aged[0].balance, Decimal('-150.00'))
+        self.assertEqual(aged[0].debt, Decimal('150.00'))
+        self.assertEqual(
+            aged[0].buckets,
+            [Decimal('100.00'), Decimal('0.00'), Decimal('50.00'),
+             Decimal('0.00')]
+        )
+        self.assertEqual(aged[0].oldest, today - timedelta(days=100))
+        self.assertEqual(aged[1].debt, Decimal('30.00'))
+        self.assertEqual(aged[1].buckets[1], Decimal('30.00'))
+
+    def test_report(self):
+        rows, totals = aging.aging_report(self.lodge)
+        debts = models.Account.objects.filter(
+            affiliation__lodge=self.lodge,
+            balance__lt=Decimal('0.00')
+        ).values_list('balance', flat=True)
+        self.assertEqual(len(rows), len(debts))
+        self.assertEqual(totals['debt'], -sum(debts))
+        self.assertEqual(sum(totals['buckets']), totals['debt'])
+
+        response = self.client.get(
+            reverse('treasure:aging-report', args=[self.lodge.pk])
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, str(totals['debt']))
+
+        response = self.client.get(
+            reverse('treasure:aging-export', args=[self.lodge.pk])
+        )
+        lines = list(csv.reader(
+            b''.join(response.streaming_content).decode().splitlines()
+        ))
+        self.assertEqual(
+            lines[0][:5],
+            ['affiliation', 'last name', 'first name', 'balance', 'debt']
+        )
+        self.assertEqual(len(lines), len(rows) + 1)
+        self.assertEqual(lines[1][0], str(rows[0][1]['id']))
+
+
+class LodgeCacheTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def setUp(self):
+        cache.clear()
+        self.user1 = users.User.objects.get(username='user1')
+        self.lodge = users.Lodge.objects.get(name='Example')
+        self.affiliation = users.Affiliation.objects.get(
+            lodge=self.lodge,
+            user=self.user1
+        )
+        self.lodge_account = models.LodgeAccount.objects.get(
+            handler=self.affiliation
+        )
+        self.client.force_login(self.user1)
+
+    def version(self):
+        return users.Lodge.objects.values_list(
+            'version', flat=True
+        ).get(pk=self.lodge.pk)
+
+    def key(self):
+        return caching.lodge_key(users.Lodge.objects.get(pk=self.lodge.pk))
+
+    def deposit(self):
+        return models.Deposit(
+            payer=self.affiliation,
+            lodge_account=self.lodge_account,
+            amount=Decimal('100.00'),
+            created_by=self.user1,
+            last_modified_by=self.user1
+        )
+
+    def test_version(self):
+        version = self.version()
+        self.deposit().save()
+        self.assertGreater(self.version(), version)
+
+        version = self.version()
+        with transaction.atomic():
+            posting.PostingService(self.user1).post(
+                posting.bulk_insert(models.Deposit, [self.deposit()])
+            )
+        self.assertEqual(self.version(), version + 1)
+
+        version = self.version()
+        self.user1.save()
+        self.assertEqual(self.version(), version + 1)
+
+        # Logging in changes nothing lodge pages show.
+        self.client.force_login(self.user1)
+        self.assertEqual(self.version(), version + 1)
+
+        # Saving a lodge writes back the version it was read with, but it's
+        # bumped on a later instant, so its keys still change.
+        key = self.key()
+        self.lodge.save()
+        self.assertNotEqual(self.key(), key)
+
+    def test_deletes_and_fixes(self):
+        deposit = self.deposit()
+        deposit.save()
+        version = self.version()
+        deposit.delete()
+        self.assertGreater(self.version(), version)
+
+        affiliation = users.Affiliation.objects.create(
+            lodge=self.lodge,
+            user=users.User.objects.create(username='new'),
+            category=self.affiliation.category,
+            created_by=self.user1,
+            last_modified_by=self.user1
+        )
+        affiliation.account.delete()
+        version = self.version()
+        affiliation.delete()
+        self.assertGreater(self.version(), version)
+
+        # Balances fixed by verify_ledger are changed behind the posting.
+        account = models.Account.objects.filter(
+            affiliation__lodge=self.lodge
+        ).first()
+        models.Account.objects.filter(pk=account.pk).update(
+            balance=F('balance') + 1
+        )
+        version = self.version()
+        call_command('verify_ledger', '--fix', stdout=StringIO())
+        self.assertGreater(self.version(), version)
+
+        movement = models.AccountMovement.objects.filter(
+            account__affiliation__lodge=self.lodge
+        ).first()
+        models.AccountMovement.objects.filter(pk=movement.pk).update(
+            balance=F('balance') + 1
+        )
+        version = self.version()
+        call_command('verify_ledger', '--running', stdout=StringIO())
+        self.assertGreater(self.version(), version)
+
+    def test_cached_pages(self):
+        deposits = reverse('treasure:deposit-list', args=[self.lodge.pk])
+        affiliations = reverse('users:affiliation-list', args=[self.lodge.pk])
+        self.client.get(deposits)
+        self.client.get(affiliations)
+
+        # Changes behind the back of the version aren't seen...
+        models.Deposit.objects.update(description='Changed')
+        users.User.objects.filter(pk=self.user1.pk).update(last_name='Zed')
+        response = self.client.get(deposits)
+        self.assertEqual(
+            len(response.context['deposits']),
+            models.Deposit.objects.filter(payer__lodge=self.lodge).count()
+        )
+        self.assertNotContains(self.client.get(affiliations), 'Zed')
+
+        # ...until the lodge's data changes.
+        with transaction.atomic():
+            posting.PostingService(self.user1).post(
+                posting.bulk_insert(models.Deposit, [self.deposit()])
+            )
+        response = self.client.get(deposits)
+        self.assertEqual(
+            len(response.context['deposits']),
+            models.Deposit.objects.filter(payer__lodge=self.lodge).count()
+        )
+        self.assertContains(self.client.get(affiliations), 'Zed')
+
+        self.user1.refresh_from_db()
+        self.user1.last_name = 'Young'
+        self.user1.save()
+        self.assertContains(self.client.get(affiliations), 'Young')
+
+
+class LodgeConditionalTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def setUp(self):
+        self.user1 = users.User.objects.get(username='user1')
+        self.lodge = users.Lodge.objects.get(name='Example')
+        self.affiliation = users.Affiliation.objects.get(
+            lodge=self.lodge,
+            user=self.user1
+        )
+        self.lodge_account = models.LodgeAccount.objects.get(
+            handler=self.affiliation
+        )
+        self.urls = [
+            reverse(name, args=[self.lodge.pk])
+            for name in (
+                'treasure:deposit-list',
+                'treasure:debtor-list',
+                'treasure:lodge-dashboard',
+                'treasure:aging-report',
+                'treasure:aging-export',
+                'users:lodge-detail',
+                'users:affiliation-list'
+            )
+        ]
+        self.client.force_login(self.user1)
+
+    def test_not_modified(self):
+        etags = {url: self.client.get(url)['ETag'] for url in self.urls}
+        for url, etag in etags.items():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304, url)
+            self.assertFalse([
+                query for query in queries
+                if 'movement' in query['sql'].lower()
+            ])
+
+        models.Deposit.objects.create(
+            payer=self.affiliation,
+            lodge_account=self.lodge_account,
+            amount=Decimal('100.00'),
+            created_by=self.user1,
+            last_modified_by=self.user1
+        )
+        for url, etag in etags.items():
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+
+    def test_last_modified(self):
+        url = self.urls[0]
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=last_modified
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_other_users(self):
+        url = self.urls[0]
+        etag = self.client.get(url)['ETag']
+        self.client.force_login(users.User.objects.get(username='user2'))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class ReceiptStorageTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/treasure/tests/fixtures/users.json',
+        'hijos/treasure/tests/fixtures/treasure.json'
+    ]
+
+    def setUp(self):
+        self.user1 = users.User.objects.get(username='user1')
+        self.affiliation = users.Affiliation.objects.get(
+            lodge__name='Example',
+            user=self.user1
+        )
+        self.lodge_account = models.LodgeAccount.objects.get(
+            handler=self.affiliation
+        )
+        self.client.force_login(self.user1)
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def deposit(self, name, content):
+        return models.Deposit.objects.create(
+            payer=self.affiliation,
+            lodge_account=self.lodge_account,
+            amount=Decimal('100.00'),
+            receipt=SimpleUploadedFile(name, content),
+            send_email=False,
+            created_by=self.user1,
+            last_modified_by=self.user1
+        )
+
+    def test_deduplication(self):
+        deposit1 = self.deposit('one.JPG', b'0123456789')
+        deposit2 = self.deposit('two.jpg', b'0123456789')
+        deposit3 = self.deposit('three.jpg', b'9876543210')
+        self.assertEqual(deposit1.receipt.name, deposit2.receipt.name)
+        self.assertNotEqual(deposit1.receipt.name, deposit3.receipt.name)
+        self.assertRegex(
+            deposit1.receipt.name,
+            r'^receipts/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.jpg$'
+        )
+        files = [
+            name
+            for directory, directories, names in os.walk(self.media_root)
+            for name in names
+        ]
+        self.assertEqual(len(files), 2)
+        with deposit2.receipt.open('rb') as file:
+            self.assertEqual(file.read(), b'0123456789')
+
+    def test_serve(self):
+        url = self.deposit('one.jpg', b'0123456789').receipt.url
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        response = self.client.get(url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+        response = self.client.get(url, HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with override_settings(RECEIPTS_SENDFILE_HEADER='X-Accel-Redirect'):
+            response = self.client.get(url)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(
+            response['X-Accel-Redirect'],
+            '/protected/' + url.split('/files/', 1)[1]
+        )
+
+        self.assertEqual(
+            self.client.get(
+                reverse('treasure:receipt', args=['other/file.jpg'])
+            ).status_code,
+            404
+        )
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_traversal(self):
+        os.makedirs(os.path.join(self.media_root, 'imports'))
+        with open(
+            os.path.join(self.media_root, 'imports', 'statement.csv'), 'w'
+        ) as file:
+            file.write('Date,Amount,Description\n')
+        self.deposit('one.jpg', b'0123456789')
+        for name in (
+            'receipts/../imports/statement.csv',
+            'receipts/./../imports/statement.csv',
+            'receipts//../imports/statement.csv',
+            'receipts/.upload-x'
+        ):
+            self.assertFalse(storage.is_receipt_name(name))
+            response = self.client.get(
+                reverse('treasure:receipt', args=[name])
+            )
+            self.assertEqual(response.status_code, 404, name)
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from hijos.treasure import forms, views
+from hijos.treasure import api, forms, views
 
 app_name = 'treasure'
 urlpatterns = [
@@ -19,6 +19,26 @@ urlpatterns = [
         view=views.LodgeAccountDetailView.as_view(),
         name='lodgeaccount-detail'
     ),
+    path(
+        'lodgeaccounts/<int:pk>/ledger/',
+        view=views.LodgeAccountLedgerView.as_view(),
+        name='lodgeaccount-ledger'
+    ),
+    path(
+        'affiliations/<int:pk>/ledger/',
+        view=views.AccountLedgerView.as_view(),
+        name='account-ledger'
+    ),
+    path(
+        'exports/accountmovements.csv',
+        view=views.AccountMovementExportView.as_view(),
+        name='accountmovement-export'
+    ),
+    path(
+        'exports/lodgeaccountmovements.csv',
+        view=views.LodgeAccountMovementExportView.as_view(),
+        name='lodgeaccountmovement-export'
+    ),
     path(
         'lodges/<int:pk>/periods/',
         view=views.PeriodsByLodgeList.as_view(),
@@ -34,6 +54,16 @@ urlpatterns = [
         view=views.PeriodDetailView.as_view(),
         name='period-detail'
     ),
+    path(
+        'periods/<int:pk>/status/',
+        view=views.PeriodStatusView.as_view(),
+        name='period-status'
+    ),
+    path(
+        'balancemailingjobs/<int:pk>/',
+        view=views.BalanceMailingJobDetailView.as_view(),
+        name='balancemailingjob-detail'
+    ),
     path(
         'lodges/<int:pk>/invoices/',
         view=views.InvoicesByLodgeList.as_view(),
@@ -59,6 +89,16 @@ urlpatterns = [
         view=views.DepositCreateView.as_view(),
         name='deposit-create'
     ),
+    path(
+        'deposits/import/',
+        view=forms.DepositImport.as_view(),
+        name='deposit-import'
+    ),
+    path(
+        'deposits/import/confirm/',
+        view=forms.DepositImportConfirm.as_view(),
+        name='deposit-import-confirm'
+    ),
     path(
         'deposits/<int:pk>/',
         view=views.DepositDetailView.as_view(),
@@ -158,5 +198,40 @@ urlpatterns = [
         'lodges/<int:pk>/debtors/',
         view=views.DebtorsByLodgeList.as_view(),
         name='debtor-list'
+    ),
+    path(
+        'lodges/<int:pk>/dashboard/',
+        view=views.LodgeDashboardView.as_view(),
+        name='lodge-dashboard'
+    ),
+    path(
+        'lodges/<int:pk>/aging/',
+        view=views.AgingReportView.as_view(),
+        name='aging-report'
+    ),
+    path(
+        'lodges/<int:pk>/aging.csv',
+        view=views.AgingExportView.as_view(),
+        name='aging-export'
+    ),
+    path(
+        'files/<path:name>',
+        view=views.ReceiptView.as_view(),
+        name='receipt'
     )
 ]
+
+# JSON API, see `api.ResourceListView` and `api.ResourceDetailView`.
+for name, resource in api.RESOURCES:
+    urlpatterns += [
+        path(
+            'api/%s/' % name,
+            view=api.ResourceListView.as_view(resource=resource),
+            name='api-%s-list' % name
+        ),
+        path(
+            'api/%s/<int:pk>/' % name,
+            view=api.ResourceDetailView.as_view(resource=resource),
+            name='api-%s-detail' % name
+        )
+    ]
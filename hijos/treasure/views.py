@@ -1,15 +1,29 @@
 from decimal import Decimal
 
+from common import routers
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Avg, Max, Min, Q, Sum
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import router
+from django.db.models import Q
+from django.http import Http404, HttpResponseBadRequest
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+from django.views import View
 from django.views.generic import CreateView, DetailView, ListView, UpdateView
 
-from hijos.treasure import models
+from hijos.treasure import aging, exports, forms, invoicing, models, prices, rollups, storage
+from hijos.treasure.pagination import CachedKeysetPaginationMixin, KeysetPaginationMixin
+from hijos.users import caching
 from hijos.users import models as users
 
 
-class LodgeAccountsByLodgeList(LoginRequiredMixin, ListView):
+class LodgeAccountsByLodgeList(
+    LoginRequiredMixin,
+    caching.LodgeConditionalMixin,
+    CachedKeysetPaginationMixin,
+    ListView
+):
     template_name = 'treasure/lodgeaccount_list.html'
     context_object_name = 'lodge_accounts'
 
@@ -19,7 +33,7 @@ class LodgeAccountsByLodgeList(LoginRequiredMixin, ListView):
         )
         return models.LodgeAccount.objects.filter(
             handler__lodge=self.lodge
-        )
+        ).select_related('handler__user', 'handler__lodge')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -44,9 +58,115 @@ class LodgeAccountCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
-class PeriodsByLodgeList(LoginRequiredMixin, ListView):
+class LedgerMixin(KeysetPaginationMixin):
+    """
+    Lists the active movements of an account, newest first, optionally
+    within a date range.
+
+    The account, an `account_model`, is looked up by `account_lookup` from
+    the `pk` of the URL, and is the `account_field` of its movements, under
+    which it's also in the context.
+    """
+    context_object_name = 'movements'
+    movement_model = None
+    account_model = None
+    account_field = None
+    account_lookup = 'pk'
+    account_related = ()
+
+    def get_queryset(self):
+        self.account = get_object_or_404(
+            self.account_model.objects.select_related(*self.account_related),
+            **{self.account_lookup: self.kwargs['pk']}
+        )
+        self.form = forms.LedgerFilterForm(self.request.GET)
+        return self.form.filter(
+            self.movement_model.objects.filter(
+                is_active=True,
+                **{self.account_field: self.account}
+            ).select_related('created_by')
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['form'] = self.form
+        context[self.account_field] = self.account
+        return context
+
+
+class LodgeAccountLedgerView(LoginRequiredMixin, LedgerMixin, ListView):
+    template_name = 'treasure/lodgeaccount_ledger.html'
+    movement_model = models.LodgeAccountMovement
+    account_model = models.LodgeAccount
+    account_field = 'lodge_account'
+    account_related = ('handler__user', 'handler__lodge')
+
+
+class AccountLedgerView(LoginRequiredMixin, LedgerMixin, ListView):
+    template_name = 'treasure/account_ledger.html'
+    movement_model = models.AccountMovement
+    account_model = models.Account
+    account_field = 'account'
+    account_lookup = 'affiliation'
+    account_related = ('affiliation__user', 'affiliation__lodge')
+
+
+class MovementExportView(LoginRequiredMixin, View):
+    """
+    Streams the movements, oldest first, as CSV. They can be filtered by
+    the `lodge`, `account` (affiliation or lodge account), `date_from` and
+    `date_until` GET parameters.
+    """
+    model = None
+    columns = None
+    lodge_lookup = None
+    account_lookup = None
+    filename = None
+    chunk_size = 2000
+
+    def get(self, request, *args, **kwargs):
+        form = forms.LedgerExportForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        # The rows are read while streaming, after the request is done, so
+        # the database is chosen now.
+        movements = form.filter_by(
+            self.model.objects.using(router.db_for_read(self.model)),
+            self.lodge_lookup,
+            self.account_lookup
+        ).order_by('created_on', 'id')
+        return exports.stream_csv(
+            self.filename,
+            self.columns,
+            exports.export_rows(movements, self.columns, self.chunk_size)
+        )
+
+
+class AccountMovementExportView(MovementExportView):
+    model = models.AccountMovement
+    columns = exports.ACCOUNT_MOVEMENT_COLUMNS
+    lodge_lookup = 'account__affiliation__lodge'
+    account_lookup = 'account__affiliation'
+    filename = 'account_movements.csv'
+
+
+class LodgeAccountMovementExportView(MovementExportView):
+    model = models.LodgeAccountMovement
+    columns = exports.LODGEACCOUNT_MOVEMENT_COLUMNS
+    lodge_lookup = 'lodge_account__handler__lodge'
+    account_lookup = 'lodge_account'
+    filename = 'lodge_account_movements.csv'
+
+
+class PeriodsByLodgeList(
+    LoginRequiredMixin,
+    caching.LodgeConditionalMixin,
+    CachedKeysetPaginationMixin,
+    ListView
+):
     template_name = 'treasure/period_list.html'
     context_object_name = 'periods'
+    keyset_ordering = ('-begin', '-id')
 
     def get_queryset(self):
         self.lodge = get_object_or_404(
@@ -68,18 +188,52 @@ class PeriodDetailView(LoginRequiredMixin, DetailView):
     template_name = 'treasure/period_detail.html'
 
 
+class PeriodStatusView(LoginRequiredMixin, DetailView):
+    template_name = 'treasure/period_status.html'
+    context_object_name = 'job'
+
+    def get_object(self, queryset=None):
+        return get_object_or_404(
+            models.PeriodInvoicingJob.objects.select_related('period__lodge'),
+            period=self.kwargs['pk']
+        )
+
+
+class BalanceMailingJobDetailView(LoginRequiredMixin, DetailView):
+    queryset = models.BalanceMailingJob.objects.select_related('lodge')
+    context_object_name = 'job'
+    template_name = 'treasure/balancemailingjob_detail.html'
+
+
 class PeriodCreateView(LoginRequiredMixin, CreateView):
     model = models.Period
     fields = ['lodge', 'begin', 'end', 'price_multiplier', 'send_email']
     template_name = 'treasure/period_add.html'
 
     def form_valid(self, form):
+        # Invoices are created in the background, check up front that every
+        # category has a price so the period doesn't fail half way through.
+        categories = users.Affiliation.objects.filter(
+            lodge=form.instance.lodge,
+            is_active=True
+        ).values_list('category', flat=True).distinct()
+        try:
+            invoicing.get_category_prices(form.instance, set(categories))
+        except prices.PriceNotFound as e:
+            form.add_error(None, str(e))
+            return self.form_invalid(form)
+
         form.instance.created_by = self.request.user
         form.instance.last_modified_by = self.request.user
         return super().form_valid(form)
 
 
-class InvoicesByLodgeList(LoginRequiredMixin, ListView):
+class InvoicesByLodgeList(
+    LoginRequiredMixin,
+    caching.LodgeConditionalMixin,
+    CachedKeysetPaginationMixin,
+    ListView
+):
     template_name = 'treasure/invoice_list.html'
     context_object_name = 'invoices'
 
@@ -89,7 +243,7 @@ class InvoicesByLodgeList(LoginRequiredMixin, ListView):
         )
         return models.Invoice.objects.filter(
             period__lodge=self.lodge
-        )
+        ).select_related('period')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -108,13 +262,41 @@ class InvoiceCreateView(LoginRequiredMixin, CreateView):
     fields = ['period', 'affiliation', 'amount', 'send_email']
     template_name = 'treasure/invoice_add.html'
 
+    def get_initial(self):
+        """
+        Defaults the amount to the price of the period for the member's
+        category, if both are given as GET parameters.
+        """
+        initial = super().get_initial()
+        try:
+            period = models.Period.objects.get(pk=self.request.GET['period'])
+            affiliation = users.Affiliation.objects.get(
+                pk=self.request.GET['affiliation']
+            )
+        except (KeyError, ValueError, ObjectDoesNotExist):
+            return initial
+        initial.update(period=period, affiliation=affiliation)
+        try:
+            initial['amount'] = prices.get_price_book().price(
+                affiliation.category_id, period.begin, period.end
+            ) * period.price_multiplier
+        except prices.PriceNotFound:
+            # No single price; the treasurer has to enter it.
+            pass
+        return initial
+
     def form_valid(self, form):
         form.instance.created_by = self.request.user
         form.instance.last_modified_by = self.request.user
         return super().form_valid(form)
 
 
-class DepositsByLodgeList(LoginRequiredMixin, ListView):
+class DepositsByLodgeList(
+    LoginRequiredMixin,
+    caching.LodgeConditionalMixin,
+    CachedKeysetPaginationMixin,
+    ListView
+):
     template_name = 'treasure/deposit_list.html'
     context_object_name = 'deposits'
 
@@ -124,6 +306,11 @@ class DepositsByLodgeList(LoginRequiredMixin, ListView):
         )
         return models.Deposit.objects.filter(
             payer__lodge=self.lodge
+        ).select_related(
+            'payer__user',
+            'payer__lodge',
+            'lodge_account__handler__user',
+            'lodge_account__handler__lodge'
         )
 
     def get_context_data(self, **kwargs):
@@ -156,7 +343,12 @@ class DepositCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
-class ChargesByLodgeList(LoginRequiredMixin, ListView):
+class ChargesByLodgeList(
+    LoginRequiredMixin,
+    caching.LodgeConditionalMixin,
+    CachedKeysetPaginationMixin,
+    ListView
+):
     template_name = 'treasure/charge_list.html'
     context_object_name = 'charges'
 
@@ -166,7 +358,7 @@ class ChargesByLodgeList(LoginRequiredMixin, ListView):
         )
         return models.Charge.objects.filter(
             debtor__lodge=self.lodge
-        )
+        ).select_related('debtor__user', 'debtor__lodge')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -197,7 +389,12 @@ class ChargeCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
-class GrandLodgeDepositsByLodgeList(LoginRequiredMixin, ListView):
+class GrandLodgeDepositsByLodgeList(
+    LoginRequiredMixin,
+    caching.LodgeConditionalMixin,
+    CachedKeysetPaginationMixin,
+    ListView
+):
     template_name = 'treasure/grandlodgedeposit_list.html'
     context_object_name = 'grand_lodge_deposits'
 
@@ -207,7 +404,7 @@ class GrandLodgeDepositsByLodgeList(LoginRequiredMixin, ListView):
         )
         return models.GrandLodgeDeposit.objects.filter(
             payer__lodge=self.lodge
-        )
+        ).select_related('payer__user', 'payer__lodge')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -248,8 +445,13 @@ class GrandLodgeDepositUpdateView(LoginRequiredMixin, UpdateView):
         return super().form_valid(form)
 
 
-class LodgeAccountIngressesByLodgeList(LoginRequiredMixin, ListView):
-    template_name = 'treasure/lodgeaccountingresses_list.html'
+class LodgeAccountIngressesByLodgeList(
+    LoginRequiredMixin,
+    caching.LodgeConditionalMixin,
+    CachedKeysetPaginationMixin,
+    ListView
+):
+    template_name = 'treasure/lodgeaccountingress_list.html'
     context_object_name = 'ingresses'
 
     def get_queryset(self):
@@ -258,6 +460,9 @@ class LodgeAccountIngressesByLodgeList(LoginRequiredMixin, ListView):
         )
         return models.LodgeAccountIngress.objects.filter(
             lodge_account__handler__lodge=self.lodge
+        ).select_related(
+            'lodge_account__handler__user',
+            'lodge_account__handler__lodge'
         )
 
     def get_context_data(self, **kwargs):
@@ -289,8 +494,13 @@ class LodgeAccountIngressCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
-class LodgeAccountEgressesByLodgeList(LoginRequiredMixin, ListView):
-    template_name = 'treasure/lodgeaccountegresses_list.html'
+class LodgeAccountEgressesByLodgeList(
+    LoginRequiredMixin,
+    caching.LodgeConditionalMixin,
+    CachedKeysetPaginationMixin,
+    ListView
+):
+    template_name = 'treasure/lodgeaccountegress_list.html'
     context_object_name = 'egresses'
 
     def get_queryset(self):
@@ -299,6 +509,9 @@ class LodgeAccountEgressesByLodgeList(LoginRequiredMixin, ListView):
         )
         return models.LodgeAccountEgress.objects.filter(
             lodge_account__handler__lodge=self.lodge
+        ).select_related(
+            'lodge_account__handler__user',
+            'lodge_account__handler__lodge'
         )
 
     def get_context_data(self, **kwargs):
@@ -330,7 +543,12 @@ class LodgeAccountEgressCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
-class LodgeAccountTransfersByLodgeList(LoginRequiredMixin, ListView):
+class LodgeAccountTransfersByLodgeList(
+    LoginRequiredMixin,
+    caching.LodgeConditionalMixin,
+    CachedKeysetPaginationMixin,
+    ListView
+):
     template_name = 'treasure/lodgeaccounttransfer_list.html'
     context_object_name = 'transfers'
 
@@ -341,6 +559,11 @@ class LodgeAccountTransfersByLodgeList(LoginRequiredMixin, ListView):
         return models.LodgeAccountTransfer.objects.filter(
             Q(lodge_account_from__handler__lodge=self.lodge) |
             Q(lodge_account_to__handler__lodge=self.lodge)
+        ).select_related(
+            'lodge_account_from__handler__user',
+            'lodge_account_from__handler__lodge',
+            'lodge_account_to__handler__user',
+            'lodge_account_to__handler__lodge'
         )
 
     def get_context_data(self, **kwargs):
@@ -371,26 +594,115 @@ class LodgeAccountTransferCreateView(LoginRequiredMixin, CreateView):
         return super().form_valid(form)
 
 
-class DebtorsByLodgeList(LoginRequiredMixin, ListView):
+class DebtorsByLodgeList(
+    LoginRequiredMixin,
+    caching.LodgeConditionalMixin,
+    CachedKeysetPaginationMixin,
+    ListView
+):
     template_name = 'treasure/debtors_list.html'
     context_object_name = 'debtor_accounts'
+    keyset_ordering = ('balance', 'id')
 
     def get_queryset(self):
         self.lodge = get_object_or_404(
-            users.Lodge, pk=self.kwargs['pk']
+            users.Lodge.objects.select_related('debt_summary'),
+            pk=self.kwargs['pk']
         )
         return models.Account.objects.filter(
             affiliation__lodge=self.lodge,
             balance__lt=Decimal('0.00')
-        ).order_by('balance')
+        ).select_related('affiliation__user', 'affiliation__lodge')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['lodge'] = self.lodge
-        context['aggregations'] = self.object_list.aggregate(
-            debt_sum=Sum('balance'),
-            debt_avg=Avg('balance'),
-            debt_max=Max('balance'),
-            debt_min=Min('balance')
+        try:
+            summary = self.lodge.debt_summary
+        except models.LodgeDebtSummary.DoesNotExist:
+            summary = None
+        # Debts age by the day; the first visit of the day ages them again.
+        if summary is None or summary.aged_on != timezone.localdate():
+            with routers.reads_from_primary():
+                rollups.refresh_debt_summaries([self.lodge.pk])
+                summary = models.LodgeDebtSummary.objects.get(
+                    lodge=self.lodge
+                )
+        context['summary'] = summary
+        return context
+
+
+class LodgeDashboardView(
+    LoginRequiredMixin, caching.LodgeConditionalMixin, DetailView
+):
+    """
+    Monthly totals, global balance trend and top debtors of a lodge, read
+    from the rollups the posting layer maintains instead of the movements.
+    """
+    queryset = users.Lodge.objects.select_related('lodge_global_account')
+    template_name = 'treasure/lodge_dashboard.html'
+    context_object_name = 'lodge'
+    top_debtors = 10
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        try:
+            balance = self.object.lodge_global_account.balance
+        except models.LodgeGlobalAccount.DoesNotExist:
+            balance = Decimal('0.00')
+        context['balance'] = balance
+        context['months'] = rollups.monthly_summary(self.object.pk, balance)
+        context['top_debtors'] = list(
+            models.Account.objects.filter(
+                affiliation__lodge=self.object,
+                balance__lt=Decimal('0.00')
+            ).select_related(
+                'affiliation__user', 'affiliation__lodge'
+            ).order_by('balance', 'id')[:self.top_debtors]
         )
         return context
+
+
+class AgingReportView(
+    LoginRequiredMixin, caching.LodgeConditionalMixin, DetailView
+):
+    """
+    How old the debt of every member of a lodge is, allocating deposits to
+    the oldest invoices and charges first (see `aging.allocate`).
+    """
+    model = users.Lodge
+    template_name = 'treasure/aging_report.html'
+    context_object_name = 'lodge'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['rows'], context['totals'] = aging.aging_report(self.object)
+        return context
+
+
+class AgingExportView(
+    LoginRequiredMixin, caching.LodgeConditionalMixin, View
+):
+
+    def get(self, request, *args, **kwargs):
+        lodge = get_object_or_404(users.Lodge, pk=self.kwargs['pk'])
+        rows, totals = aging.aging_report(lodge)
+        return exports.stream_csv(
+            'aging.csv', exports.AGING_COLUMNS, aging.export_rows(rows)
+        )
+
+
+class ReceiptView(LoginRequiredMixin, View):
+    """
+    Serves the receipts of deposits, ingresses and egresses to members, see
+    `storage.serve`.
+    """
+
+    def get(self, request, *args, **kwargs):
+        name = self.kwargs['name']
+        if not (
+            storage.is_receipt_name(name) and
+            storage.receipt_storage.exists(name)
+        ):
+            raise Http404(_("Receipt not found."))
+        return storage.serve(request, storage.receipt_storage, name)
@@ -1,5 +1,6 @@
 from django.apps import AppConfig
-from django.db.models.signals import post_save
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 from django.utils.translation import ugettext_lazy as _
 
 
@@ -8,8 +9,15 @@ class UsersConfig(AppConfig):
     verbose_name = _("users")
 
     def ready(self):
+        from common import sqlite
         from hijos.users import models, signals
 
+        connection_created.connect(
+            receiver=sqlite.set_pragmas,
+            dispatch_uid='Common_Connection_SetSQLitePragmas',
+            weak=False
+        )
+
         post_save.connect(
             receiver=signals.lodge,
             sender=models.Lodge,
@@ -22,3 +30,15 @@ class UsersConfig(AppConfig):
             dispatch_uid='Users_Affiliation_CreateAccount',
             weak=False
         )
+        post_save.connect(
+            receiver=signals.user,
+            sender=models.User,
+            dispatch_uid='Users_User_BumpLodgeVersion',
+            weak=False
+        )
+        post_delete.connect(
+            receiver=signals.affiliation_deleted,
+            sender=models.Affiliation,
+            dispatch_uid='Users_Affiliation_BumpLodgeVersion',
+            weak=False
+        )
@@ -0,0 +1,120 @@
+import hashlib
+from datetime import datetime, time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, F, Max
+from django.middleware.csrf import get_token
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+from hijos.users import models
+
+
+def bump_lodges(lodge_ids):
+    """
+    Bumps the version of the lodges (ids, or a subquery of them), so nothing
+    cached for them is used again.
+
+    The version is a column of the lodge, changed in the same transaction as
+    its data, so every process (and every cache backend, even the per
+    process locmem one) sees both at once, and a rolled back change leaves
+    the version it found.
+    """
+    models.Lodge.objects.filter(pk__in=lodge_ids).update(
+        version=F('version') + 1,
+        version_on=timezone.now()
+    )
+
+
+def lodge_key(lodge, *parts):
+    """
+    Returns the cache key of something of a lodge, as of its current
+    version, further identified by `parts` (view name, cursor, etc.).
+    """
+    # The instant tells apart versions with the same number, whose changes
+    # were rolled back or that a save of a lodge read before wrote back.
+    return 'lodge:%d:%d:%s:%s' % (
+        lodge.pk,
+        lodge.version,
+        lodge.version_on.timestamp(),
+        hashlib.md5(repr(parts).encode()).hexdigest()
+    )
+
+
+def lodges_key():
+    """
+    Returns the cache key of the list of lodges, which only changes when a
+    lodge is saved, added or deleted.
+    """
+    lodges = models.Lodge.objects.aggregate(
+        count=Count('id'), last_modified_on=Max('last_modified_on')
+    )
+    return 'lodges:%d:%s' % (
+        lodges['count'],
+        lodges['last_modified_on'] and lodges['last_modified_on'].timestamp()
+    )
+
+
+def cached(key, function):
+    """
+    Returns what was cached under `key`, or caches and returns what
+    `function` returns.
+    """
+    return cache.get_or_set(key, function, settings.LODGE_CACHE_TIMEOUT)
+
+
+def lodge_version(lodge_id):
+    """
+    Returns the `(version, version on)` of a lodge, or None if there's none.
+    """
+    return models.Lodge.objects.filter(pk=lodge_id).values_list(
+        'version', 'version_on'
+    ).first()
+
+
+def csrf_secret(request):
+    """
+    Returns the CSRF cookie of the request, the one its page will be rendered
+    with, setting a new one if it has none yet.
+    """
+    get_token(request)
+    return request.META['CSRF_COOKIE']
+
+
+class LodgeConditionalMixin:
+    """
+    Gives the GET responses of the pages of a lodge an ETag and Last-Modified
+    of its version, and answers 304 Not Modified, reading just the lodge's
+    row, while the client's copy is current.
+
+    Pages are per user (and carry its CSRF token) and some age debts by the
+    day, so those are part of the ETag too, and Last-Modified is never
+    before today.
+    """
+    lodge_kwarg = 'pk'
+
+    def dispatch(self, request, *args, **kwargs):
+        version = None
+        if request.method in ('GET', 'HEAD'):
+            version = lodge_version(self.kwargs[self.lodge_kwarg])
+        if version is None:
+            # Not found lodges are answered (404) by the view.
+            return super().dispatch(request, *args, **kwargs)
+
+        today = timezone.localdate()
+        etag = hashlib.md5(repr((
+            version[0],
+            version[1].timestamp(),
+            today,
+            request.user.pk,
+            csrf_secret(request)
+        )).encode()).hexdigest()
+        last_modified = max(
+            version[1],
+            timezone.make_aware(datetime.combine(today, time()))
+        )
+        return condition(
+            etag_func=lambda request, *args, **kwargs: etag,
+            last_modified_func=lambda request, *args, **kwargs: last_modified
+        )(super().dispatch)(request, *args, **kwargs)
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_auto_20190301_1434'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='categoryprice',
+            index=models.Index(condition=models.Q(is_active=True), fields=['category', 'date_from', 'date_until'], name='categoryprice_range_idx'),
+        ),
+    ]
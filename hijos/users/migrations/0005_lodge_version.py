@@ -0,0 +1,24 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lodge',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text="Bumped whenever the lodge's data changes.", verbose_name='version'),
+        ),
+        migrations.AddField(
+            model_name='lodge',
+            name='version_on',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='version on'),
+        ),
+    ]
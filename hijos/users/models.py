@@ -5,6 +5,7 @@ from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinValueValidator
 from django.db import models
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 DEGREE_ENTEREDAPPRENTICE = '1'
@@ -138,6 +139,17 @@ class Lodge(Model):
         blank=True,
         null=True
     )
+    version = models.PositiveIntegerField(
+        _('version'),
+        default=0,
+        editable=False,
+        help_text=_("Bumped whenever the lodge's data changes.")
+    )
+    version_on = models.DateTimeField(
+        _('version on'),
+        default=timezone.now,
+        editable=False
+    )
 
     def __str__(self):
         return str(self.name)
@@ -222,6 +234,14 @@ class CategoryPrice(Model):
         verbose_name_plural = _('prices')
         default_permissions = ('add', 'change', 'delete', 'view')
         ordering = ['-date_until', '-date_from']
+        indexes = [
+            # The price of a category in force during a period.
+            models.Index(
+                fields=['category', 'date_from', 'date_until'],
+                name='categoryprice_range_idx',
+                condition=models.Q(is_active=True)
+            )
+        ]
 
 
 class Affiliation(Model):
@@ -1,4 +1,8 @@
 from hijos.treasure import models as treasure
+from hijos.users import caching, models
+
+# The fields of a user shown in the pages of its lodges.
+LISTED_USER_FIELDS = {'username', 'first_name', 'last_name', 'degree'}
 
 
 def lodge(sender, instance, created, raw, **kwargs):
@@ -8,6 +12,8 @@ def lodge(sender, instance, created, raw, **kwargs):
             created_by=instance.created_by,
             last_modified_by=instance.created_by
         )
+    elif not raw:
+        caching.bump_lodges([instance.pk])
 
 
 def affiliation(sender, instance, created, raw, **kwargs):
@@ -17,3 +23,20 @@ def affiliation(sender, instance, created, raw, **kwargs):
             created_by=instance.created_by,
             last_modified_by=instance.created_by
         )
+    if not raw:
+        caching.bump_lodges([instance.lodge_id])
+
+
+def user(sender, instance, raw, update_fields, **kwargs):
+    # Saves of other fields only (like `last_login`, on every login) change
+    # nothing those pages show.
+    if not raw and (
+        update_fields is None or LISTED_USER_FIELDS & set(update_fields)
+    ):
+        caching.bump_lodges(
+            models.Affiliation.objects.filter(user=instance).values('lodge')
+        )
+
+
+def affiliation_deleted(sender, instance, **kwargs):
+    caching.bump_lodges([instance.lodge_id])
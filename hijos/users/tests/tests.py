@@ -1,5 +1,13 @@
+import re
+import tracemalloc
+from unittest import mock
+
+from common import middleware, routers
+from django.conf import settings
 from django.core import mail
-from django.test import TestCase
+from django.db import connection, router
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
 from django.urls import reverse
 
 from hijos.treasure import models as treasure
@@ -374,7 +382,169 @@ class LodgeTestCase(TestCase):
             "\n\n"
             "Your last 10 movements are:"
             "\n\nDate\tType\t\tAmount\t\tBalance\n\n"
-            "2018-05-18\tInvoice\t\t-300.00\t\t-300.00\n"
             "2018-05-18\tDeposit\t\t200.00\t\t0.00\n"
+            "2018-05-18\tInvoice\t\t-300.00\t\t-300.00\n"
             "2018-05-17\tCharge\t\t-200.00\t\t-200.00\n"
         )
+
+
+class SQLitePragmasTestCase(TestCase):
+    """
+    """
+
+    def test_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(
+                cursor.fetchone()[0],
+                settings.SQLITE_PRAGMAS['busy_timeout']
+            )
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(
+                cursor.fetchone()[0],
+                settings.SQLITE_PRAGMAS['cache_size']
+            )
+            cursor.execute('PRAGMA temp_store')
+            self.assertEqual(cursor.fetchone()[0], 2)  # memory
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """
+    """
+
+    def setUp(self):
+        self.databases = mock.patch.dict(
+            settings.DATABASES,
+            {routers.REPLICA: settings.DATABASES['default']}
+        )
+        self.databases.start()
+        self.addCleanup(self.databases.stop)
+
+    def test_router(self):
+        self.assertEqual(router.db_for_read(models.User), 'default')
+        with routers.reads_from_replica():
+            self.assertEqual(router.db_for_read(models.User), 'replica')
+            self.assertEqual(router.db_for_write(models.User), 'default')
+            with routers.reads_from_primary():
+                self.assertEqual(router.db_for_read(models.User), 'default')
+            self.assertEqual(router.db_for_read(models.User), 'replica')
+        self.assertEqual(router.db_for_read(models.User), 'default')
+
+    def test_middleware(self):
+        databases = []
+
+        def view(request):
+            databases.append(router.db_for_read(models.User))
+            return HttpResponse()
+
+        replica = middleware.ReplicaMiddleware(view)
+        factory = RequestFactory()
+        replica(factory.get('/'))
+        response = replica(factory.post('/'))
+        self.assertEqual(
+            response.cookies['pin_primary']['max-age'],
+            settings.REPLICA_PIN_SECONDS
+        )
+        request = factory.get('/')
+        request.COOKIES['pin_primary'] = '1'
+        replica(request)
+        self.assertEqual(databases, ['replica', 'default', 'default'])
+
+
+class ProfilingMiddlewareTestCase(TestCase):
+    """
+    """
+    fixtures = [
+        'hijos/users/tests/fixtures/users.json'
+    ]
+
+    def setUp(self):
+        self.user1 = models.User.objects.get(username='user1')
+        self.lodge = models.Lodge.objects.get(name='Example')
+
+    def profile(self, view, **settings):
+        def get_response(request):
+            profiling.process_view(request, view, (), {})
+            return view(request)
+
+        with override_settings(**settings):
+            profiling = middleware.ProfilingMiddleware(get_response)
+            return profiling(RequestFactory().get('/'))
+
+    def test_measures(self):
+        def view(request):
+            list(models.User.objects.all())
+            list(models.Lodge.objects.all())
+            return HttpResponse()
+
+        if not tracemalloc.is_tracing():
+            # Tracing slows down the rest of the tests.
+            self.addCleanup(tracemalloc.stop)
+        with self.assertLogs('common.profiling', 'INFO') as logs:
+            response = self.profile(view, PROFILING_MEMORY=True)
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^sql;dur=[\d.]+;desc="2 queries", render;dur=[\d.]+, '
+            r'total;dur=[\d.]+, mem;desc="\d+ KiB peak"$'
+        )
+        record = logs.records[0]
+        self.assertEqual(record.queries, 2)
+        self.assertEqual(record.status, 200)
+        self.assertTrue(record.view.endswith('.view'))
+        self.assertIn('queries=2', record.getMessage())
+
+    def test_budget(self):
+        def view(request):
+            list(models.User.objects.all())
+            list(models.Lodge.objects.all())
+            return HttpResponse()
+
+        with self.assertLogs('common.profiling', 'WARNING') as logs:
+            self.profile(
+                view,
+                PROFILING_QUERY_BUDGET=1,
+                PROFILING_RAISE_OVER_BUDGET=False
+            )
+        self.assertIn('over its budget of 1', logs.output[0])
+
+        with self.assertRaises(middleware.QueryBudgetExceeded):
+            self.profile(
+                view,
+                PROFILING_QUERY_BUDGET=1,
+                PROFILING_RAISE_OVER_BUDGET=True
+            )
+
+        # The budget of the view wins.
+        view.query_budget = 2
+        self.profile(
+            view,
+            PROFILING_QUERY_BUDGET=1,
+            PROFILING_RAISE_OVER_BUDGET=True
+        )
+
+    def test_lodge_detail(self):
+        self.client.force_login(user=self.user1)
+        url_detail = reverse('users:lodge-detail', args=[self.lodge.pk])
+        with override_settings(
+            MIDDLEWARE=['common.middleware.ProfilingMiddleware'] +
+            settings.MIDDLEWARE
+        ):
+            response = self.client.get(url_detail)
+            self.assertIn('render;dur=', response['Server-Timing'])
+            queries = int(re.search(
+                r'(\d+) queries', response['Server-Timing']
+            ).group(1))
+
+            for i in range(10):
+                models.Affiliation.objects.create(
+                    lodge=self.lodge,
+                    user=models.User.objects.create(username='member%d' % i),
+                    category=models.Category.objects.first(),
+                    created_by=self.user1,
+                    last_modified_by=self.user1
+                )
+            # Affiliations are listed with a single query.
+            response = self.client.get(url_detail)
+            self.assertIn(
+                '"%d queries"' % queries, response['Server-Timing']
+            )
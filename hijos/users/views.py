@@ -1,10 +1,11 @@
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.shortcuts import get_object_or_404
 from django.views import View
 from django.views.generic import CreateView, DetailView, ListView
 
 from hijos.treasure import forms
-from hijos.users import models
+from hijos.users import caching, models
 
 
 class UserDetailView(LoginRequiredMixin, DetailView):
@@ -51,8 +52,16 @@ class LodgesList(LoginRequiredMixin, ListView):
     def get_queryset(self):
         return models.Lodge.objects.filter(is_active=True)
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['cache_key'] = caching.lodges_key()
+        context['cache_timeout'] = settings.LODGE_CACHE_TIMEOUT
+        return context
 
-class LodgeDisplayView(LoginRequiredMixin, DetailView):
+
+class LodgeDisplayView(
+    LoginRequiredMixin, caching.LodgeConditionalMixin, DetailView
+):
     model = models.Lodge
     template_name = 'users/lodge_detail.html'
     context_object_name = 'lodge'
@@ -60,6 +69,12 @@ class LodgeDisplayView(LoginRequiredMixin, DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['form'] = forms.SendAccountBalanceForm()
+        # Only read if the cached fragment listing them is stale.
+        context['affiliations'] = self.object.affiliations.select_related(
+            'user', 'lodge'
+        )
+        context['cache_key'] = caching.lodge_key(self.object)
+        context['cache_timeout'] = settings.LODGE_CACHE_TIMEOUT
         return context
 
 
@@ -74,7 +89,9 @@ class LodgeDetailView(View):
         return view(request, *args, **kwargs)
 
 
-class AffiliationsByLodgeList(LoginRequiredMixin, ListView):
+class AffiliationsByLodgeList(
+    LoginRequiredMixin, caching.LodgeConditionalMixin, ListView
+):
     template_name = 'users/affiliation_list.html'
     context_object_name = 'affiliations'
 
@@ -82,11 +99,15 @@ class AffiliationsByLodgeList(LoginRequiredMixin, ListView):
         self.lodge = get_object_or_404(
             models.Lodge, pk=self.kwargs['pk']
         )
-        return models.Affiliation.objects.filter(lodge=self.lodge)
+        return models.Affiliation.objects.filter(
+            lodge=self.lodge
+        ).select_related('user', 'lodge')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['lodge'] = self.lodge
+        context['cache_key'] = caching.lodge_key(self.lodge)
+        context['cache_timeout'] = settings.LODGE_CACHE_TIMEOUT
         return context
 
 